@@ -145,6 +145,7 @@ void setup()
 void initiateMotorChange(
     uint8_t registerValue,
     MotorState &motorState,
+    uint8_t &state,
     unsigned long &actionStart,
     const int pwmChannel)
 {
@@ -152,14 +153,14 @@ void initiateMotorChange(
   {
     motorState = UP_REQUESTED;
     actionStart = millis();
-    headState = MOTOR_UP_REQUESTED;
+    state = MOTOR_UP_REQUESTED;
     ledcWrite(pwmChannel, 255);
   }
   else if (registerValue == MOTOR_DOWN_REQUESTED && motorState == UP)
   {
     motorState = DOWN_REQUESTED;
     actionStart = millis();
-    headState = MOTOR_DOWN_REQUESTED;
+    state = MOTOR_DOWN_REQUESTED;
     ledcWrite(pwmChannel, 0);
   }
 }
@@ -192,13 +193,13 @@ void receiveEvent(int numBytes)
     }
     break;
   case HEAD_REG:
-    initiateMotorChange(registerValue, headMotorState, actionStartTimeHead, headPwmChannel);
+    initiateMotorChange(registerValue, headMotorState, headState, actionStartTimeHead, headPwmChannel);
     break;
   case TAIL_REG:
-    initiateMotorChange(registerValue, tailMotorState, actionStartTimeTail, tailPwmChannel);
+    initiateMotorChange(registerValue, tailMotorState, tailState, actionStartTimeTail, tailPwmChannel);
     break;
   case MOUTH_REG:
-    initiateMotorChange(registerValue, mouthMotorState, actionStartTimeMouth, mouthPwmChannel);
+    initiateMotorChange(registerValue, mouthMotorState, mouthState, actionStartTimeMouth, mouthPwmChannel);
     break;
   default:
     break;
@@ -230,6 +231,13 @@ void requestEvent()
     Serial.println(headState, HEX);
     Wire.write(headState);
     break;
+  case ALL_STATUS:
+  {
+    uint8_t statuses[] = {controlledExternally, mouthState, tailState, headState};
+    Serial.println("ALL");
+    Wire.write(statuses, sizeof(statuses));
+    break;
+  }
 
   default:
     break;
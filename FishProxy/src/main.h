@@ -11,6 +11,8 @@
 #define CONTROL_STATUS 0x51
 #define TAIL_STATUS 0x52
 #define HEAD_STATUS 0x53
+// control, mouth, tail and head statuses in one read
+#define ALL_STATUS 0x54
 
 // register values
 #define MOTOR_IDLE 0x00
@@ -76,6 +78,7 @@ void handleMotorStates(
 void initiateMotorChange(
     uint8_t registerValue,
     MotorState &motorState,
+    uint8_t &state,
     unsigned long &actionStart,
     const int pwmChannel);
 #endif
@@ -4,16 +4,21 @@ import uuid
 import cv2
 import numpy as np
 import face_recognition
-from picamera2 import Picamera2
 import time
 import json
 from enum import Enum
 
 from pydantic import ValidationError
+from models.store import PlayerStore
 
 from models.history import *
 from models.profile import *
 from models.responses import *
+from .frame_sources import FrameSource, PicameraFrameSource
+from .motion_gate import MotionGate
+from .model_runtime import ModelRuntime, OpenCVRuntime, age_blob, face_blob
+from .classifier_ipc import AGE_BUCKETS, ClassifierEvent, ClassifierEventType, SharedFrame
+from .stage_timings import NullStageTimings, StageTimings
 
 
 class AgeClassifierStates(Enum):
@@ -22,51 +27,67 @@ class AgeClassifierStates(Enum):
 class AgeClassifier:
     def __init__(self, queue, face_model_path: str, face_proto_path: str,
                  age_model_path: str, age_proto_path: str,
-                 json_path: str = 'RiddleClient/recognized_faces.json',
+                 store_path: str = 'RiddleClient/fish.db',
                  frame_width: int = 320, frame_height: int = 240,
-                 process_interval: int = 5, timeout_duration: int = 10):
+                 process_interval: int = 5, timeout_duration: int = 10,
+                 frame_source: FrameSource = None, frame_delay: float = 0.5,
+                 timings: StageTimings = None, motion_gate: MotionGate = None,
+                 face_net: ModelRuntime = None, age_net: ModelRuntime = None,
+                 shared_frame: SharedFrame = None):
         """
         Initializes the class responsible for processing video frames and performing face detection and age classification.
 
         Args:
-            queue : A queue for communication between processes.
+            queue : A queue for communication between processes. Anything with a `put()` method accepting ClassifierEvent works as a sink.
             face_model_path (str): Path to the pre-trained model file for face detection.
             face_proto_path (str): Path to the protocol buffer file for face detection architecture.
             age_model_path (str): Path to the pre-trained model file for age classification.
             age_proto_path (str): Path to the protocol buffer file for age classification architecture.
-            json_path (str, optional): Path to the JSON file where recognized faces are stored. Default is 'recognized_faces.json'.
+            store_path (str, optional): Path to the player store where recognized faces are kept. Default is 'RiddleClient/fish.db'.
             frame_width (int, optional): The width of the video frames to process. Default is 320 pixels.
             frame_height (int, optional): The height of the video frames to process. Default is 240 pixels.
             process_interval (int, optional): The number of frames to skip between processing steps to optimize performance. Default is 5.
             timeout_duration (int, optional): Timeout duration in seconds before the process consider person leaving the camera zone. Default is 10 seconds.
+            frame_source (FrameSource, optional): Where frames come from. Default is the Raspberry PI camera.
+            frame_delay (float, optional): Pause in seconds after each processed frame. Default is 0.5 seconds.
+            timings (StageTimings, optional): Collects per-stage latencies, used by the benchmark. Default is not collecting anything.
+            motion_gate (MotionGate, optional): Skips face detection while nothing moves in front of the camera. Default is detecting on every processed frame.
+            face_net (ModelRuntime, optional): Runtime for the face detector. Default is the Caffe model through cv2.dnn.
+            age_net (ModelRuntime, optional): Runtime for the age net. Default is the Caffe model through cv2.dnn.
+            shared_frame (SharedFrame, optional): Every processed frame is published there for other processes. Default is not sharing frames.
         """
         self.queue = queue
         # Load the age categories
-        self.AGE_BUCKETS = ['(0-2)', '(4-6)', '(8-12)', '(15-20)',
-                            '(25-32)', '(38-43)', '(48-53)', '(60-100)']
+        self.AGE_BUCKETS = AGE_BUCKETS
 
         # Load the models
-        self.face_net = cv2.dnn.readNetFromCaffe(
-            face_proto_path, face_model_path)
-        self.age_net = cv2.dnn.readNetFromCaffe(age_proto_path, age_model_path)
+        self.face_net = face_net or OpenCVRuntime(face_proto_path, face_model_path)
+        self.age_net = age_net or OpenCVRuntime(age_proto_path, age_model_path)
 
-        # Initialize picamera2
-        self.picam2 = Picamera2()
-        config = self.picam2.create_preview_configuration(
-            main={"format": 'RGB888', "size": (frame_width, frame_height)})
-        self.picam2.configure(config)
-        self.picam2.start()
+        # Initialize picamera2 unless frames come from somewhere else
+        if frame_source is None:
+            frame_source = PicameraFrameSource(frame_width, frame_height)
+        self.frame_source = frame_source
 
         # Frame processing variables
         self.process_interval = process_interval
+        self.frame_delay = frame_delay
         self.frame_count = 0
+        self.timings = timings if timings is not None else NullStageTimings()
+        self.motion_gate = motion_gate
+        self.shared_frame = shared_frame
+        # whether the last face detector run found anybody
+        self.face_present = False
+        # RGB copy of the frame for face_recognition, reused between frames
+        self.rgb_frame = None
 
         # For checking if it's the same person
         # Adjust as needed for stricter/looser matching
         self.face_similarity_threshold = 0.6
 
         # Path for saving recognized data
-        self.json_path = json_path
+        self.store_path = store_path
+        self.store = None
 
         self.timeout_duration = timeout_duration
 
@@ -85,15 +106,9 @@ class AgeClassifier:
         signal.signal(signal.SIGINT, handle_sigterm)
 
     def process_new_person(self, face, confidence, current_face_encoding):
-        # Prepare the face ROI for age estimation
-        face_blob = cv2.dnn.blobFromImage(face, 1.0, (227, 227),
-                                        (78.4263377603, 87.7689143744,
-                                        114.895847746),
-                                        swapRB=False)
-
         # Predict the age
-        self.age_net.setInput(face_blob)
-        age_preds = self.age_net.forward()
+        with self.timings.measure("age"):
+            age_preds = self.age_net.forward(age_blob(face))
         age_index = age_preds[0].argmax()
         age = self.AGE_BUCKETS[age_index]
         age_confidence = age_preds[0][age_index]
@@ -108,15 +123,108 @@ class AgeClassifier:
                 flag_new=True,
             )
             self.save(player_profile)
-            self.queue.put(player_profile.model_dump())
+            self.queue.put(ClassifierEvent(
+                type=ClassifierEventType.PLAYER,
+                id=player_profile.id,
+                age_index=int(age_index),
+                confidence=float(confidence),
+                flag_new=True,
+            ))
         else:
             print(f"not enough confidence to process user yet")
 
+    def detect_faces(self, frame):
+        """Runs the SSD face detector, returns list of (confidence, (startX, startY, endX, endY))."""
+        h, w = frame.shape[:2]
+        detections = self.face_net.forward(face_blob(frame))
+
+        faces = []
+        for i in range(detections.shape[2]):
+            confidence = detections[0, 0, i, 2]
+            if confidence > 0.6:  # Confidence threshold for face detection
+                # Get face coordinates
+                box = detections[0, 0, i, 3:7] * np.array([w, h, w, h])
+                faces.append((confidence, tuple(box.astype("int"))))
+        return faces
+
+    def encode_faces(self, frame, faces):
+        """
+        Encodes all detected faces of the frame in one face_recognition call.
+
+        The SSD boxes are handed over as known locations, so the HOG detector
+        does not run again, and the frame is converted to RGB once into a
+        reused buffer. Returns list of (confidence, BGR face crop, encoding).
+        """
+        h, w = frame.shape[:2]
+        crops = []
+        locations = []
+        for confidence, (startX, startY, endX, endY) in faces:
+            startX, startY = max(startX, 0), max(startY, 0)
+            endX, endY = min(endX, w), min(endY, h)
+
+            # Check if face ROI is valid
+            if endX <= startX or endY <= startY:
+                continue
+
+            crops.append((confidence, frame[startY:endY, startX:endX]))
+            # face_recognition wants (top, right, bottom, left)
+            locations.append((startY, endX, endY, startX))
+
+        if not locations:
+            return []
+
+        # Convert frame to RGB (required for face_recognition)
+        if self.rgb_frame is None or self.rgb_frame.shape != frame.shape:
+            self.rgb_frame = np.empty_like(frame)
+        cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=self.rgb_frame)
+
+        encodings = face_recognition.face_encodings(
+            self.rgb_frame, known_face_locations=locations)
+
+        return [(confidence, face, encoding)
+                for (confidence, face), encoding in zip(crops, encodings)]
+
+    def identify(self, face, confidence, current_face_encoding) -> bool:
+        """
+        Matches encoding against known faces and notifies the queue.
+        Returns True if the rest of the faces in the frame should be skipped.
+        """
+        # no data saved yet, recognize new person
+        if len(self.data.root) == 0:
+            print("Nothing in the registry yet - assuming it's new person")
+            self.process_new_person(face, confidence, current_face_encoding)
+            return False
+
+        with self.timings.measure("match"):
+            matches = face_recognition.compare_faces(
+                [i.encoding for i in self.data.root],
+                current_face_encoding,
+                self.face_similarity_threshold)
+
+        # if match - send old information
+        if any(matches):
+            previousPerson = self.data.root[matches.index(True)]
+            print(f"same person detected: {previousPerson.id}")
+            self.queue.put(ClassifierEvent(
+                type=ClassifierEventType.PLAYER,
+                id=previousPerson.id,
+                age_index=self.AGE_BUCKETS.index(previousPerson.age),
+                confidence=previousPerson.confidence,
+                flag_new=False,
+            ))
+            return False
+
+        print("New person detected")
+        self.process_new_person(face, confidence, current_face_encoding)
+        return True
+
     def classify(self):
+        self.frame_source.start()
         try:
             while not self.exiting:
                 # Capture frame-by-frame
-                frame = self.picam2.capture_array()
+                with self.timings.measure("capture"):
+                    frame = self.frame_source.read()
                 if frame is None:
                     print("Can't receive frame (stream end?). Exiting ...")
                     break
@@ -125,90 +233,57 @@ class AgeClassifier:
                 if self.frame_count % self.process_interval != 0:
                     continue  # Skip this frame
 
-                # Prepare the frame for face detection
-                h, w = frame.shape[:2]
-                blob = cv2.dnn.blobFromImage(cv2.resize(frame, (300, 300)),
-                                             1.0, (300, 300), (104.0, 177.0, 123.0))
-
-                # Detect faces
-                self.face_net.setInput(blob)
-                detections = self.face_net.forward()
-
-                face_detected = False
-                for i in range(detections.shape[2]):
-                    confidence = detections[0, 0, i, 2]
-                    if confidence > 0.6:  # Confidence threshold for face detection
-                        face_detected = True
-                        self.last_detection_time = time.time()
-                        # Get face coordinates
-                        box = detections[0, 0, i, 3:7] * np.array([w, h, w, h])
-                        (startX, startY, endX, endY) = box.astype("int")
-                        face = frame[startY:endY, startX:endX]
-
-                        # Check if face ROI is valid
-                        if face.size == 0:
-                            continue
-
-                        # Convert face to RGB (required for face_recognition)
-                        rgb_face = cv2.cvtColor(face, cv2.COLOR_BGR2RGB)
-
-                        # Get face encoding
-                        current_face_encodings = face_recognition.face_encodings(
-                            rgb_face)
-                        if current_face_encodings:
-                            current_face_encoding = current_face_encodings[0]
-
-                            # no data saved yet, recognize new person
-                            if len(self.data.root) == 0:
-                                print("Nothing in the registry yet - assuming it's new person")
-                                self.process_new_person(face, confidence, current_face_encoding)
-                            elif len(self.data.root) > 0:
-                                matches = face_recognition.compare_faces(
-                                    [i.encoding for i in self.data.root],
-                                    current_face_encoding,
-                                    self.face_similarity_threshold)
-                                # if match - send old information
-                                if any(matches):
-                                    previousPerson = self.data.root[matches.index(
-                                        True)]
-                                    profile = UserProfile(
-                                        id=previousPerson.id,
-                                        age=previousPerson.age,
-                                        confidence=previousPerson.confidence,
-                                        flag_new=False,
-                                        encoding=current_face_encoding,
-                                    )
-                                    print(f"same person detected: {previousPerson.id}")
-                                    self.queue.put(profile.model_dump())
-                                else:
-                                    print("New person detected")
-                                    self.process_new_person(face, confidence, current_face_encoding)
-                                    break
+                frame_start = time.perf_counter()
+
+                if self.shared_frame is not None:
+                    self.shared_frame.publish(frame)
+
+                # Detect faces, unless the hall is empty and nothing moved
+                faces = []
+                with self.timings.measure("gate"):
+                    run_detector = self.motion_gate is None or \
+                        self.motion_gate.should_detect(frame, self.face_present)
+                if run_detector:
+                    with self.timings.measure("detect"):
+                        faces = self.detect_faces(frame)
+                    self.face_present = len(faces) > 0
+
+                face_detected = len(faces) > 0
+                if face_detected:
+                    self.last_detection_time = time.time()
+
+                    with self.timings.measure("encode"):
+                        encoded = self.encode_faces(frame, faces)
+
+                    for confidence, face, current_face_encoding in encoded:
+                        if self.identify(face, confidence, current_face_encoding):
+                            break
+
+                self.timings.record("frame", time.perf_counter() - frame_start)
 
                 # Check if the timeout duration has been reached without detecting a face
                 if not face_detected and (time.time() - self.last_detection_time) > self.timeout_duration:
-                    self.queue.put(
-                        {'state': AgeClassifierStates.NO_FACE_DETECTED})
+                    self.queue.put(ClassifierEvent(
+                        type=ClassifierEventType.NO_FACE_DETECTED))
                     self.last_detection_time = time.time()
 
-                time.sleep(0.5)
+                if self.frame_delay > 0:
+                    time.sleep(self.frame_delay)
         finally:
             # Release resources
-            self.picam2.stop()
+            self.frame_source.stop()
 
     def save(self, profile: UserProfile):
-        """Save user profile to JSON"""
+        """Save user profile to the player store, only the new row is written"""
 
         self.data.root.append(profile)
-
-        with open(self.json_path, 'w') as f:
-            f.write(self.data.model_dump_json(indent=4, exclude={'flag_new'}))
+        self.store.add_face(profile)
 
     def load(self) -> UserProfiles:
+        # opened here, the classifier runs in its own process with its own connection
+        self.store = PlayerStore(self.store_path)
         try:
-            with open(self.json_path, 'r') as f:
-                data = f.read()
-            return UserProfiles.model_validate_json(data)
-        except (FileNotFoundError, ValidationError):
-            print("UserProfiles does not exists or corrupted, initializing empty.")
+            return UserProfiles(root=self.store.faces())
+        except ValidationError:
+            print("UserProfiles corrupted, initializing empty.")
             return UserProfiles(root=[])
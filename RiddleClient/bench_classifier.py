@@ -0,0 +1,163 @@
+"""
+Offline benchmark for AgeClassifier.
+
+Replays recorded footage (video files, directories of images or the synthetic
+generator) through `AgeClassifier.classify` and reports per-stage latency
+percentiles, FPS and identification accuracy. Does not need the Raspberry PI:
+
+    python -m RiddleClient.bench_classifier footage/alice.mp4 footage/bob/ \
+        --labels footage/labels.json
+
+labels.json maps the file or directory name of each source to a person label,
+e.g. {"alice.mp4": "alice", "bob": "bob"}. Sources without a label are still
+timed, but don't count towards accuracy.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from typing import Dict, List, Tuple
+
+from .age_classifier import AgeClassifier
+from .classifier_ipc import ClassifierEventType
+from .frame_sources import open_frame_source
+from .motion_gate import MotionGate
+from .model_runtime import runtime_from_env
+from .stage_timings import StageTimings
+
+MODELS_DIR = 'RiddleClient/.opencv_models'
+
+
+class ListSink:
+    """Queue stand-in which just remembers everything the classifier sends."""
+
+    def __init__(self):
+        self.events = []
+
+    def put(self, item):
+        self.events.append(item)
+
+    def drain(self) -> List:
+        events, self.events = self.events, []
+        return events
+
+
+def identification_accuracy(results: List[Tuple[str, List[str]]], labels: Dict[str, str]) -> Tuple[float, int]:
+    """
+    Every label should always map to the same player ID and no ID should be
+    shared by two labels. Returns the share of identifications which follow
+    that rule and the number of identifications checked.
+    """
+    label_to_id = {}
+    id_to_label = {}
+    correct = 0
+    total = 0
+
+    for source, ids in results:
+        label = labels.get(os.path.basename(os.path.normpath(source)))
+        if label is None:
+            continue
+
+        for player_id in ids:
+            total += 1
+            expected_id = label_to_id.setdefault(label, player_id)
+            owner = id_to_label.setdefault(player_id, label)
+            if player_id == expected_id and owner == label:
+                correct += 1
+
+    return (correct / total if total else 0.0), total
+
+
+def run(args) -> int:
+    labels = {}
+    if args.labels:
+        with open(args.labels, 'r') as f:
+            labels = json.load(f)
+
+    faces_db = args.faces_db
+    if faces_db is None:
+        faces_db = os.path.join(tempfile.mkdtemp(), 'fish.db')
+
+    face_model_path = os.path.join(args.models_dir, 'res10_300x300_ssd_iter_140000_fp16.caffemodel')
+    face_proto_path = os.path.join(args.models_dir, 'deploy.prototxt')
+    age_model_path = os.path.join(args.models_dir, 'age_net.caffemodel')
+    age_proto_path = os.path.join(args.models_dir, 'age_deploy.prototxt')
+
+    sink = ListSink()
+    timings = StageTimings()
+    classifier = AgeClassifier(
+        queue=sink,
+        face_model_path=face_model_path,
+        face_proto_path=face_proto_path,
+        age_model_path=age_model_path,
+        age_proto_path=age_proto_path,
+        store_path=faces_db,
+        frame_width=args.frame_width,
+        frame_height=args.frame_height,
+        process_interval=args.process_interval,
+        timeout_duration=args.timeout_duration,
+        frame_source=open_frame_source(
+            args.sources[0], args.frame_width, args.frame_height),
+        frame_delay=args.frame_delay,
+        timings=timings,
+        motion_gate=MotionGate() if args.motion_gate else None,
+        face_net=runtime_from_env('FACE_NET', face_proto_path, face_model_path),
+        age_net=runtime_from_env('AGE_NET', age_proto_path, age_model_path),
+    )
+
+    results = []
+    started = time.perf_counter()
+    for source in args.sources:
+        classifier.frame_source = open_frame_source(
+            source, args.frame_width, args.frame_height)
+        classifier.last_detection_time = time.time()
+        classifier.classify()
+
+        ids = [str(e.id) for e in sink.drain() if e.type == ClassifierEventType.PLAYER]
+        results.append((source, ids))
+        print(f"{source}: {len(ids)} identifications, {len(set(ids))} distinct players")
+    elapsed = time.perf_counter() - started
+
+    print()
+    print(timings.report())
+    print()
+    print(f"frames read:      {timings.count('capture')}")
+    print(f"frames processed: {timings.count('frame')}")
+    print(f"detector runs:    {timings.count('detect')}")
+    print(f"elapsed:          {elapsed:.2f} s")
+    if elapsed > 0:
+        print(f"capture FPS:      {timings.count('capture') / elapsed:.2f}")
+        print(f"processed FPS:    {timings.count('frame') / elapsed:.2f}")
+
+    if labels:
+        accuracy, total = identification_accuracy(results, labels)
+        print(f"identification accuracy: {accuracy:.3f} over {total} identifications")
+
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Replay footage through AgeClassifier and measure it")
+    parser.add_argument('sources', nargs='+',
+                        help="video files, directories of images or 'synthetic'")
+    parser.add_argument('--labels', help="JSON file mapping source name to person label")
+    parser.add_argument('--faces-db', default=None,
+                        help="start from the faces in this player store instead of an empty one")
+    parser.add_argument('--models-dir', default=MODELS_DIR)
+    parser.add_argument('--frame-width', type=int, default=320)
+    parser.add_argument('--frame-height', type=int, default=240)
+    parser.add_argument('--process-interval', type=int, default=5)
+    parser.add_argument('--timeout-duration', type=int, default=5)
+    parser.add_argument('--frame-delay', type=float, default=0.0,
+                        help="pause after each processed frame, the Pi uses 0.5")
+    parser.add_argument('--motion-gate', action='store_true',
+                        help="only run the face detector when something moves")
+    args = parser.parse_args()
+
+    raise SystemExit(run(args))
+
+
+if __name__ == "__main__":
+    main()
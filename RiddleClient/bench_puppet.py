@@ -0,0 +1,111 @@
+"""
+Benchmark for FishController without the fish.
+
+Runs FishController against FishProxySimulator and measures latency of puppet
+commands from sending to completion, throughput and how much bus traffic the
+status polling costs:
+
+    python -m RiddleClient.bench_puppet --commands 200 --time-scale 0.1
+"""
+import argparse
+import threading
+import time
+from multiprocessing import Pipe
+
+from .consts import CONTROL_UNDER_CONTROL
+from .fishcontroller import FishController, FishControllerStatuses
+from .fishproxy_sim import FishProxySimulator
+from .stage_timings import StageTimings
+
+# mouth flapping with the odd head/tail move, like a fish talking
+SCRIPT = ["mouth_open", "mouth_close", "mouth_open", "mouth_close",
+          "tail_up", "tail_down", "mouth_open", "mouth_close",
+          "head_up", "mouth_open", "mouth_close", "head_down"]
+
+
+def run(args) -> int:
+    bus = FishProxySimulator(
+        time_scale=args.time_scale,
+        transaction_time=args.transaction_time,
+        read_error_rate=args.read_error_rate,
+        seed=0,
+    )
+    parent, child = Pipe()
+    controller = FishController(pipe=child, bus=bus,
+                                poll_interval=args.poll_interval,
+                                initial_poll_interval=args.initial_poll_interval,
+                                poll_backoff=args.poll_backoff,
+                                bulk_status=not args.no_bulk)
+    worker = threading.Thread(target=controller.process, daemon=True)
+    worker.start()
+
+    # don't count the bus cleanup and control handshake
+    while bus.control != CONTROL_UNDER_CONTROL:
+        time.sleep(0.01)
+
+    timings = StageTimings()
+    sent = {}
+    actions = [SCRIPT[i % len(SCRIPT)] for i in range(args.commands)]
+
+    def receive():
+        status, cmd_id = parent.recv()
+        if status == FishControllerStatuses.ACTION_TIMED_OUT:
+            timings.record("timed_out", 0.0)
+        if cmd_id in sent:
+            action, started = sent.pop(cmd_id)
+            timings.record(action, time.perf_counter() - started)
+            timings.record("all", time.perf_counter() - started)
+
+    reads_before = bus.reads
+    started = time.perf_counter()
+    for cmd_id, action in enumerate(actions, start=1):
+        sent[cmd_id] = (action, time.perf_counter())
+        parent.send((cmd_id, action, ()))
+        if not args.pipelined:
+            while cmd_id in sent:
+                receive()
+    while sent:
+        receive()
+    elapsed = time.perf_counter() - started
+    reads = bus.reads - reads_before
+
+    controller.exiting = True
+    worker.join(timeout=5)
+
+    print(timings.report())
+    print()
+    print(f"commands:        {args.commands} ({'pipelined' if args.pipelined else 'one at a time'})")
+    print(f"elapsed:         {elapsed:.2f} s")
+    print(f"throughput:      {args.commands / elapsed:.1f} commands/s")
+    print(f"status reads:    {reads} ({reads / args.commands:.1f} per command)")
+    print(f"bus errors:      {bus.errors}")
+    print(f"timed out:       {timings.count('timed_out')}")
+    print()
+    print(controller.latency_report())
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure FishController against a simulated Fish Proxy")
+    parser.add_argument('--commands', type=int, default=120)
+    parser.add_argument('--pipelined', action='store_true',
+                        help="send everything at once instead of waiting for each command")
+    parser.add_argument('--time-scale', type=float, default=1.0,
+                        help="multiplier for the firmware motor timings")
+    parser.add_argument('--transaction-time', type=float, default=0.0005,
+                        help="seconds per I2C transaction")
+    parser.add_argument('--read-error-rate', type=float, default=0.0)
+    parser.add_argument('--poll-interval', type=float, default=0.05,
+                        help="longest pause between status polls")
+    parser.add_argument('--initial-poll-interval', type=float, default=0.005)
+    parser.add_argument('--poll-backoff', type=float, default=1.5)
+    parser.add_argument('--no-bulk', action='store_true',
+                        help="read status registers one by one")
+    args = parser.parse_args()
+
+    raise SystemExit(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Micro-benchmark for the Socket.IO payloads of the client/server events.
+
+Encodes and decodes each event the way it goes over the websocket, as the
+JSON models older clients send (base64 audio inside) and as models.wire
+payloads with the audio as binary attachments, and reports the time per event
+and the bytes on the wire:
+
+    python -m RiddleClient.bench_wire --repeat 200
+"""
+import argparse
+import os
+import uuid
+
+from socketio import packet
+
+from models.profile import NewPlayer, OldPlayer
+from models.responses import PlayerVoiceChunk, PlayerVoiceStream, ResponseContinue, ResponseRetry
+from models.wire import msgpack, pack, unpack, with_binary
+from .stage_timings import StageTimings
+
+
+def sample_events(recording_seconds: float):
+    # 16 kHz mono 16 bit, what the client uploads since the codec stage
+    recording = os.urandom(int(recording_seconds * 16000) * 2)
+    chunk = os.urandom(4000 * 2)
+    player = OldPlayer(id=uuid.uuid4(), age="(25-32)", confidence=0.93, lang="en", voice="fish.wav")
+    new_player = with_binary(NewPlayer, id=player.id, age=player.age,
+                             confidence=player.confidence, recording=recording)
+
+    return {
+        "greet_new_player": new_player,
+        "give_answer_on_riddle": with_binary(PlayerVoiceChunk, player=player, recording=recording,
+                                             codec="pcm_s16le", sample_rate=16000),
+        "answer_chunk": with_binary(PlayerVoiceStream, player=player, seq=3, codec="pcm_s16le",
+                                    sample_rate=16000, recording=chunk),
+        "retry_greeting": ResponseRetry(player=new_player),
+        "say": ResponseContinue(player=player, total_riddles_correct=2, answer_correct=True,
+                                transcription="What has roots that nobody sees and is taller than trees?",
+                                wav_location="http://localhost:7851/audio/riddle.wav"),
+    }
+
+
+def encode(event: str, payload):
+    encoded = packet.Packet(packet.EVENT, data=[event, payload]).encode()
+    return encoded if isinstance(encoded, list) else [encoded]
+
+
+def decode(encoded):
+    pkt = packet.Packet(encoded_packet=encoded[0])
+    for attachment in encoded[1:]:
+        pkt.add_attachment(attachment)
+    return pkt.data[1]
+
+
+def size(encoded) -> int:
+    return sum(len(part.encode() if isinstance(part, str) else part) for part in encoded)
+
+
+def run(args) -> int:
+    formats = {
+        "json-model": lambda model: model.model_dump_json(),
+        "wire-json": lambda model: pack(model),
+    }
+    if msgpack is not None:
+        formats["wire-msgpack"] = lambda model: pack(model, metadata="msgpack")
+
+    events = sample_events(args.recording_seconds)
+    timings = StageTimings()
+    sizes = {}
+
+    for event, model in events.items():
+        for name, to_payload in formats.items():
+            stage = f"{event}/{name}"
+            for _ in range(args.repeat):
+                with timings.measure(f"{stage}/enc"):
+                    encoded = encode(event, to_payload(model))
+                with timings.measure(f"{stage}/dec"):
+                    decoded = unpack(type(model), decode(encoded))
+            assert decoded == model, f"{stage} doesn't round trip"
+            sizes[stage] = size(encoded)
+
+    print(f"{'event/format':<36} {'bytes':>9} {'enc p50 ms':>11} {'dec p50 ms':>11}")
+    for stage, nbytes in sizes.items():
+        enc = timings.percentiles(f"{stage}/enc", (50,))[50]
+        dec = timings.percentiles(f"{stage}/dec", (50,))[50]
+        print(f"{stage:<36} {nbytes:>9} {enc:>11.3f} {dec:>11.3f}")
+    if msgpack is None:
+        print("\nmsgpack isn't installed, wire-msgpack skipped")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure encode/decode time and size of the Socket.IO event payloads")
+    parser.add_argument('--repeat', type=int, default=100)
+    parser.add_argument('--recording-seconds', type=float, default=5.0,
+                        help="length of the recordings in greet_new_player and give_answer_on_riddle")
+    args = parser.parse_args()
+
+    raise SystemExit(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+from typing import Iterable, List, Tuple
+
+# (motor, position): controller action
+MOVES = {
+    ("head", "up"): "head_up",
+    ("head", "down"): "head_down",
+    ("tail", "up"): "tail_up",
+    ("tail", "down"): "tail_down",
+    ("mouth", "open"): "mouth_open",
+    ("mouth", "close"): "mouth_close",
+}
+
+# what FishController receives: (seconds since start, action), sorted by time
+CompiledTimeline = List[Tuple[float, str]]
+
+
+def compile_timeline(events: Iterable[Tuple[float, str, str]]) -> CompiledTimeline:
+    """
+    Turns (t_offset, motor, position) events into the form sent to the
+    controller process in one message.
+
+    Raises:
+        ValueError: on unknown motor/position or negative offsets.
+    """
+    compiled = []
+    for offset, motor, position in events:
+        if offset < 0:
+            raise ValueError(f"Timeline offset can't be negative: {offset}")
+        action = MOVES.get((motor, position))
+        if action is None:
+            raise ValueError(f"Unknown move '{position}' for motor '{motor}'")
+        compiled.append((float(offset), action))
+
+    # stable, so events at the same time keep their order
+    compiled.sort(key=lambda e: e[0])
+    return compiled
+
+
+def flap_fin_timeline(count: int = 5, interval: float = 0.5) -> CompiledTimeline:
+    events = []
+    for i in range(count):
+        events.append((i * interval, "tail", "up"))
+        events.append((i * interval + interval / 2, "tail", "down"))
+    return compile_timeline(events)
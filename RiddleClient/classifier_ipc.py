@@ -0,0 +1,132 @@
+import asyncio
+import struct
+from enum import IntEnum
+from multiprocessing import shared_memory
+from typing import NamedTuple, Optional
+from uuid import UUID
+
+import numpy as np
+
+AGE_BUCKETS = ['(0-2)', '(4-6)', '(8-12)', '(15-20)',
+               '(25-32)', '(38-43)', '(48-53)', '(60-100)']
+
+
+class ClassifierEventType(IntEnum):
+    PLAYER = 0x01
+    # same value as AgeClassifierStates.NO_FACE_DETECTED
+    NO_FACE_DETECTED = 0x30
+
+
+class ClassifierEvent(NamedTuple):
+    """What AgeClassifier tells the Riddle Client, without the face encoding."""
+    type: ClassifierEventType
+    id: Optional[UUID] = None
+    age_index: int = 0
+    confidence: float = 0.0
+    flag_new: bool = False
+
+    @property
+    def age(self) -> str:
+        return AGE_BUCKETS[self.age_index]
+
+
+# event type, flag_new, UUID bytes, age bucket index, confidence
+RECORD = struct.Struct('<B?16sBf')
+NO_UUID = bytes(16)
+
+
+def encode_event(event: ClassifierEvent) -> bytes:
+    return RECORD.pack(event.type, event.flag_new,
+                       event.id.bytes if event.id is not None else NO_UUID,
+                       event.age_index, event.confidence)
+
+
+def decode_event(record: bytes) -> ClassifierEvent:
+    type, flag_new, id, age_index, confidence = RECORD.unpack(record)
+    return ClassifierEvent(
+        type=ClassifierEventType(type),
+        id=UUID(bytes=id) if id != NO_UUID else None,
+        age_index=age_index,
+        confidence=confidence,
+        flag_new=flag_new,
+    )
+
+
+class ClassifierEventWriter:
+    """Sending end for the classifier process, a drop-in queue sink for AgeClassifier."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def put(self, event: ClassifierEvent):
+        self.conn.send_bytes(encode_event(event))
+
+
+class ClassifierEventReader:
+    """Receiving end for the asyncio loop of the Riddle Client."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    async def coro_get(self) -> ClassifierEvent:
+        loop = asyncio.get_running_loop()
+        fd = self.conn.fileno()
+
+        while not self.conn.poll():
+            readable = loop.create_future()
+            loop.add_reader(fd, lambda: readable.done() or readable.set_result(None))
+            try:
+                await readable
+            finally:
+                loop.remove_reader(fd)
+
+        return decode_event(self.conn.recv_bytes())
+
+
+class SharedFrame:
+    # sequence counter - odd while the frame is being written
+    HEADER = struct.Struct('<Q')
+
+    def __init__(self, shape, name: str = None, create: bool = False):
+        """
+        Latest camera frame in shared memory, so other processes can look at
+        it without the frame going through a pipe.
+
+        The classifier process creates it and calls `publish()`, readers attach
+        by name and call `read()`, which retries while a write is in progress.
+        """
+        self.shape = tuple(shape)
+        size = self.HEADER.size + int(np.prod(self.shape))
+        self.shm = shared_memory.SharedMemory(name=name, create=create, size=size)
+        self.name = self.shm.name
+        self.frame = np.ndarray(self.shape, dtype=np.uint8,
+                                buffer=self.shm.buf, offset=self.HEADER.size)
+        if create:
+            self.HEADER.pack_into(self.shm.buf, 0, 0)
+
+    def _sequence(self) -> int:
+        return self.HEADER.unpack_from(self.shm.buf, 0)[0]
+
+    def publish(self, frame: np.ndarray):
+        sequence = self._sequence()
+        self.HEADER.pack_into(self.shm.buf, 0, sequence + 1)
+        np.copyto(self.frame, frame)
+        self.HEADER.pack_into(self.shm.buf, 0, sequence + 2)
+
+    def read(self, retries: int = 10) -> Optional[np.ndarray]:
+        for _ in range(retries):
+            before = self._sequence()
+            if before == 0:
+                return None
+            if before % 2:
+                continue
+            copy = self.frame.copy()
+            if self._sequence() == before:
+                return copy
+        return None
+
+    def close(self, unlink: bool = False):
+        self.frame = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
@@ -9,6 +9,8 @@ MOUTH_STATUS = 0x50
 CONTROL_STATUS = 0x51
 TAIL_STATUS = 0x52
 HEAD_STATUS = 0x53
+# control, mouth, tail and head statuses in one block read
+ALL_STATUS = 0x54
 
 MOTOR_IDLE = 0x00
 MOTOR_UP_REQUESTED = 0x01
@@ -0,0 +1,210 @@
+"""
+Converts the Caffe face/age nets to int8 ONNX models and validates them.
+
+    python -m RiddleClient.convert_models --images calibration/
+
+Steps, per network:
+    1. Caffe -> ONNX with caffe2onnx (pip install caffe2onnx)
+    2. static int8 quantization with ONNX Runtime, calibrated on --images
+    3. validation against the original Caffe model on the same images:
+       detection agreement / IoU for the face net, bucket agreement for the
+       age net, plus per-inference timings of both
+
+Needs onnx, onnxruntime and caffe2onnx, which are not part of the regular
+Riddle Client requirements. Exits with 1 if any converted model falls below
+--min-agreement, so the result can gate a deployment.
+
+Note: the face detector ends with Caffe's DetectionOutput layer, which ONNX has
+no operator for. If caffe2onnx refuses it, keep FACE_NET_RUNTIME=opencv and
+only switch the age net.
+"""
+import argparse
+import glob
+import os
+import subprocess
+import sys
+import time
+from typing import List
+
+import cv2
+import numpy as np
+
+from .model_runtime import ModelRuntime, OnnxRuntime, OpenCVRuntime, age_blob, face_blob
+
+MODELS_DIR = 'RiddleClient/.opencv_models'
+FACE_CONFIDENCE = 0.6
+
+
+def load_images(path: str, limit: int) -> List[np.ndarray]:
+    files = sorted(f for ext in ('*.jpg', '*.jpeg', '*.png')
+                   for f in glob.glob(os.path.join(path, ext)))[:limit]
+    images = [cv2.imread(f) for f in files]
+    return [i for i in images if i is not None]
+
+
+def convert(proto_path: str, model_path: str, onnx_path: str):
+    print(f"Converting {model_path} -> {onnx_path}")
+    subprocess.run([sys.executable, '-m', 'caffe2onnx.convert',
+                    '--prototxt', proto_path,
+                    '--caffemodel', model_path,
+                    '--onnx', onnx_path], check=True)
+
+
+def quantize(onnx_path: str, int8_path: str, blobs: List[np.ndarray]):
+    from onnxruntime.quantization import (CalibrationDataReader, QuantFormat,
+                                          QuantType, quantize_static)
+    import onnxruntime as ort
+
+    input_name = ort.InferenceSession(
+        onnx_path, providers=['CPUExecutionProvider']).get_inputs()[0].name
+
+    class BlobReader(CalibrationDataReader):
+        def __init__(self):
+            self.blobs = iter(blobs)
+
+        def get_next(self):
+            blob = next(self.blobs, None)
+            return None if blob is None else {input_name: blob}
+
+    print(f"Quantizing {onnx_path} -> {int8_path} on {len(blobs)} samples")
+    quantize_static(onnx_path, int8_path, BlobReader(),
+                    quant_format=QuantFormat.QDQ,
+                    activation_type=QuantType.QUInt8,
+                    weight_type=QuantType.QInt8,
+                    per_channel=True)
+
+
+def detections_of(net: ModelRuntime, image) -> List[np.ndarray]:
+    h, w = image.shape[:2]
+    detections = net.forward(face_blob(image))
+    return [detections[0, 0, i, 3:7] * np.array([w, h, w, h])
+            for i in range(detections.shape[2])
+            if detections[0, 0, i, 2] > FACE_CONFIDENCE]
+
+
+def iou(a, b) -> float:
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0.0, x2 - x1) * max(0.0, y2 - y1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def timed(net: ModelRuntime, blob) -> float:
+    start = time.perf_counter()
+    net.forward(blob)
+    return time.perf_counter() - start
+
+
+def validate_face(reference: ModelRuntime, candidate: ModelRuntime, images) -> float:
+    agreed = 0
+    ious = []
+    ref_times, cand_times = [], []
+
+    for image in images:
+        blob = face_blob(image)
+        ref_times.append(timed(reference, blob))
+        cand_times.append(timed(candidate, blob))
+
+        expected = detections_of(reference, image)
+        got = detections_of(candidate, image)
+        if len(expected) == len(got):
+            agreed += 1
+        for box in expected:
+            ious.append(max((iou(box, g) for g in got), default=0.0))
+
+    agreement = agreed / len(images)
+    print(f"face net: detection count agreement {agreement:.3f}, "
+          f"mean IoU {np.mean(ious) if ious else 0.0:.3f}, "
+          f"{np.median(ref_times) * 1000:.1f} ms -> {np.median(cand_times) * 1000:.1f} ms")
+    return agreement
+
+
+def validate_age(reference: ModelRuntime, candidate: ModelRuntime, face_net: ModelRuntime, images) -> float:
+    agreed = 0
+    total = 0
+    ref_times, cand_times = [], []
+
+    for image in images:
+        for (startX, startY, endX, endY) in (b.astype("int") for b in detections_of(face_net, image)):
+            face = image[max(startY, 0):endY, max(startX, 0):endX]
+            if face.size == 0:
+                continue
+
+            blob = age_blob(face)
+            ref_times.append(timed(reference, blob))
+            cand_times.append(timed(candidate, blob))
+            total += 1
+            if reference.forward(blob)[0].argmax() == candidate.forward(blob)[0].argmax():
+                agreed += 1
+
+    if total == 0:
+        print("age net: no faces found in the validation images")
+        return 0.0
+
+    agreement = agreed / total
+    print(f"age net: bucket agreement {agreement:.3f} over {total} faces, "
+          f"{np.median(ref_times) * 1000:.1f} ms -> {np.median(cand_times) * 1000:.1f} ms")
+    return agreement
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert face/age nets to int8 ONNX and validate them")
+    parser.add_argument('--images', required=True,
+                        help="directory with photos of people for calibration and validation")
+    parser.add_argument('--models-dir', default=MODELS_DIR)
+    parser.add_argument('--limit', type=int, default=200)
+    parser.add_argument('--min-agreement', type=float, default=0.95)
+    parser.add_argument('--skip-face', action='store_true',
+                        help="only convert the age net")
+    parser.add_argument('--validate-only', action='store_true',
+                        help="don't convert, validate already converted models")
+    args = parser.parse_args()
+
+    images = load_images(args.images, args.limit)
+    if not images:
+        print(f"No images found in '{args.images}'")
+        sys.exit(1)
+
+    d = args.models_dir
+    face_proto = os.path.join(d, 'deploy.prototxt')
+    face_model = os.path.join(d, 'res10_300x300_ssd_iter_140000_fp16.caffemodel')
+    age_proto = os.path.join(d, 'age_deploy.prototxt')
+    age_model = os.path.join(d, 'age_net.caffemodel')
+    face_onnx = os.path.join(d, 'face_net.onnx')
+    face_int8 = os.path.join(d, 'face_net.int8.onnx')
+    age_onnx = os.path.join(d, 'age_net.onnx')
+    age_int8 = os.path.join(d, 'age_net.int8.onnx')
+
+    face_reference = OpenCVRuntime(face_proto, face_model)
+    age_reference = OpenCVRuntime(age_proto, age_model)
+
+    if not args.validate_only:
+        if not args.skip_face:
+            convert(face_proto, face_model, face_onnx)
+            quantize(face_onnx, face_int8, [face_blob(i) for i in images])
+
+        face_crops = [image[max(y1, 0):y2, max(x1, 0):x2]
+                      for image in images
+                      for (x1, y1, x2, y2) in (b.astype("int") for b in detections_of(face_reference, image))]
+        convert(age_proto, age_model, age_onnx)
+        quantize(age_onnx, age_int8, [age_blob(f) for f in face_crops if f.size > 0])
+
+    ok = True
+    if not args.skip_face:
+        ok &= validate_face(face_reference, OnnxRuntime(face_int8), images) >= args.min_agreement
+    ok &= validate_age(age_reference, OnnxRuntime(age_int8), face_reference, images) >= args.min_agreement
+
+    if not ok:
+        print(f"Converted models are below {args.min_agreement} agreement, keep using the Caffe ones")
+        sys.exit(1)
+
+    print("Converted models are good, to use them put into RiddleClient/.env:")
+    if not args.skip_face:
+        print(f'FACE_NET_RUNTIME="onnxruntime"\nFACE_NET_ONNX="{face_int8}"')
+    print(f'AGE_NET_RUNTIME="onnxruntime"\nAGE_NET_ONNX="{age_int8}"')
+
+
+if __name__ == "__main__":
+    main()
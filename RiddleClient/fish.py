@@ -1,22 +1,30 @@
 import asyncio
-import base64
 import sys
-import time
+from typing import Optional
 import socketio
 import os
 
 from dotenv import load_dotenv  # noqa
 load_dotenv()                  # noqa
 
-from models.profile import NewPlayer, OldPlayer, UserPreference, UserProfile
+from models.profile import NewPlayer, OldPlayer, UserPreference
 from .consts import *
-from .fishcontroller import FishController, FishControllerStatuses
-from .age_classifier import AgeClassifier, AgeClassifierStates
-from aioprocessing import AioQueue, AioPipe, AioProcess
+from .fishcontroller import FishController
+from .puppet import Puppet
+from .choreography import flap_fin_timeline
+from .age_classifier import AgeClassifier
+from .classifier_ipc import ClassifierEvent, ClassifierEventReader, ClassifierEventType, ClassifierEventWriter
+from .motion_gate import MotionGate
+from .model_runtime import runtime_from_env
+from aioprocessing import AioProcess
+from multiprocessing import Pipe
 from .voiceprocessing import VoiceProcessing
+from .upload_codec import UploadEncoder
 from .fishaudio import FishAudio
 from .preferences import Preferences
 from models.responses import *
+from models.wire import WIRE_VERSION, pack, turn_of, unpack, with_binary
+from models.tracing import Tracer, current_turn, start_turn
 
 # Paths to the models (adjust the paths if necessary)
 face_model_path = 'RiddleClient/.opencv_models/res10_300x300_ssd_iter_140000_fp16.caffemodel'
@@ -24,9 +32,14 @@ face_proto_path = 'RiddleClient/.opencv_models/deploy.prototxt'
 age_model_path = 'RiddleClient/.opencv_models/age_net.caffemodel'
 age_proto_path = 'RiddleClient/.opencv_models/age_deploy.prototxt'
 
+# spans of every turn, empty TRACE_FILE turns the file off
+tracer = Tracer("client", os.getenv("TRACE_FILE", "RiddleClient/traces.jsonl") or None)
+
 sio = socketio.AsyncClient(logger=True)
-classifyQueue = AioQueue()
-puppet_parent_conn, child_conn = AioPipe()
+classify_reader_conn, classify_writer_conn = Pipe(duplex=False)
+classifyQueue = ClassifierEventReader(classify_reader_conn)
+puppet_parent_conn, child_conn = Pipe()
+puppet = Puppet(puppet_parent_conn, tracer=tracer)
 
 fish_no_face = asyncio.Event()
 fish_no_face.set()
@@ -34,13 +47,19 @@ fish_no_face.set()
 voice_processing = VoiceProcessing(
     mic_index=1, sample_rate=44100, chunk_size=512, energy_threshold=18000)
 
-fish_audio = FishAudio()
+# pcm_s16le, wav, flac or opus
+upload_codec = os.getenv("UPLOAD_CODEC", "flac")
+# a known face has to be recognized that many times in a row before the greeting,
+# the server prepares it from the first sighting on
+greet_after_sightings = int(os.getenv("GREET_AFTER_SIGHTINGS", "3"))
+
+fish_audio = FishAudio(tracer=tracer)
 player_preferences = Preferences()
 
 
-def start_classify(queue):
+def start_classify(conn):
     classifier = AgeClassifier(
-        queue=queue,
+        queue=ClassifierEventWriter(conn),
         face_model_path=face_model_path,
         face_proto_path=face_proto_path,
         age_model_path=age_model_path,
@@ -49,6 +68,9 @@ def start_classify(queue):
         frame_height=240,
         process_interval=5,
         timeout_duration=5,
+        motion_gate=MotionGate(),
+        face_net=runtime_from_env('FACE_NET', face_proto_path, face_model_path),
+        age_net=runtime_from_env('AGE_NET', age_proto_path, age_model_path),
     )
     classifier.classify()
 
@@ -58,25 +80,6 @@ def posses_fish(pipe):
     fish.process()
 
 
-def wait_for_response(pipe, expect):
-    while True:
-        try:
-            if pipe.poll(1):
-                if pipe.recv() == expect:
-                    break
-            else:
-                print(f"still waiting for response")
-                time.sleep(0.1)
-        except asyncio.CancelledError:
-            print("wait_for_response was cancelled.")
-            break
-        except EOFError:
-            break
-        except Exception as e:
-            print(f'wait_for_response got: {str(e)}')
-            break
-
-
 @sio.event
 async def connect():
     print('connection established')
@@ -95,69 +98,68 @@ async def on_error(error):
 @sio.on('say_no_continue')
 async def on_say_no_continue(data):
     try:
-        parsed = ResponseStop.model_validate_json(data)
+        start_turn(turn_of(data))
+        parsed = unpack(ResponseStop, data)
 
-        fish_audio.say_from_url_with_callback(
-            parsed.wav_location, parsed.transcription, do_puppet)
+        await fish_audio.say_from_url(
+            parsed.wav_location, parsed.transcription, puppet)
         do_puppet("head_down")
 
     except asyncio.CancelledError:
         print("on_say_no_continue: exiting")
 
 
-def do_puppet(action):
-    puppet_parent_conn.send((action, ()))
-    wait_for_response(puppet_parent_conn,
-                      FishControllerStatuses.ACTION_COMPLETED)
-
-
-def flap_fin():
-    do_puppet("tail_up")
-    do_puppet("tail_down")
+def do_puppet(action) -> int:
+    """Fire-and-forget, use `await puppet.run(action)` to wait for the motor."""
+    return puppet.send(action)
 
 
 async def capture_audio(data: ResponseContinue):
-    audio_ready_event = asyncio.Event()
-
-    def callback(_, audio):
-        """Callback to handle the recognized speech."""
-        global wav_data
-        try:
-            wav_data = audio
-            print(f"Audio captured: {wav_data}")
-        except Exception as e:
-            print(f"Error in callback: {e}")
-        finally:
-            audio_ready_event.set()
-
+    """Streams the answer to the server while the player is still speaking."""
+    encoder = UploadEncoder(voice_processing.sample_rate, codec=upload_codec)
+    # the answer and the reply on it are the next turn
+    turn = start_turn()
+
+    def chunk(seq, pcm, final=False):
+        with tracer.span("encode", codec=encoder.codec):
+            recording = encoder.encode(pcm, last=final)
+        return pack(with_binary(
+            PlayerVoiceStream,
+            player=data.player,
+            seq=seq,
+            codec=encoder.codec,
+            sample_rate=encoder.target_rate,
+            recording=recording,
+            final=final,
+        ), turn=turn)
+
+    async def upload(seq, pcm, final=False):
+        with tracer.span("upload", seq=seq):
+            await emit_with_retry('answer_chunk', chunk(seq, pcm, final))
+
+    seq = 0
     try:
-        stopper = voice_processing.start_background_listening(callback)
-
-        while not audio_ready_event.is_set():
-            if fish_no_face.is_set():
-                print("Face no more detected near fish - stopping voice capture")
-                stopper(wait_for_stop=False)
-                return
-
-            await asyncio.sleep(0.1)
-
-        if wav_data is not None:
-            print("Sending back recognized audio...")
-            voice_chunk = PlayerVoiceChunk(
-                player=data.player,
-                recording=base64.b64encode(wav_data.get_wav_data()),
-            )
-            await emit_with_retry('give_answer_on_riddle', voice_chunk.model_dump_json())
-
-        stopper(wait_for_stop=False)
+        with tracer.span("capture") as span:
+            async for pcm in voice_processing.stream_phrase(stop=fish_no_face):
+                await upload(seq, pcm)
+                seq += 1
+            span["chunks"] = seq
+
+        if fish_no_face.is_set():
+            print("Face no more detected near fish - stopping voice capture")
+            # the server drops the part it got and the riddle it prepared
+            await emit_with_retry('answer_cancel', pack(data.player, turn=turn))
+            return
+
+        print(f"Answer captured in {seq} chunks")
+        await upload(seq, b"", final=True)
     except asyncio.CancelledError:
         print("on_say: exiting")
-        stopper(wait_for_stop=False)
 
 
 @sio.on('save_player_preferences')
 async def on_save_player_preferences(data):
-    model = UserPreference.model_validate_json(data)
+    model = unpack(UserPreference, data)
     print(f"Saving user preferences for user: {model.id}")
     player_preferences.save(model)
 
@@ -167,23 +169,20 @@ async def on_say(data):
     try:
         print(f'saying something')
 
-        parsed = ResponseContinue.model_validate_json(data)
+        start_turn(turn_of(data))
+        parsed = unpack(ResponseContinue, data)
 
         if parsed.answer_correct:
-            do_puppet("mouth_close")
-            do_puppet("head_down")
+            await asyncio.gather(puppet.run("mouth_close"), puppet.run("head_down"))
             await asyncio.sleep(0.5)
-            fish_audio.play_wav(
-                "RiddleClient/shreksophone.wav", blocking=False)
-            for _ in range(5):
-                flap_fin()
-                time.sleep(0.5)
-            fish_audio.wait_and_stop()
-            do_puppet("head_up")
+            song = fish_audio.play_wav("RiddleClient/shreksophone.wav")
+            await puppet.completion(puppet.play(flap_fin_timeline(count=5, interval=1.0)))
+            await song
+            await puppet.run("head_up")
 
         if not fish_no_face.is_set():
-            fish_audio.say_from_url_with_callback(
-                parsed.wav_location, parsed.transcription, do_puppet)
+            await fish_audio.say_from_url(
+                parsed.wav_location, parsed.transcription, puppet)
 
             await capture_audio(data=parsed)
         else:
@@ -194,39 +193,44 @@ async def on_say(data):
 
 @sio.on('retry_greeting')
 async def on_retry_greeting(data):
-    model = ResponseRetry.model_validate_json(data)
-    recording_b64 = base64.b64encode(greet_new_player())
+    turn = start_turn(turn_of(data))
+    model = unpack(ResponseRetry, data)
+    recording = await greet_new_player()
     await emit_with_retry('greet_new_player',
-                          NewPlayer(
+                          pack(with_binary(
+                              NewPlayer,
                               id=model.player.id,
                               age=model.player.age,
                               confidence=model.player.confidence,
-                              recording=recording_b64,
-                          ).model_dump_json())
+                              recording=recording,
+                          ), turn=turn))
 
 
-async def retry_no_player_preferences(profile: UserProfile):
-    recording_b64 = base64.b64encode(greet_new_player())
+async def retry_no_player_preferences(profile: ClassifierEvent):
+    turn = start_turn()
+    recording = await greet_new_player()
     await emit_with_retry('greet_new_player',
-                          NewPlayer(
+                          pack(with_binary(
+                              NewPlayer,
                               id=profile.id,
                               age=profile.age,
                               confidence=profile.confidence,
-                              recording=recording_b64,
-                          ).model_dump_json())
+                              recording=recording,
+                          ), turn=turn))
 
 
-def greet_new_player() -> bytes:
+async def greet_new_player() -> bytes:
     """
     Note: return Bytes of the player voice
     """
-    fish_audio.say_with_callback(
-        "RiddleClient/english.wav", "English?", do_puppet)
-    time.sleep(1)
-    fish_audio.say_with_callback(
-        "RiddleClient/nederlands.wav", "Nederlands?", do_puppet)
+    await fish_audio.say(
+        "RiddleClient/english.wav", "English?", puppet)
+    await asyncio.sleep(1)
+    await fish_audio.say(
+        "RiddleClient/nederlands.wav", "Nederlands?", puppet)
 
-    return voice_processing.listen().get_wav_data()
+    with tracer.span("capture"):
+        return await voice_processing.record()
 
 
 async def emit_with_retry(event: str, data):
@@ -240,53 +244,85 @@ async def emit_with_retry(event: str, data):
             print(
                 f"There was an error {str(e)} emiting '{event}', retrying, attempt {current_retry}")
             await sio.disconnect()
-            await sio.connect(os.getenv("RIDDLE_PROCESSOR_URL"),  transports=['websocket'])
+            await sio.connect(os.getenv("RIDDLE_PROCESSOR_URL"), transports=['websocket'],
+                              auth={"wire": WIRE_VERSION})
             current_retry += 1
             await asyncio.sleep(1.5)
 
 
+def known_player(profile: ClassifierEvent) -> Optional[OldPlayer]:
+    try:
+        player_prefs = player_preferences.get(profile.id)
+    except ValueError:
+        return None
+
+    return OldPlayer(
+        id=profile.id,
+        age=profile.age,
+        confidence=profile.confidence,
+        lang=player_prefs.lang,
+        voice=player_prefs.voice,
+    )
+
+
 async def read_from_classify_queue(classify_queue):
     player_in_front_of_camera = False
+    # known player the server was told about, but not greeted yet
+    arriving = None
+    sightings = 0
 
     while True:
         try:
             message = await classify_queue.coro_get()
-            if 'state' in message:
-                if message['state'] == AgeClassifierStates.NO_FACE_DETECTED:
-                    if player_in_front_of_camera:
-                        fish_no_face.set()
-                        do_puppet("head_down")
-                        player_in_front_of_camera = False
-            elif 'id' in message:
+            if message.type == ClassifierEventType.NO_FACE_DETECTED:
+                if arriving is not None:
+                    await emit_with_retry('player_gone', pack(arriving, turn=current_turn.get()))
+                    arriving = None
+                    sightings = 0
+                if player_in_front_of_camera:
+                    fish_no_face.set()
+                    do_puppet("head_down")
+                    player_in_front_of_camera = False
+            elif message.type == ClassifierEventType.PLAYER:
                 fish_no_face.clear()
 
-                profile = UserProfile.model_validate(message)
+                # compact record, the face encoding stays in the classifier process
+                profile = message
                 if not player_in_front_of_camera:
                     if profile.flag_new:
                         print("Greet NEW player!")
-                        recording_b64 = base64.b64encode(greet_new_player())
-                        player_info = NewPlayer(
+                        turn = start_turn()
+                        recording = await greet_new_player()
+                        player_info = with_binary(
+                            NewPlayer,
                             id=profile.id,
                             age=profile.age,
                             confidence=profile.confidence,
-                            recording=recording_b64,
+                            recording=recording,
                         )
-                        await emit_with_retry('greet_new_player', player_info.model_dump_json())
+                        await emit_with_retry('greet_new_player', pack(player_info, turn=turn))
                         do_puppet("head_up")
                     else:
-                        print("Greet OLD player!")
-                        try:
-                            player_prefs = player_preferences.get(profile.id)
-
-                            player_info = OldPlayer(
-                                id=profile.id,
-                                age=profile.age,
-                                confidence=profile.confidence,
-                                lang=player_prefs.lang,
-                                voice=player_prefs.voice,
-                            )
-                            await emit_with_retry('greet_old_player', player_info.model_dump_json())
-                        except ValueError:
+                        player_info = known_player(profile)
+                        if player_info is not None:
+                            if arriving is None or arriving.id != player_info.id:
+                                if arriving is not None:
+                                    await emit_with_retry('player_gone', pack(arriving, turn=current_turn.get()))
+                                # cheap hint, the server starts on the greeting right away,
+                                # the greeting itself is sent in the same turn
+                                turn = start_turn()
+                                await emit_with_retry('player_arriving', pack(player_info, turn=turn))
+                                arriving = player_info
+                                sightings = 0
+                            sightings += 1
+                            if sightings < greet_after_sightings:
+                                continue
+
+                            print("Greet OLD player!")
+                            await emit_with_retry('greet_old_player', pack(player_info, turn=current_turn.get()))
+                            arriving = None
+                            sightings = 0
+                        else:
                             print(
                                 "We have facial pattern, but no preferences saved.")
                             print(
@@ -309,15 +345,18 @@ async def main():
     backoff = 0.1
 
     read_task = asyncio.create_task(read_from_classify_queue(classifyQueue))
+    puppet.attach(asyncio.get_running_loop())
+    fish_audio.start()
 
-    classify_process = AioProcess(target=start_classify, args=(classifyQueue,))
+    classify_process = AioProcess(target=start_classify, args=(classify_writer_conn,))
     posses_fish_process = AioProcess(target=posses_fish, args=(child_conn,))
     classify_process.start()
     posses_fish_process.start()
 
     while True:
         try:
-            await sio.connect(os.getenv("RIDDLE_PROCESSOR_URL"),  transports=['websocket'])
+            await sio.connect(os.getenv("RIDDLE_PROCESSOR_URL"), transports=['websocket'],
+                              auth={"wire": WIRE_VERSION})
             await sio.wait()
             backoff = 0.1
         except asyncio.CancelledError:
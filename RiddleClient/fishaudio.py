@@ -1,99 +1,116 @@
+import asyncio
 import base64
-from os import unlink
-import tempfile
-import time
+import io
+from typing import Tuple, Union
+
+import numpy as np
 import requests
-import sounddevice as sd
 import soundfile as sf
 
+from models.tracing import NullTracer, Tracer
+from .lipsync import LipSync
+from .playback import PlaybackEngine, PlaybackHandle
+
+# decoded audio: float32 samples and sample rate
+Clip = Tuple[np.ndarray, int]
+
+# what play/say accept: path, encoded WAV bytes or an already decoded Clip
+AudioSource = Union[str, bytes, bytearray, memoryview, Clip]
+
+# seconds a clip may take to come out of the speaker, and to end after its length
+PLAYBACK_TIMEOUT = 5.0
+
+STATIC_CLIPS = (
+    "RiddleClient/english.wav",
+    "RiddleClient/nederlands.wav",
+    "RiddleClient/shreksophone.wav",
+)
+
 
 class FishAudio:
-    def play_wav(self, file_path, blocking=True):
-        data, samplerate = sf.read(file_path, dtype='float32')
-        sd.play(data, samplerate)
-        if blocking:
-            self.wait_and_stop()
-
-    def wait_and_stop(self):
-        sd.wait()
-        sd.stop()
-
-    def count_syllables(self, word):
-        vowels = "aeiouy"
-        word = word.lower()
-        syllable_count = 0
-        if word[0] in vowels:
-            syllable_count += 1
-        for i in range(1, len(word)):
-            if word[i] in vowels and word[i - 1] not in vowels:
-                syllable_count += 1
-        # Handle words with no vowels (e.g., short abbreviations)
-        if syllable_count == 0:
-            syllable_count = 1
-        return syllable_count
-
-    # Function to control the fish's mouth opening and closing
-    def control_fish_mouth(self, callback, word_timing):
-        stream = sd.get_stream()
-        open_duration = 0.6   # Time to open the mouth
-
-        for _, duration in enumerate(word_timing):
-            if not stream.active:
-                print("Stopping mouth control...")
-                callback("mouth_close")
-                sd.stop()
-                break
-
-            callback("mouth_open")
-
-            if duration > open_duration:
-                time.sleep(duration - open_duration)
-            callback("mouth_close")
-
-    # Function to distribute time based on syllable counts
-    def distribute_time_by_syllables(self, wav_file_path, transcription):
-        # Load the wav file to get its total duration
-        audio_signal, samplerate = sf.read(wav_file_path)
-        # Total duration of the wav file
-        total_duration = len(audio_signal) / samplerate
-
-        # Split transcription into words and count syllables
-        words = transcription.split()
-        syllable_counts = [self.count_syllables(word) for word in words]
-        total_syllables = sum(syllable_counts)
-
-        # Calculate time per syllable
-        time_per_syllable = total_duration / total_syllables
-
-        # Distribute time per word based on syllable count
-        word_timing = [count * time_per_syllable for count in syllable_counts]
-
-        return word_timing
-
-    def say_with_callback(self, wav_path, transcription, callback):
-        word_timing = self.distribute_time_by_syllables(
-            wav_path, transcription)
-        self.play_wav(wav_path, blocking=False)
-        self.control_fish_mouth(callback=callback, word_timing=word_timing)
-        sd.wait()
-        sd.stop()
-
-    def say_b64_with_callback(self, wav_b64, transcription, callback):
-        audio = base64.b64decode(wav_b64)
-        temp = tempfile.NamedTemporaryFile(delete=False)
-        temp.write(audio)
-        self.say_with_callback(temp.name, transcription, callback)
-        unlink(temp.name)
-
-    def say_from_url_with_callback(self, wav_url, transcription, callback):
+    def __init__(self, preload=STATIC_CLIPS, engine: PlaybackEngine = None, tracer: Tracer = None):
+        """
+        Args:
+            preload (optional): Paths of clips decoded once and kept in RAM,
+                together with their lip sync. Default is STATIC_CLIPS.
+            engine (PlaybackEngine, optional): Output stream to play through. Default is a new one on the default device.
+            tracer (Tracer, optional): Records download and playback spans. Default is not recording anything.
+        """
+        self.engine = engine or PlaybackEngine()
+        self.tracer = tracer if tracer is not None else NullTracer()
+        self.clips = {}
+        self.timelines = {}
+        for path in preload:
+            try:
+                self.clips[path] = self.decode(path)
+            except (OSError, RuntimeError) as e:
+                print(f"Unable to preload '{path}': {str(e)}")
+
+    def decode(self, source: AudioSource) -> Clip:
+        """Decodes source in memory, cached clips are returned as they are."""
+        if isinstance(source, tuple):
+            return source
+        if isinstance(source, str):
+            clip = self.clips.get(source)
+            if clip is not None:
+                return clip
+            return sf.read(source, dtype='float32')
+        return sf.read(io.BytesIO(source), dtype='float32')
+
+    def start(self):
+        """Opens the output stream, must be called from the running asyncio loop."""
+        self.engine.start()
+
+    def play_wav(self, source: AudioSource) -> PlaybackHandle:
+        """Queues source for playing and returns right away, await the handle to wait for the end."""
+        data, samplerate = self.decode(source)
+        return self.engine.enqueue(data, samplerate)
+
+    def stop(self):
+        self.engine.stop_all()
+
+    def lip_sync(self, source: AudioSource, data, samplerate):
+        if isinstance(source, str) and source in self.clips:
+            if source not in self.timelines:
+                self.timelines[source] = LipSync(samplerate).timeline(data)
+            return self.timelines[source]
+        return LipSync(samplerate).timeline(data)
+
+    async def say(self, source: AudioSource, transcription, puppet):
+        # decoded once, the same samples go to lip sync and playback
+        with self.tracer.span("audio_decode"):
+            data, samplerate = self.decode(source)
+            timeline = self.lip_sync(source, data, samplerate)
+        handle = self.engine.enqueue(data, samplerate)
+
+        seconds = len(data) / samplerate
         try:
-            response = requests.get(wav_url)
-            response.raise_for_status()
+            # the timeline starts when the clip comes out of the speaker, not when it's queued
+            with self.tracer.span("playback_start"):
+                await asyncio.wait_for(handle.started, PLAYBACK_TIMEOUT)
+            puppet.play(timeline)
+            try:
+                with self.tracer.span("playback", seconds=round(seconds, 3)):
+                    await asyncio.wait_for(handle.finished, seconds + PLAYBACK_TIMEOUT)
+            finally:
+                puppet.cancel_timeline()
+                puppet.send("mouth_close")
+        except asyncio.TimeoutError:
+            # nothing comes out of the speaker, the fish goes on rather than hangs
+            print("Playback didn't finish in time, dropping the queued audio")
+            self.engine.stop_all()
+
+    async def say_b64(self, wav_b64, transcription, puppet):
+        await self.say(base64.b64decode(wav_b64), transcription, puppet)
+
+    async def say_from_url(self, wav_url, transcription, puppet):
+        try:
+            with self.tracer.span("download") as span:
+                response = await asyncio.to_thread(requests.get, wav_url)
+                response.raise_for_status()
+                span["bytes"] = len(response.content)
         except requests.RequestException as e:
             raise ValueError(
-                f"Unable to download file from server, error was: {str(e)}")        
-        
-        temp = tempfile.NamedTemporaryFile(delete=False)
-        temp.write(response.content)
-        self.say_with_callback(temp.name, transcription, callback)
-        unlink(temp.name)
+                f"Unable to download file from server, error was: {str(e)}")
+
+        await self.say(response.content, transcription, puppet)
@@ -1,4 +1,5 @@
 import signal
+from collections import deque
 from .consts import *
 import smbus2
 import time
@@ -6,16 +7,150 @@ from enum import Enum
 
 class FishControllerStatuses(Enum):
     ACTION_COMPLETED = 0x10
+    ACTION_TIMED_OUT = 0x11
+
+# action: (register, requested value, status register, status when done)
+ACTIONS = {
+    "head_up": (HEAD_REG, MOTOR_UP_REQUESTED, HEAD_STATUS, MOTOR_UP),
+    "head_down": (HEAD_REG, MOTOR_DOWN_REQUESTED, HEAD_STATUS, MOTOR_IDLE),
+    "tail_up": (TAIL_REG, MOTOR_UP_REQUESTED, TAIL_STATUS, MOTOR_UP),
+    "tail_down": (TAIL_REG, MOTOR_DOWN_REQUESTED, TAIL_STATUS, MOTOR_IDLE),
+    "mouth_open": (MOUTH_REG, MOTOR_UP_REQUESTED, MOUTH_STATUS, MOTOR_UP),
+    "mouth_close": (MOUTH_REG, MOTOR_DOWN_REQUESTED, MOUTH_STATUS, MOTOR_IDLE),
+}
+
+# Head and tail share the H-bridge and must never be driven at the same time,
+# so they go through one lane. The mouth can move in parallel with either.
+LANES = {
+    "head_up": "body",
+    "head_down": "body",
+    "tail_up": "body",
+    "tail_down": "body",
+    "mouth_open": "mouth",
+    "mouth_close": "mouth",
+}
+
+# seconds an action may take before the motor is considered stuck,
+# a bit over twice the firmware startup/spring times
+ACTION_TIMEOUTS = {
+    "head_up": 1.5,
+    "head_down": 3.5,
+    "tail_up": 1.0,
+    "tail_down": 1.0,
+    "mouth_open": 1.0,
+    "mouth_close": 1.0,
+}
+
+# order of the bytes returned by the ALL_STATUS register
+ALL_STATUS_LAYOUT = (CONTROL_STATUS, MOUTH_STATUS, TAIL_STATUS, HEAD_STATUS)
+
+
+class LatencyHistogram:
+    # upper bounds of the buckets in seconds, the last one catches everything
+    BOUNDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, float("inf"))
+
+    def __init__(self):
+        self.counts = [0] * len(self.BOUNDS)
+        self.total = 0
+        self.sum = 0.0
+
+    def record(self, seconds):
+        for i, bound in enumerate(self.BOUNDS):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+        self.total += 1
+        self.sum += seconds
+
+    def __str__(self):
+        if self.total == 0:
+            return "no samples"
+        buckets = " ".join(f"<={b * 1000:g}ms:{c}" for b, c in zip(self.BOUNDS, self.counts) if c)
+        return f"n={self.total} mean={self.sum / self.total * 1000:.1f}ms {buckets}"
+
+
+class MotorCommand:
+    def __init__(self, action, cmd_id):
+        self.action = action
+        # commands coalesced into this one complete together
+        self.ids = [cmd_id]
+        self.started = 0.0
+        self.deadline = 0.0
+        self.next_poll = 0.0
+        self.interval = 0.0
+
+
+class MotorLane:
+    def __init__(self, name):
+        self.name = name
+        self.queue = deque()
+        self.active = None
+
+    def submit(self, cmd_id, action):
+        """Queues action, or merges it into the last one if it's the same move."""
+        last = self.queue[-1] if self.queue else self.active
+        if last is not None and last.action == action:
+            last.ids.append(cmd_id)
+            return
+        self.queue.append(MotorCommand(action, cmd_id))
+
+    def busy(self) -> bool:
+        return self.active is not None or len(self.queue) > 0
+
+    def drop_unclaimed(self):
+        """Drops queued commands nobody waits for, e.g. the rest of a cancelled timeline."""
+        self.queue = deque(c for c in self.queue if any(i is not None for i in c.ids))
+
+
+class Timeline:
+    def __init__(self, cmd_id, events, started):
+        self.cmd_id = cmd_id
+        self.events = events
+        self.started = started
+        self.position = 0
+        # last event index per motor lane, never skipped so the puppet ends up in the final pose
+        self.last_per_lane = {LANES[action]: i for i, (_, action) in enumerate(events)}
+
+    def finished(self) -> bool:
+        return self.position >= len(self.events)
+
+    def next_due_in(self, now) -> float:
+        return self.started + self.events[self.position][0] - now
+
 
 class FishController:
-    def __init__(self, pipe, i2c_bus=1, device_address=0x08):
-        # Initialize the I2C bus and device address
-        self.bus = smbus2.SMBus(i2c_bus)
+    def __init__(self, pipe, i2c_bus=1, device_address=0x08, poll_interval=0.05, max_lateness=0.15, bus=None,
+                 initial_poll_interval=0.005, poll_backoff=1.5, action_timeouts=None, bulk_status=True):
+        """
+        Args:
+            pipe: Connection to the Riddle Client, receives (cmd_id, action, args).
+            i2c_bus (int, optional): I2C bus number. Default is 1.
+            device_address (int, optional): Address of the Fish Proxy. Default is 0x08.
+            poll_interval (float, optional): Longest pause between two status polls. Default is 0.05 seconds.
+            max_lateness (float, optional): Timeline moves later than this are skipped. Default is 0.15 seconds.
+            bus (optional): Bus to use instead of smbus2.SMBus, e.g. FishProxySimulator.
+            initial_poll_interval (float, optional): First pause after a command is sent. Default is 0.005 seconds.
+            poll_backoff (float, optional): The pause grows by this factor after every poll. Default is 1.5.
+            action_timeouts (dict, optional): Seconds per action before giving up. Default is ACTION_TIMEOUTS.
+            bulk_status (bool, optional): Read all status registers in one transaction if the firmware supports it. Default is True.
+        """
+        # Initialize the I2C bus and device address, unless a bus (e.g. FishProxySimulator) is given
+        self.bus = bus if bus is not None else smbus2.SMBus(i2c_bus)
         self.device_address = device_address
         self.pipe = pipe
+        self.poll_interval = poll_interval
+        self.initial_poll_interval = initial_poll_interval
+        self.poll_backoff = poll_backoff
+        self.action_timeouts = action_timeouts or ACTION_TIMEOUTS
+        self.bulk_status = bulk_status
+        self.histograms = {motor: LatencyHistogram() for motor in ("head", "tail", "mouth")}
 
         # internal stuff
         self.exiting = False
+        self.lanes = {name: MotorLane(name) for name in set(LANES.values())}
+        self.timeline = None
+        # timeline events later than this are skipped, so the puppet catches up with the audio
+        self.max_lateness = max_lateness
 
         def handle_sigterm(signum, frame):
             print("FishController: Received SIGTERM or SIGINT. Shutting down gracefully...")
@@ -24,13 +159,6 @@ class FishController:
         signal.signal(signal.SIGTERM, handle_sigterm)
         signal.signal(signal.SIGINT, handle_sigterm)
 
-    def send_status_on_completion(func):
-        def wrapper(self, *args, **kwargs):
-            result = func(self, *args, **kwargs)
-            self.pipe.send(FishControllerStatuses.ACTION_COMPLETED)
-            return result
-        return wrapper
-
     def process(self):
         self._cleanup_bus()
         self._assume_control()
@@ -39,25 +167,162 @@ class FishController:
 
         try:
             while not self.exiting:
-                if self.pipe.poll(timeout=1):
-                    method_name, args = self.pipe.recv()
-                    method = getattr(self, method_name)
-                    method(*args)
-                else:
-                    time.sleep(0.1)
+                # new commands wake us up immediately, otherwise poll motors
+                if self.pipe.poll(timeout=self._next_wakeup()):
+                    while self.pipe.poll():
+                        self.submit(*self.pipe.recv())
+                self._step_timeline()
+                self._step_lanes()
         except Exception as e:
             print(f"Child process exception: {e}")
         finally:
             self.head_down()
             self._leave_body()
             self.bus.close()
+            print(self.latency_report())
+
+    def latency_report(self) -> str:
+        return "\n".join(f"{motor}: {histogram}" for motor, histogram in self.histograms.items())
+
+    def _next_wakeup(self) -> float:
+        timeout = 1
+        now = time.monotonic()
+        for lane in self.lanes.values():
+            if lane.active is not None:
+                timeout = min(timeout, max(lane.active.next_poll - now, 0))
+            elif lane.queue:
+                timeout = 0
+        if self.timeline is not None and not self.timeline.finished():
+            timeout = min(timeout, max(self.timeline.next_due_in(time.monotonic()), 0))
+        return timeout
+
+    def submit(self, cmd_id, action, args=()):
+        if action == "play_timeline":
+            self.play_timeline(cmd_id, *args)
+            return
+        if action == "cancel_timeline":
+            self.cancel_timeline()
+            self._notify([cmd_id])
+            return
+        if action not in ACTIONS:
+            print(f"Unknown puppet action: {action}")
+            self._notify([cmd_id])
+            return
+
+        self.lanes[LANES[action]].submit(cmd_id, action)
+
+    def play_timeline(self, cmd_id, events):
+        """Starts a compiled timeline, replacing the one playing (if any)."""
+        self.cancel_timeline()
+        self.timeline = Timeline(cmd_id, events, time.monotonic())
+
+    def cancel_timeline(self):
+        if self.timeline is None:
+            return
+        for lane in self.lanes.values():
+            lane.drop_unclaimed()
+        self._notify([self.timeline.cmd_id])
+        self.timeline = None
+
+    def _step_timeline(self):
+        timeline = self.timeline
+        if timeline is None:
+            return
+
+        # offsets are relative to the start, so being late once doesn't shift the rest
+        now = time.monotonic()
+        while not timeline.finished() and timeline.next_due_in(now) <= 0:
+            i = timeline.position
+            _, action = timeline.events[i]
+            lateness = -timeline.next_due_in(now)
+            if lateness <= self.max_lateness or timeline.last_per_lane[LANES[action]] == i:
+                lane = self.lanes[LANES[action]]
+                # a motor slower than the timeline only catches up with the latest pose
+                lane.drop_unclaimed()
+                lane.submit(None, action)
+            timeline.position += 1
+
+        if timeline.finished() and not any(lane.busy() for lane in self.lanes.values()):
+            self._notify([timeline.cmd_id])
+            self.timeline = None
+
+    def _step_lanes(self):
+        now = time.monotonic()
+        due = [lane.active for lane in self.lanes.values()
+               if lane.active is not None and now >= lane.active.next_poll]
+        statuses = self._read_statuses([ACTIONS[c.action][2] for c in due]) if due else {}
+
+        now = time.monotonic()
+        for lane in self.lanes.values():
+            self._step_lane(lane, statuses, now)
+
+    def _step_lane(self, lane: MotorLane, statuses, now):
+        command = lane.active
+        if command is not None:
+            _, _, status_register, want = ACTIONS[command.action]
+            if status_register not in statuses:
+                # not polled this time
+                return
+
+            if statuses[status_register] == want:
+                self.histograms[command.action.split("_")[0]].record(now - command.started)
+                self._notify(command.ids)
+            elif now >= command.deadline:
+                print(f"{command.action} did not complete in {now - command.started:.2f}s, giving up")
+                self._notify(command.ids, FishControllerStatuses.ACTION_TIMED_OUT)
+            else:
+                command.interval = min(command.interval * self.poll_backoff, self.poll_interval)
+                command.next_poll = now + command.interval
+                return
+            lane.active = None
+
+        if lane.queue:
+            command = lane.queue.popleft()
+            register, value, _, _ = ACTIONS[command.action]
+            self._set_state(register, value)
+
+            lane.active = command
+            command.started = time.monotonic()
+            command.deadline = command.started + self.action_timeouts[command.action]
+            command.interval = self.initial_poll_interval
+            command.next_poll = command.started + command.interval
+
+    def _notify(self, ids, status=FishControllerStatuses.ACTION_COMPLETED):
+        for cmd_id in ids:
+            # timeline moves have no ID, the timeline itself is reported
+            if cmd_id is not None:
+                self.pipe.send((status, cmd_id))
 
     # FIXME: this is hack to stabilize bus
 
-    def _cleanup_bus(self):
+    def _cleanup_bus(self, settle=0.05):
         for r in [CONTROL_STATUS, MOUTH_STATUS, TAIL_STATUS, HEAD_STATUS]:
             self._get_state(r)
-            time.sleep(0.2)
+            time.sleep(settle)
+
+        if self.bulk_status and self._read_all_statuses() is None:
+            print("Fish Proxy firmware has no ALL_STATUS register, reading statuses one by one")
+            self.bulk_status = False
+
+    def _read_all_statuses(self):
+        try:
+            values = self.bus.read_i2c_block_data(
+                self.device_address, ALL_STATUS, len(ALL_STATUS_LAYOUT))
+        except Exception as e:
+            print(f"Error reading all status registers: {e}")
+            return None
+        if len(values) != len(ALL_STATUS_LAYOUT) or values[0] not in (
+                CONTROL_IDLE, CONTROL_REQUESTED, CONTROL_UNDER_CONTROL, CONTROL_LEAVE):
+            return None
+        return dict(zip(ALL_STATUS_LAYOUT, values))
+
+    def _read_statuses(self, registers):
+        """One I2C transaction for all statuses if possible, otherwise one per register."""
+        if self.bulk_status and len(registers) > 1:
+            statuses = self._read_all_statuses()
+            if statuses is not None:
+                return statuses
+        return {r: self._get_state(r) for r in registers}
 
     def _set_state(self, register, value):
         try:
@@ -73,44 +338,51 @@ class FishController:
             print(f"Error reading from mouth state register: {e}")
             return None
 
-    def _wait_for_state(self, register, want):
-        while not self.exiting and (self._get_state(register) != want):
-            time.sleep(0.1)
+    def _wait_for_state(self, register, want, timeout) -> bool:
+        """Polls with backoff until register reads `want`, returns False on timeout."""
+        deadline = time.monotonic() + timeout
+        interval = self.initial_poll_interval
+        while self._get_state(register) != want:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(interval)
+            interval = min(interval * self.poll_backoff, self.poll_interval)
+        return True
+
+    def _run_action(self, action) -> bool:
+        """Executes action right away and blocks until it's done."""
+        register, value, status_register, want = ACTIONS[action]
+        self._set_state(register, value)
+        if not self._wait_for_state(status_register, want, self.action_timeouts[action]):
+            print(f"{action} did not complete in time")
+            return False
+        return True
 
     def _assume_control(self):
-        self._set_state(DIRECT_CONTROL_REG, CONTROL_REQUESTED)
-        self._wait_for_state(CONTROL_STATUS, CONTROL_UNDER_CONTROL)
+        while not self.exiting:
+            self._set_state(DIRECT_CONTROL_REG, CONTROL_REQUESTED)
+            if self._wait_for_state(CONTROL_STATUS, CONTROL_UNDER_CONTROL, timeout=2):
+                return
+            print("Fish Proxy does not give control, retrying")
 
     def _leave_body(self):
         self._set_state(DIRECT_CONTROL_REG, CONTROL_LEAVE)
-        self._wait_for_state(CONTROL_STATUS, CONTROL_IDLE)
+        self._wait_for_state(CONTROL_STATUS, CONTROL_IDLE, timeout=2)
 
-    @send_status_on_completion
     def head_up(self):
-        self._set_state(HEAD_REG, MOTOR_UP_REQUESTED)
-        self._wait_for_state(HEAD_STATUS, MOTOR_UP)
+        self._run_action("head_up")
 
-    @send_status_on_completion
     def head_down(self):
-        self._set_state(HEAD_REG, MOTOR_DOWN_REQUESTED)
-        self._wait_for_state(HEAD_STATUS, MOTOR_IDLE)
+        self._run_action("head_down")
 
-    @send_status_on_completion
     def tail_up(self):
-        self._set_state(TAIL_REG, MOTOR_UP_REQUESTED)
-        self._wait_for_state(TAIL_STATUS, MOTOR_UP)
+        self._run_action("tail_up")
 
-    @send_status_on_completion
     def tail_down(self):
-        self._set_state(TAIL_REG, MOTOR_DOWN_REQUESTED)
-        self._wait_for_state(TAIL_STATUS, MOTOR_IDLE)
+        self._run_action("tail_down")
 
-    @send_status_on_completion
     def mouth_open(self):
-        self._set_state(MOUTH_REG, MOTOR_UP_REQUESTED)
-        self._wait_for_state(MOUTH_STATUS, MOTOR_UP)
+        self._run_action("mouth_open")
 
-    @send_status_on_completion
     def mouth_close(self):
-        self._set_state(MOUTH_REG, MOTOR_DOWN_REQUESTED)
-        self._wait_for_state(MOUTH_STATUS, MOTOR_IDLE)
+        self._run_action("mouth_close")
@@ -0,0 +1,142 @@
+import random
+import threading
+import time
+
+from .consts import *
+
+# Movement timing of FishProxy/src/main.h in seconds: (startup, spring)
+MOTOR_TIMINGS = {
+    MOUTH_REG: (0.250, 0.200),
+    HEAD_REG: (0.600, 1.500),
+    TAIL_REG: (0.250, 0.125),
+}
+
+STATUS_REGISTERS = {
+    MOUTH_STATUS: MOUTH_REG,
+    HEAD_STATUS: HEAD_REG,
+    TAIL_STATUS: TAIL_REG,
+}
+
+
+class SimulatedMotor:
+    def __init__(self, startup_time, spring_time):
+        self.startup_time = startup_time
+        self.spring_time = spring_time
+        self.state = MOTOR_IDLE
+        self.action_start = 0.0
+
+    def request(self, value, now):
+        if value == MOTOR_UP_REQUESTED and self.state == MOTOR_IDLE:
+            self.state = MOTOR_UP_REQUESTED
+            self.action_start = now
+        elif value == MOTOR_DOWN_REQUESTED and self.state == MOTOR_UP:
+            self.state = MOTOR_DOWN_REQUESTED
+            self.action_start = now
+
+    def update(self, now):
+        # same transitions as handleMotorStates() in main.cpp
+        if self.state == MOTOR_UP_REQUESTED and now - self.action_start >= self.startup_time:
+            self.state = MOTOR_UP
+        elif self.state == MOTOR_DOWN_REQUESTED and now - self.action_start >= self.spring_time:
+            # firmware passes through MOTOR_DOWN for a single loop iteration only
+            self.state = MOTOR_IDLE
+
+
+class FishProxySimulator:
+    def __init__(self, time_scale: float = 1.0, transaction_time: float = 0.0005,
+                 read_error_rate: float = 0.0, write_error_rate: float = 0.0, seed: int = None):
+        """
+        Software stand-in for the Fish Proxy on the I2C bus, with the same
+        interface as smbus2.SMBus as far as FishController uses it.
+
+        Implements the register protocol of FishProxy/src/main.cpp: the control
+        handshake and the motor state transitions with their startup/spring
+        times.
+
+        Args:
+            time_scale (float, optional): Multiplier for the motor timings, 0 makes motors instant. Default is 1.
+            transaction_time (float, optional): Seconds each bus transaction takes, 100 kHz I2C is about 0.5 ms. Default is 0.0005.
+            read_error_rate (float, optional): Probability of a read raising OSError. Default is 0.
+            write_error_rate (float, optional): Probability of a write raising OSError. Default is 0.
+            seed (int, optional): Seed for the error injection.
+        """
+        self.transaction_time = transaction_time
+        self.read_error_rate = read_error_rate
+        self.write_error_rate = write_error_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+
+        self.control = CONTROL_IDLE
+        self.motors = {register: SimulatedMotor(startup * time_scale, spring * time_scale)
+                       for register, (startup, spring) in MOTOR_TIMINGS.items()}
+
+        # statistics
+        self.reads = 0
+        self.writes = 0
+        self.errors = 0
+        self.fail_next_reads = 0
+
+    def fail_next(self, reads: int = 1):
+        """Makes the next `reads` reads fail, regardless of the error rate."""
+        self.fail_next_reads += reads
+
+    def _transaction(self):
+        if self.transaction_time > 0:
+            time.sleep(self.transaction_time)
+
+    def write_byte_data(self, i2c_addr, register, value, force=None):
+        self._transaction()
+        with self.lock:
+            self.writes += 1
+            if self.rng.random() < self.write_error_rate:
+                self.errors += 1
+                raise OSError(121, "Remote I/O error")
+
+            now = time.monotonic()
+            if register == DIRECT_CONTROL_REG:
+                if value == CONTROL_REQUESTED and self.control != CONTROL_UNDER_CONTROL:
+                    self.control = CONTROL_UNDER_CONTROL
+                elif value == CONTROL_LEAVE and self.control == CONTROL_UNDER_CONTROL:
+                    self.control = CONTROL_IDLE
+            elif register in self.motors:
+                self.motors[register].request(value, now)
+
+    def read_byte_data(self, i2c_addr, register, force=None):
+        self._transaction()
+        with self.lock:
+            self.reads += 1
+            if self.fail_next_reads > 0 or self.rng.random() < self.read_error_rate:
+                self.fail_next_reads = max(self.fail_next_reads - 1, 0)
+                self.errors += 1
+                raise OSError(121, "Remote I/O error")
+
+            if register == CONTROL_STATUS:
+                return self.control
+            if register in STATUS_REGISTERS:
+                motor = self.motors[STATUS_REGISTERS[register]]
+                motor.update(time.monotonic())
+                return motor.state
+            return 0
+
+    def read_i2c_block_data(self, i2c_addr, register, length, force=None):
+        self._transaction()
+        with self.lock:
+            self.reads += 1
+            if self.fail_next_reads > 0 or self.rng.random() < self.read_error_rate:
+                self.fail_next_reads = max(self.fail_next_reads - 1, 0)
+                self.errors += 1
+                raise OSError(121, "Remote I/O error")
+
+            if register != ALL_STATUS:
+                return [0xFF] * length
+
+            now = time.monotonic()
+            values = [self.control]
+            for status_register in (MOUTH_STATUS, TAIL_STATUS, HEAD_STATUS):
+                motor = self.motors[STATUS_REGISTERS[status_register]]
+                motor.update(now)
+                values.append(motor.state)
+            return values[:length]
+
+    def close(self):
+        pass
@@ -0,0 +1,152 @@
+import glob
+import os
+from typing import List, Optional
+
+import cv2
+import numpy as np
+
+
+class FrameSource:
+    """
+    Something AgeClassifier can pull BGR frames from.
+
+    `read()` returns None when the source is exhausted, which AgeClassifier
+    treats the same way as a camera stream ending.
+    """
+
+    def start(self):
+        pass
+
+    def read(self) -> Optional[np.ndarray]:
+        raise NotImplementedError
+
+    def stop(self):
+        pass
+
+
+class PicameraFrameSource(FrameSource):
+    def __init__(self, frame_width: int = 320, frame_height: int = 240):
+        # picamera2 is only available on the Raspberry PI
+        from picamera2 import Picamera2
+
+        self.picam2 = Picamera2()
+        config = self.picam2.create_preview_configuration(
+            main={"format": 'RGB888', "size": (frame_width, frame_height)})
+        self.picam2.configure(config)
+
+    def start(self):
+        self.picam2.start()
+
+    def read(self) -> Optional[np.ndarray]:
+        return self.picam2.capture_array()
+
+    def stop(self):
+        self.picam2.stop()
+
+
+class VideoFileFrameSource(FrameSource):
+    def __init__(self, path: str, frame_width: int = 320, frame_height: int = 240, loop: bool = False):
+        """
+        Replays recorded footage.
+
+        Args:
+            path (str): Path to any video file OpenCV can decode.
+            frame_width (int, optional): Frames are resized to this width to match the camera. Default is 320.
+            frame_height (int, optional): Frames are resized to this height to match the camera. Default is 240.
+            loop (bool, optional): Start over when the end of the file is reached. Default is False.
+        """
+        self.path = path
+        self.size = (frame_width, frame_height)
+        self.loop = loop
+        self.capture = None
+
+    def start(self):
+        self.capture = cv2.VideoCapture(self.path)
+        if not self.capture.isOpened():
+            raise ValueError(f"Unable to open video file '{self.path}'")
+
+    def read(self) -> Optional[np.ndarray]:
+        ok, frame = self.capture.read()
+        if not ok and self.loop:
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ok, frame = self.capture.read()
+
+        if not ok:
+            return None
+
+        return cv2.resize(frame, self.size)
+
+    def stop(self):
+        if self.capture is not None:
+            self.capture.release()
+            self.capture = None
+
+
+class ImageDirectoryFrameSource(FrameSource):
+    EXTENSIONS = ('*.jpg', '*.jpeg', '*.png', '*.bmp')
+
+    def __init__(self, path: str, frame_width: int = 320, frame_height: int = 240, loop: bool = False):
+        self.size = (frame_width, frame_height)
+        self.loop = loop
+        self.files: List[str] = sorted(
+            f for ext in self.EXTENSIONS for f in glob.glob(os.path.join(path, ext)))
+        if not self.files:
+            raise ValueError(f"No images found in '{path}'")
+        self.position = 0
+
+    def start(self):
+        self.position = 0
+
+    def read(self) -> Optional[np.ndarray]:
+        if self.position >= len(self.files):
+            if not self.loop:
+                return None
+            self.position = 0
+
+        frame = cv2.imread(self.files[self.position])
+        self.position += 1
+        if frame is None:
+            return None
+
+        return cv2.resize(frame, self.size)
+
+
+class SyntheticFrameSource(FrameSource):
+    def __init__(self, frame_width: int = 320, frame_height: int = 240,
+                 frame_count: int = 300, seed: int = 0):
+        """
+        Generates frames without any camera or footage: a noisy background
+        with a bright blob drifting across it. Useful to measure the raw cost
+        of the pipeline, not the accuracy.
+        """
+        self.frame_width = frame_width
+        self.frame_height = frame_height
+        self.frame_count = frame_count
+        self.seed = seed
+        self.position = 0
+        self.rng = None
+
+    def start(self):
+        self.position = 0
+        self.rng = np.random.default_rng(self.seed)
+
+    def read(self) -> Optional[np.ndarray]:
+        if self.position >= self.frame_count:
+            return None
+
+        frame = self.rng.integers(0, 32, (self.frame_height, self.frame_width, 3),
+                                  dtype=np.uint8)
+        x = (self.position * 4) % self.frame_width
+        cv2.circle(frame, (x, self.frame_height // 2),
+                   self.frame_height // 6, (200, 180, 160), -1)
+        self.position += 1
+        return frame
+
+
+def open_frame_source(path: str, frame_width: int = 320, frame_height: int = 240) -> FrameSource:
+    """Pick a frame source for `path`: a directory of images, 'synthetic' or a video file."""
+    if path == 'synthetic':
+        return SyntheticFrameSource(frame_width, frame_height)
+    if os.path.isdir(path):
+        return ImageDirectoryFrameSource(path, frame_width, frame_height)
+    return VideoFileFrameSource(path, frame_width, frame_height)
@@ -0,0 +1,99 @@
+import numpy as np
+
+from .choreography import CompiledTimeline
+
+
+class LipSync:
+    def __init__(self, samplerate: int, hop: float = 0.02,
+                 open_threshold: float = 0.3, close_threshold: float = 0.15,
+                 min_open: float = 0.25, min_closed: float = 0.2, peak_decay: float = 0.999):
+        """
+        Turns the loudness of the audio into mouth open/close moves.
+
+        An RMS envelope is computed over `hop` long frames. The mouth opens when
+        the envelope rises above `open_threshold` and closes when it drops below
+        `close_threshold` (both relative to the reference level), so a level
+        hovering around one threshold doesn't make the mouth chatter. Each pose
+        is held at least `min_open`/`min_closed` seconds, which is about what
+        the motors need to get there (MOUTH_STARTUP_TIME / MOUTH_SPRING_TIME).
+
+        Works on a whole clip at once (`timeline`) or on chunks as they arrive
+        (`feed`), where the reference level is the running peak.
+        """
+        self.samplerate = samplerate
+        self.hop_samples = max(int(samplerate * hop), 1)
+        self.open_threshold = open_threshold
+        self.close_threshold = close_threshold
+        self.min_open = min_open
+        self.min_closed = min_closed
+        self.peak_decay = peak_decay
+        self.reset()
+
+    def reset(self, reference: float = None):
+        self.reference = reference
+        self.peak = 0.0
+        self.pending = np.zeros(0, dtype=np.float32)
+        self.frames_seen = 0
+        self.is_open = False
+        self.last_change = -self.min_closed
+
+    def envelope(self, samples: np.ndarray) -> np.ndarray:
+        """RMS per full frame, the remainder is kept for the next call."""
+        if samples.ndim > 1:
+            samples = samples.mean(axis=1)
+        samples = np.concatenate((self.pending, samples.astype(np.float32, copy=False)))
+
+        frames = len(samples) // self.hop_samples
+        used = frames * self.hop_samples
+        self.pending = samples[used:]
+
+        framed = samples[:used].reshape(frames, self.hop_samples)
+        return np.sqrt(np.mean(np.square(framed), axis=1))
+
+    def feed(self, samples: np.ndarray) -> CompiledTimeline:
+        """Mouth moves for the next chunk, offsets are from the start of the audio."""
+        return self._events(self.envelope(samples))
+
+    def _events(self, envelope: np.ndarray) -> CompiledTimeline:
+        events = []
+        hop = self.hop_samples / self.samplerate
+
+        for level in envelope.tolist():
+            t = self.frames_seen * hop
+            self.frames_seen += 1
+
+            reference = self.reference
+            if reference is None:
+                self.peak = max(self.peak * self.peak_decay, level)
+                reference = self.peak
+            if reference <= 0:
+                continue
+
+            relative = level / reference
+            held = t - self.last_change
+            if not self.is_open and relative > self.open_threshold and held >= self.min_closed:
+                self.is_open = True
+                self.last_change = t
+                events.append((t, "mouth_open"))
+            elif self.is_open and relative < self.close_threshold and held >= self.min_open:
+                self.is_open = False
+                self.last_change = t
+                events.append((t, "mouth_close"))
+
+        return events
+
+    def finish(self) -> CompiledTimeline:
+        """Closes the mouth at the end of the audio if it's still open."""
+        if not self.is_open:
+            return []
+        self.is_open = False
+        t = max(self.frames_seen * self.hop_samples / self.samplerate,
+                self.last_change + self.min_open)
+        return [(t, "mouth_close")]
+
+    def timeline(self, samples: np.ndarray) -> CompiledTimeline:
+        """Mouth moves for a whole clip, levels are relative to its loud parts."""
+        self.reset()
+        envelope = self.envelope(samples)
+        self.reference = float(np.percentile(envelope, 95)) if len(envelope) else 0.0
+        return self._events(envelope) + self.finish()
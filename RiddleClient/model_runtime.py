@@ -0,0 +1,126 @@
+import os
+
+import cv2
+import numpy as np
+
+FACE_INPUT_SIZE = (300, 300)
+FACE_MEAN = (104.0, 177.0, 123.0)
+AGE_INPUT_SIZE = (227, 227)
+AGE_MEAN = (78.4263377603, 87.7689143744, 114.895847746)
+
+
+def face_blob(frame) -> np.ndarray:
+    """Prepares a BGR frame for the SSD face detector."""
+    return cv2.dnn.blobFromImage(cv2.resize(frame, FACE_INPUT_SIZE),
+                                 1.0, FACE_INPUT_SIZE, FACE_MEAN)
+
+
+def age_blob(face) -> np.ndarray:
+    """Prepares a BGR face crop for the age net."""
+    return cv2.dnn.blobFromImage(face, 1.0, AGE_INPUT_SIZE, AGE_MEAN, swapRB=False)
+
+
+class ModelRuntime:
+    """A loaded network which turns an input blob into its raw output."""
+
+    def forward(self, blob: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+
+class OpenCVRuntime(ModelRuntime):
+    BACKENDS = {
+        'default': cv2.dnn.DNN_BACKEND_DEFAULT,
+        'opencv': cv2.dnn.DNN_BACKEND_OPENCV,
+        'openvino': cv2.dnn.DNN_BACKEND_INFERENCE_ENGINE,
+        'vulkan': cv2.dnn.DNN_BACKEND_VKCOM,
+        'cuda': cv2.dnn.DNN_BACKEND_CUDA,
+    }
+    TARGETS = {
+        'cpu': cv2.dnn.DNN_TARGET_CPU,
+        'opencl': cv2.dnn.DNN_TARGET_OPENCL,
+        'opencl_fp16': cv2.dnn.DNN_TARGET_OPENCL_FP16,
+        'vulkan': cv2.dnn.DNN_TARGET_VULKAN,
+        'cuda': cv2.dnn.DNN_TARGET_CUDA,
+        'cuda_fp16': cv2.dnn.DNN_TARGET_CUDA_FP16,
+    }
+
+    def __init__(self, proto_path: str, model_path: str, backend: str = 'default', target: str = 'cpu'):
+        """
+        Runs a network through cv2.dnn.
+
+        Args:
+            proto_path (str): Caffe architecture file, ignored for ONNX models.
+            model_path (str): Caffe weights or an ONNX model (including int8 quantized ones).
+            backend (str, optional): One of BACKENDS. Default is 'default'.
+            target (str, optional): One of TARGETS. Default is 'cpu'.
+        """
+        if backend not in self.BACKENDS:
+            raise ValueError(f"Unknown OpenCV DNN backend '{backend}'")
+        if target not in self.TARGETS:
+            raise ValueError(f"Unknown OpenCV DNN target '{target}'")
+
+        if model_path.endswith('.onnx'):
+            self.net = cv2.dnn.readNetFromONNX(model_path)
+        else:
+            self.net = cv2.dnn.readNetFromCaffe(proto_path, model_path)
+
+        self.net.setPreferableBackend(self.BACKENDS[backend])
+        self.net.setPreferableTarget(self.TARGETS[target])
+
+    def forward(self, blob: np.ndarray) -> np.ndarray:
+        self.net.setInput(blob)
+        return self.net.forward()
+
+
+class OnnxRuntime(ModelRuntime):
+    def __init__(self, model_path: str, threads: int = 0):
+        """
+        Runs an ONNX model through ONNX Runtime on the CPU.
+
+        Args:
+            model_path (str): Path to the ONNX model, usually the int8 quantized one.
+            threads (int, optional): Intra-op threads, 0 lets ONNX Runtime decide. Default is 0.
+        """
+        # onnxruntime is optional on the Raspberry PI
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(
+            model_path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def forward(self, blob: np.ndarray) -> np.ndarray:
+        return self.session.run(None, {self.input_name: blob.astype(np.float32, copy=False)})[0]
+
+
+def runtime_from_env(prefix: str, proto_path: str, model_path: str) -> ModelRuntime:
+    """
+    Builds a runtime for one network from the environment (.env):
+
+        <prefix>_RUNTIME   'opencv' (default) or 'onnxruntime'
+        <prefix>_ONNX      ONNX model to use instead of the Caffe one
+        DNN_BACKEND        OpenCV backend, see OpenCVRuntime.BACKENDS
+        DNN_TARGET         OpenCV target, see OpenCVRuntime.TARGETS
+        DNN_THREADS        ONNX Runtime intra-op threads
+
+    e.g. prefix 'FACE_NET' reads FACE_NET_RUNTIME and FACE_NET_ONNX.
+    """
+    runtime = os.getenv(f"{prefix}_RUNTIME", "opencv")
+    onnx_path = os.getenv(f"{prefix}_ONNX")
+
+    if runtime == "onnxruntime":
+        if not onnx_path:
+            raise ValueError(f"{prefix}_RUNTIME is onnxruntime, but {prefix}_ONNX is not set")
+        return OnnxRuntime(onnx_path, threads=int(os.getenv("DNN_THREADS", "0")))
+
+    if runtime == "opencv":
+        return OpenCVRuntime(
+            proto_path,
+            onnx_path or model_path,
+            backend=os.getenv("DNN_BACKEND", "default"),
+            target=os.getenv("DNN_TARGET", "cpu"),
+        )
+
+    raise ValueError(f"Unknown {prefix}_RUNTIME '{runtime}'")
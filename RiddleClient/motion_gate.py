@@ -0,0 +1,66 @@
+import time
+
+import cv2
+import numpy as np
+
+
+class MotionGate:
+    def __init__(self, width: int = 80, height: int = 60, pixel_threshold: int = 15,
+                 min_changed_ratio: float = 0.01, learning_rate: float = 0.05,
+                 safety_interval: float = 3.0):
+        """
+        Cheap presence check in front of the SSD face detector.
+
+        Keeps a running average of a downscaled grayscale frame and reports
+        motion when enough pixels differ from it. The face detector only has
+        to run when something changes, while a face is being tracked, or every
+        `safety_interval` seconds in case someone walked in very slowly.
+
+        Args:
+            width (int, optional): Width of the downscaled frame. Default is 80 pixels.
+            height (int, optional): Height of the downscaled frame. Default is 60 pixels.
+            pixel_threshold (int, optional): Grayscale difference for a pixel to count as changed. Default is 15.
+            min_changed_ratio (float, optional): Share of changed pixels that counts as motion. Default is 1%.
+            learning_rate (float, optional): How fast the background adapts to slow light changes. Default is 0.05.
+            safety_interval (float, optional): Run the detector at least this often in seconds. Default is 3 seconds.
+        """
+        self.size = (width, height)
+        self.pixel_threshold = pixel_threshold
+        self.min_changed_ratio = min_changed_ratio
+        self.learning_rate = learning_rate
+        self.safety_interval = safety_interval
+
+        self.background = None
+        self.last_detector_run = 0.0
+
+    def motion(self, frame) -> bool:
+        small = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+        gray = cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), (5, 5), 0)
+
+        if self.background is None:
+            self.background = gray.astype(np.float32)
+            return True
+
+        diff = cv2.absdiff(gray, cv2.convertScaleAbs(self.background))
+        changed = np.count_nonzero(diff > self.pixel_threshold) / diff.size
+        cv2.accumulateWeighted(gray, self.background, self.learning_rate)
+
+        return changed >= self.min_changed_ratio
+
+    def should_detect(self, frame, face_present: bool) -> bool:
+        """
+        Args:
+            frame: BGR frame from the camera.
+            face_present (bool): Whether the last detector run found a face.
+                While a face is there the detector keeps running, so a player
+                standing still is not mistaken for an empty hall.
+        """
+        # always feed the frame, so the background keeps up with the scene
+        moved = self.motion(frame)
+        now = time.monotonic()
+
+        if face_present or moved or now - self.last_detector_run >= self.safety_interval:
+            self.last_detector_run = now
+            return True
+
+        return False
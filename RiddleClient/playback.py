@@ -0,0 +1,171 @@
+import asyncio
+import itertools
+from collections import deque
+
+import numpy as np
+import sounddevice as sd
+
+
+def resample(data: np.ndarray, samplerate: int, target: int) -> np.ndarray:
+    """Linear resampling, plenty for the fish speaker."""
+    if samplerate == target or len(data) == 0:
+        return data
+    length = int(round(len(data) * target / samplerate))
+    positions = np.linspace(0, len(data) - 1, length)
+    return np.interp(positions, np.arange(len(data)), data).astype(np.float32)
+
+
+class PlaybackHandle:
+    def __init__(self, clip_id, frames, loop):
+        self.clip_id = clip_id
+        self.frames = frames
+        # frame counter of the stream when the clip starts, set by the callback
+        self.start_frame = None
+        self.started = loop.create_future()
+        self.finished = loop.create_future()
+
+    def __await__(self):
+        return self.finished.__await__()
+
+
+class Segment:
+    def __init__(self, data, handle):
+        self.data = data
+        self.handle = handle
+        self.offset = 0
+
+
+class PlaybackEngine:
+    def __init__(self, samplerate: int = 48000, blocksize: int = 512, device=None):
+        """
+        Persistent sounddevice.OutputStream fed from a queue of clips.
+
+        The PortAudio callback only pops from a deque and copies into the
+        output buffer, so the asyncio loop never waits for audio and clips
+        queued back to back play without a gap. Clips are resampled to the
+        stream rate and mixed down to mono when queued.
+
+        When PortAudio aborts the stream (the device is gone) the handles of
+        everything queued finish right away, the next clip reopens it.
+
+        Args:
+            samplerate (int, optional): Rate of the output stream. Default is 48000.
+            blocksize (int, optional): Frames per callback. Default is 512.
+            device (optional): sounddevice output device. Default is the system default.
+        """
+        self.samplerate = samplerate
+        self.blocksize = blocksize
+        self.device = device
+        self.segments = deque()
+        self.ids = itertools.count(1)
+        # frames handed to PortAudio since start, only written by the callback
+        self.frames_written = 0
+        self.stream = None
+        self.loop = None
+
+    def start(self, loop: asyncio.AbstractEventLoop = None):
+        self.loop = loop or asyncio.get_running_loop()
+        self.open()
+
+    def open(self):
+        self.stream = sd.OutputStream(
+            samplerate=self.samplerate,
+            blocksize=self.blocksize,
+            channels=1,
+            dtype='float32',
+            device=self.device,
+            callback=self._callback,
+            finished_callback=self._finished,
+        )
+        self.stream.start()
+
+    def close(self):
+        self.stop_all()
+        if self.stream is not None:
+            self.stream.stop()
+            self.stream.close()
+            self.stream = None
+
+    def latency(self) -> float:
+        return self.stream.latency if self.stream is not None else 0.0
+
+    def enqueue(self, data: np.ndarray, samplerate: int) -> PlaybackHandle:
+        """Queues a clip after whatever is playing, returns its handle right away."""
+        if data.ndim > 1:
+            data = data.mean(axis=1)
+        data = resample(data.astype(np.float32, copy=False), samplerate, self.samplerate)
+
+        if self.stream is not None and not self.stream.active:
+            print("Output stream was stopped, reopening it")
+            self.stream.close()
+            self.open()
+
+        handle = PlaybackHandle(next(self.ids), len(data), self.loop)
+        self.segments.append(Segment(data, handle))
+        return handle
+
+    def stop_all(self):
+        """Drops everything queued or playing, their handles finish right away."""
+        while self.segments:
+            try:
+                segment = self.segments.popleft()
+            except IndexError:
+                break
+            self._resolve(segment.handle.started)
+            self._resolve(segment.handle.finished)
+
+    def position(self, handle: PlaybackHandle) -> float:
+        """Seconds of the clip which came out of the speaker so far, negative before it starts."""
+        if handle.start_frame is None:
+            return -1.0
+        heard = self.frames_written - handle.start_frame - self.latency() * self.samplerate
+        return min(max(heard, 0.0), handle.frames) / self.samplerate
+
+    def busy(self) -> bool:
+        return len(self.segments) > 0
+
+    def _resolve(self, future, delay=0.0):
+        def resolve():
+            if not future.done():
+                future.set_result(None)
+
+        if delay > 0:
+            self.loop.call_soon_threadsafe(self.loop.call_later, delay, resolve)
+        else:
+            self.loop.call_soon_threadsafe(resolve)
+
+    def _finished(self):
+        # runs in the PortAudio thread once the stream stopped, aborted or closed
+        self.stop_all()
+
+    def _callback(self, outdata, frames, time_info, status):
+        # runs in the PortAudio thread: no locks, no allocations beyond slicing
+        out = outdata[:, 0]
+        filled = 0
+        latency = self.latency()
+
+        while filled < frames:
+            try:
+                segment = self.segments[0]
+            except IndexError:
+                break
+            handle = segment.handle
+
+            if segment.offset == 0:
+                handle.start_frame = self.frames_written + filled
+                self._resolve(handle.started, latency)
+
+            count = min(frames - filled, len(segment.data) - segment.offset)
+            out[filled:filled + count] = segment.data[segment.offset:segment.offset + count]
+            segment.offset += count
+            filled += count
+
+            if segment.offset >= len(segment.data):
+                # stop_all() may have emptied the queue meanwhile
+                if self.segments and self.segments[0] is segment:
+                    self.segments.popleft()
+                self._resolve(handle.finished, latency)
+
+        if filled < frames:
+            out[filled:] = 0
+        self.frames_written += frames
@@ -1,30 +1,34 @@
+from typing import Dict
 from uuid import UUID
-from models.profile import UserPreference, UserPreferences
+from models.profile import UserPreference
+from models.store import PlayerStore
 
 
 class Preferences:
-    def __init__(self, json_path: str = 'RiddleClient/preferences.json'):
-        self.json_path = json_path
-        self.data = self.load()
+    def __init__(self, store_path: str = 'RiddleClient/fish.db', store: PlayerStore = None):
+        self.store_path = store_path
+        self.store = store
+        # UUID -> preference, read from the store on first use
+        self._index = None
 
-    def get(self, id: UUID) -> UserPreference:
-        for i in self.data.root:
-            if i.id == id:
-                return i
+    @property
+    def index(self) -> Dict[UUID, UserPreference]:
+        if self._index is None:
+            if self.store is None:
+                self.store = PlayerStore(self.store_path)
+            self._index = {i.id: i for i in self.store.preferences()}
+        return self._index
 
-        raise ValueError("UUID not found")
+    def get(self, id: UUID) -> UserPreference:
+        try:
+            return self.index[id]
+        except KeyError:
+            raise ValueError("UUID not found")
 
     def save(self, profile: UserPreference):
-        self.data.root.append(profile)
+        """Inserts or replaces the preferences of profile.id."""
+        if self.index.get(profile.id) == profile:
+            return
 
-        with open(self.json_path, 'w') as f:
-            f.write(self.data.model_dump_json(indent=4))
-
-    def load(self) -> UserPreferences:
-        try:
-            with open(self.json_path, 'r') as f:
-                data = f.read()
-        except FileNotFoundError:
-            return UserPreferences(root=[])
-        
-        return UserPreferences.model_validate_json(data)
+        self.index[profile.id] = profile
+        self.store.upsert_preference(profile)
@@ -0,0 +1,96 @@
+import asyncio
+import itertools
+import time
+from typing import Dict, Optional
+
+from models.tracing import NullTracer, Tracer, current_turn
+from .choreography import CompiledTimeline
+from .fishcontroller import FishControllerStatuses
+
+
+class Puppet:
+    """
+    Riddle Client side of the FishController process.
+
+    Commands are identified by ID and don't block: `send` is fire-and-forget,
+    `run` returns an awaitable completing when the controller reports the
+    command done. Completions are read by the asyncio loop as soon as they
+    arrive, see `attach`.
+    """
+
+    def __init__(self, conn, tracer: Tracer = None):
+        self.conn = conn
+        self.tracer = tracer if tracer is not None else NullTracer()
+        self.ids = itertools.count(1)
+        # command ID: future of whoever awaits it (None if nobody does)
+        self.pending: Dict[int, Optional[asyncio.Future]] = {}
+        self.loop = None
+
+    def attach(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        loop.add_reader(self.conn.fileno(), self._drain)
+
+    def detach(self):
+        if self.loop is not None:
+            self.loop.remove_reader(self.conn.fileno())
+            self.loop = None
+
+    def send(self, action: str, *args) -> int:
+        cmd_id = next(self.ids)
+        self.pending[cmd_id] = None
+        self.conn.send((cmd_id, action, args))
+        return cmd_id
+
+    def run(self, action: str, *args) -> asyncio.Future:
+        start = time.perf_counter()
+        turn = current_turn.get()
+        future = self.completion(self.send(action, *args))
+        future.add_done_callback(lambda _: self.tracer.record(
+            f"puppet.{action}", time.perf_counter() - start, turn=turn))
+        return future
+
+    def play(self, timeline: CompiledTimeline) -> int:
+        """
+        Sends the whole timeline in one message, the controller schedules it
+        from the moment it's received. Completes when the timeline is over or
+        cancelled.
+        """
+        return self.send("play_timeline", timeline)
+
+    def cancel_timeline(self) -> int:
+        return self.send("cancel_timeline")
+
+    def completion(self, cmd_id: int) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        if cmd_id not in self.pending:
+            future.set_result(cmd_id)
+        else:
+            self.pending[cmd_id] = future
+        return future
+
+    def done(self, cmd_id: int) -> bool:
+        return cmd_id not in self.pending
+
+    def wait_blocking(self, cmd_id: int, timeout: float = 10):
+        """For synchronous callers which really have to wait for the motor."""
+        while not self.done(cmd_id):
+            if not self.conn.poll(timeout):
+                print(f"puppet command {cmd_id} timed out")
+                return
+            self._drain()
+
+    def _drain(self):
+        try:
+            while self.conn.poll():
+                status, cmd_id = self.conn.recv()
+                if status == FishControllerStatuses.ACTION_TIMED_OUT:
+                    print(f"puppet command {cmd_id} timed out on the controller")
+                self._complete(cmd_id)
+        except EOFError:
+            print("puppet controller went away")
+            self.detach()
+
+    def _complete(self, cmd_id: int):
+        future = self.pending.pop(cmd_id, None)
+        if future is not None and not future.done():
+            future.set_result(cmd_id)
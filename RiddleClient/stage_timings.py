@@ -0,0 +1,53 @@
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Iterable
+
+import numpy as np
+
+
+class StageTimings:
+    """Collects wall-clock durations per named pipeline stage."""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+
+    @contextmanager
+    def measure(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.samples[stage].append(time.perf_counter() - start)
+
+    def record(self, stage: str, seconds: float):
+        self.samples[stage].append(seconds)
+
+    def count(self, stage: str) -> int:
+        return len(self.samples.get(stage, []))
+
+    def percentiles(self, stage: str, q: Iterable[float] = (50, 95, 99)) -> Dict[float, float]:
+        """Returns percentiles of the stage duration in milliseconds."""
+        values = self.samples.get(stage)
+        if not values:
+            return {p: 0.0 for p in q}
+        result = np.percentile(np.asarray(values) * 1000.0, list(q))
+        return dict(zip(q, result.tolist()))
+
+    def report(self) -> str:
+        lines = [f"{'stage':<12} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"]
+        for stage in self.samples:
+            p = self.percentiles(stage)
+            lines.append(
+                f"{stage:<12} {self.count(stage):>7} {p[50]:>9.2f} {p[95]:>9.2f} {p[99]:>9.2f}")
+        return "\n".join(lines)
+
+
+class NullStageTimings(StageTimings):
+    """Does not keep anything - used when nobody is benchmarking."""
+
+    def measure(self, stage: str):
+        return nullcontext()
+
+    def record(self, stage: str, seconds: float):
+        pass
@@ -0,0 +1,110 @@
+import io
+
+import numpy as np
+import soundfile as sf
+
+# what Whisper works with, anything above is thrown away on the server
+WHISPER_RATE = 16000
+
+# codec: (soundfile format, subtype), pcm_s16le is sent as raw samples
+FORMATS = {
+    "wav": ("WAV", "PCM_16"),
+    "flac": ("FLAC", "PCM_16"),
+    "opus": ("OGG", "OPUS"),
+}
+
+
+def lowpass_kernel(cutoff: float, taps: int = 63) -> np.ndarray:
+    """Windowed sinc, cutoff in cycles per sample."""
+    n = np.arange(taps) - (taps - 1) / 2
+    kernel = 2 * cutoff * np.sinc(2 * cutoff * n) * np.hamming(taps)
+    return (kernel / kernel.sum()).astype(np.float32)
+
+
+class Resampler:
+    def __init__(self, samplerate: int, target: int = WHISPER_RATE):
+        """
+        Streaming resampler, chunks can be fed as they come from the mic
+        without clicks at the chunk borders.
+
+        Uses soxr when it's installed. Otherwise low-pass filters with a
+        windowed sinc and interpolates linearly, which is plenty for speech
+        recognition.
+
+        Args:
+            samplerate (int): Rate of the input.
+            target (int, optional): Rate of the output. Default is WHISPER_RATE.
+        """
+        self.samplerate = samplerate
+        self.target = target
+        self.ratio = samplerate / target
+        self.stream = None
+
+        try:
+            import soxr
+            self.stream = soxr.ResampleStream(samplerate, target, 1, dtype='float32')
+        except ImportError:
+            self.kernel = lowpass_kernel(0.45 * min(1.0, target / samplerate))
+            self.history = np.zeros(len(self.kernel) - 1, dtype=np.float32)
+            # last filtered sample of the previous chunk, to interpolate across the border
+            self.previous = np.zeros(1, dtype=np.float32)
+            # next output position, in samples from self.previous
+            self.position = 1.0
+
+    def process(self, samples: np.ndarray, last: bool = False) -> np.ndarray:
+        if self.samplerate == self.target:
+            return samples
+        if self.stream is not None:
+            return self.stream.resample_chunk(samples, last=last)
+        if len(samples) == 0:
+            return samples
+
+        extended = np.concatenate((self.history, samples))
+        self.history = extended[len(extended) - len(self.history):]
+        filtered = np.concatenate((self.previous, np.convolve(extended, self.kernel, mode='valid')))
+        self.previous = filtered[-1:]
+
+        end = len(filtered) - 1
+        positions = np.arange(self.position, end + 1e-9, self.ratio)
+        out = np.interp(positions, np.arange(len(filtered)), filtered)
+        self.position = (positions[-1] + self.ratio if len(positions) else self.position) - end
+        return out.astype(np.float32)
+
+
+class UploadEncoder:
+    def __init__(self, samplerate: int, codec: str = "flac", channels: int = 1, target_rate: int = WHISPER_RATE):
+        """
+        Turns 16 bit PCM from the mic into what goes over the Wi-Fi: mono,
+        resampled to the rate Whisper uses and optionally compressed.
+
+        Every chunk is encoded on its own, so the server can decode it as soon
+        as it arrives.
+
+        Args:
+            samplerate (int): Rate of the mic.
+            codec (str, optional): One of pcm_s16le, wav, flac or opus. Default is flac.
+            channels (int, optional): Interleaved channels of the input, mixed down to one. Default is 1.
+            target_rate (int, optional): Rate sent to the server. Default is WHISPER_RATE.
+        """
+        if codec != "pcm_s16le" and codec not in FORMATS:
+            raise ValueError(f"Unknown upload codec '{codec}'")
+        self.codec = codec
+        self.channels = channels
+        self.target_rate = target_rate
+        self.resampler = Resampler(samplerate, target_rate)
+
+    def encode(self, pcm: bytes, last: bool = False) -> bytes:
+        samples = np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768
+        if self.channels > 1:
+            samples = samples.reshape(-1, self.channels).mean(axis=1)
+        samples = self.resampler.process(samples, last=last)
+
+        if self.codec == "pcm_s16le":
+            return (np.clip(samples, -1, 1) * 32767).astype('<i2').tobytes()
+        if len(samples) == 0 and self.codec != "wav":
+            return b""
+
+        file_format, subtype = FORMATS[self.codec]
+        buffer = io.BytesIO()
+        sf.write(buffer, samples, self.target_rate, format=file_format, subtype=subtype)
+        return buffer.getvalue()
@@ -0,0 +1,139 @@
+from enum import Enum
+from typing import List, Tuple
+
+import numpy as np
+
+
+class VoiceActivityDetector:
+    def __init__(self, samplerate: int, frame: float = 0.02, threshold_ratio: float = 3.0,
+                 min_energy: float = 200.0, max_zcr: float = 0.3, noise_adapt: float = 0.05,
+                 initial_noise: float = 500.0):
+        """
+        Frame level speech detection on 16 bit PCM.
+
+        A frame is speech when its RMS energy is `threshold_ratio` times above
+        the noise floor. Frames with a high zero-crossing rate need twice the
+        energy, which keeps hiss and fan noise out while fricatives at normal
+        speaking volume still pass. The noise floor follows the energy of the
+        non-speech frames, so the threshold adapts to the room instead of being
+        fixed.
+
+        Args:
+            samplerate (int): Sample rate of the audio.
+            frame (float, optional): Frame length in seconds. Default is 0.02.
+            threshold_ratio (float, optional): Speech energy relative to the noise floor. Default is 3.
+            min_energy (float, optional): Lower bound of the threshold in int16 RMS units. Default is 200.
+            max_zcr (float, optional): Zero-crossing rate above which a frame looks like noise. Default is 0.3.
+            noise_adapt (float, optional): How fast the noise floor follows non-speech frames. Default is 0.05.
+            initial_noise (float, optional): Noise floor until calibrated. Default is 500.
+        """
+        self.samplerate = samplerate
+        self.frame_size = max(int(samplerate * frame), 1)
+        self.threshold_ratio = threshold_ratio
+        self.min_energy = min_energy
+        self.max_zcr = max_zcr
+        self.noise_adapt = noise_adapt
+        self.noise = initial_noise
+
+    @property
+    def threshold(self) -> float:
+        return max(self.noise * self.threshold_ratio, self.min_energy)
+
+    @staticmethod
+    def analyse(frame: np.ndarray) -> Tuple[float, float]:
+        """RMS energy and zero-crossing rate of a frame of samples."""
+        samples = frame.astype(np.float32)
+        energy = float(np.sqrt(np.mean(np.square(samples))))
+        signs = np.signbit(samples)
+        zcr = float(np.count_nonzero(signs[1:] != signs[:-1])) / max(len(samples) - 1, 1)
+        return energy, zcr
+
+    def calibrate(self, samples: np.ndarray):
+        """Sets the noise floor from audio known to hold no speech."""
+        frames = len(samples) // self.frame_size
+        if frames == 0:
+            return
+        framed = samples[:frames * self.frame_size].reshape(frames, self.frame_size)
+        energies = np.sqrt(np.mean(np.square(framed.astype(np.float32)), axis=1))
+        self.noise = float(np.median(energies))
+
+    def is_speech(self, frame: np.ndarray) -> bool:
+        energy, zcr = self.analyse(frame)
+        threshold = self.threshold
+        if zcr > self.max_zcr:
+            threshold *= 2
+
+        speech = energy > threshold
+        if not speech:
+            self.noise += self.noise_adapt * (energy - self.noise)
+        return speech
+
+
+class EndpointerStates(Enum):
+    WAITING = 1
+    SPEAKING = 2
+    ENDED = 3
+    TIMED_OUT = 4
+
+
+class Endpointer:
+    def __init__(self, frame_duration: float, start_speech: float = 0.1, trailing_silence: float = 0.8,
+                 max_phrase: float = 15.0, no_speech_timeout: float = None, pre_roll: float = 0.3):
+        """
+        Decides where a phrase starts and ends from the per frame VAD decisions.
+
+        Args:
+            frame_duration (float): Seconds per frame.
+            start_speech (float, optional): Speech needed in a row before the phrase starts. Default is 0.1.
+            trailing_silence (float, optional): Silence which ends the phrase. Default is 0.8.
+            max_phrase (float, optional): Longest phrase, it ends there regardless. Default is 15.
+            no_speech_timeout (float, optional): Give up when no phrase started in this time. Default is to wait forever.
+            pre_roll (float, optional): Audio kept from before the start, so the first syllable isn't clipped. Default is 0.3.
+        """
+        self.frame_duration = frame_duration
+        self.start_frames = max(int(round(start_speech / frame_duration)), 1)
+        self.trailing_frames = max(int(round(trailing_silence / frame_duration)), 1)
+        self.max_frames = int(max_phrase / frame_duration)
+        self.timeout_frames = int(no_speech_timeout / frame_duration) if no_speech_timeout else None
+        self.pre_roll_frames = max(int(round(pre_roll / frame_duration)), self.start_frames)
+        self.reset()
+
+    def reset(self):
+        self.state = EndpointerStates.WAITING
+        self.pre_roll = []
+        self.speech_run = 0
+        self.silence_run = 0
+        self.frames_waiting = 0
+        self.frames_in_phrase = 0
+
+    @property
+    def done(self) -> bool:
+        return self.state in (EndpointerStates.ENDED, EndpointerStates.TIMED_OUT)
+
+    def push(self, frame: bytes, speech: bool) -> List[bytes]:
+        """Feeds one frame, returns the frames which belong to the phrase."""
+        if self.state == EndpointerStates.WAITING:
+            self.frames_waiting += 1
+            self.pre_roll.append(frame)
+            if len(self.pre_roll) > self.pre_roll_frames:
+                self.pre_roll.pop(0)
+
+            self.speech_run = self.speech_run + 1 if speech else 0
+            if self.speech_run >= self.start_frames:
+                self.state = EndpointerStates.SPEAKING
+                frames, self.pre_roll = self.pre_roll, []
+                self.frames_in_phrase = len(frames)
+                return frames
+
+            if self.timeout_frames is not None and self.frames_waiting >= self.timeout_frames:
+                self.state = EndpointerStates.TIMED_OUT
+            return []
+
+        if self.state == EndpointerStates.SPEAKING:
+            self.frames_in_phrase += 1
+            self.silence_run = 0 if speech else self.silence_run + 1
+            if self.silence_run >= self.trailing_frames or self.frames_in_phrase >= self.max_frames:
+                self.state = EndpointerStates.ENDED
+            return [frame]
+
+        return []
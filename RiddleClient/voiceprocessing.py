@@ -1,8 +1,22 @@
-from pyaudio import PyAudio
+import asyncio
+import numpy as np
+from pyaudio import PyAudio, paContinue, paInt16
 import speech_recognition as sr
 
+from .upload_codec import UploadEncoder
+from .vad import Endpointer, VoiceActivityDetector
+
 class VoiceProcessing:
-    def __init__(self, mic_index=1, sample_rate=44100, chunk_size=2048, energy_threshold=1500):
+    def __init__(self, mic_index=1, sample_rate=44100, chunk_size=2048, energy_threshold=1500,
+                 trailing_silence=0.8, max_phrase=15.0):
+        self.mic_index = mic_index
+        self.sample_rate = sample_rate
+        self.trailing_silence = trailing_silence
+        self.max_phrase = max_phrase
+        # energy_threshold is only the starting point, the VAD adapts to the room
+        self.vad = VoiceActivityDetector(sample_rate)
+        self.vad.noise = energy_threshold / self.vad.threshold_ratio
+
         self.p = PyAudio()
         for i in range(self.p.get_host_api_count()):
             print(self.p.get_device_info_by_index(i))
@@ -17,6 +31,7 @@ class VoiceProcessing:
     def calibrate(self, duration=1):
         with self.m as source:
             self.r.adjust_for_ambient_noise(source, duration)
+            self.vad.noise = self.r.energy_threshold / self.r.dynamic_energy_ratio
             return True
         return False
 
@@ -26,3 +41,64 @@ class VoiceProcessing:
     def listen(self, phrase_time_limit=3):
         with self.m as source:
             return self.r.listen(source, phrase_time_limit=phrase_time_limit)
+
+    async def stream_phrase(self, stop: asyncio.Event = None, chunk_duration=0.25, no_speech_timeout=None):
+        """
+        Captures one phrase and yields it as 16 bit mono PCM chunks while the
+        player is still speaking.
+
+        The phrase starts on the first speech frames (plus a bit of pre-roll)
+        and ends after `trailing_silence` seconds of silence or `max_phrase`
+        seconds. Nothing more is yielded once `stop` is set.
+
+        Args:
+            stop (asyncio.Event, optional): Aborts the capture when set.
+            chunk_duration (float, optional): Seconds of audio per yielded chunk. Default is 0.25.
+            no_speech_timeout (float, optional): Give up when nobody starts talking in this time. Default is to wait.
+        """
+        loop = asyncio.get_running_loop()
+        frames = asyncio.Queue()
+
+        def callback(in_data, frame_count, time_info, status):
+            # PortAudio thread
+            loop.call_soon_threadsafe(frames.put_nowait, in_data)
+            return None, paContinue
+
+        endpointer = Endpointer(self.vad.frame_size / self.sample_rate,
+                                trailing_silence=self.trailing_silence,
+                                max_phrase=self.max_phrase,
+                                no_speech_timeout=no_speech_timeout)
+        chunk = bytearray()
+        chunk_bytes = int(chunk_duration * self.sample_rate) * 2
+
+        stream = self.p.open(format=paInt16, channels=1, rate=self.sample_rate, input=True,
+                             input_device_index=self.mic_index,
+                             frames_per_buffer=self.vad.frame_size,
+                             stream_callback=callback)
+        try:
+            while not endpointer.done:
+                if stop is not None and stop.is_set():
+                    return
+                try:
+                    data = await asyncio.wait_for(frames.get(), 0.1)
+                except asyncio.TimeoutError:
+                    continue
+
+                speech = self.vad.is_speech(np.frombuffer(data, dtype=np.int16))
+                for frame in endpointer.push(data, speech):
+                    chunk += frame
+
+                if len(chunk) >= chunk_bytes:
+                    yield bytes(chunk)
+                    chunk.clear()
+
+            if chunk:
+                yield bytes(chunk)
+        finally:
+            stream.stop_stream()
+            stream.close()
+
+    async def record(self, stop: asyncio.Event = None, no_speech_timeout=None, codec="wav") -> bytes:
+        """Captures one phrase with the same endpointing, returns it encoded at 16 kHz mono."""
+        chunks = [chunk async for chunk in self.stream_phrase(stop, no_speech_timeout=no_speech_timeout)]
+        return UploadEncoder(self.sample_rate, codec).encode(b"".join(chunks), last=True)
@@ -0,0 +1,183 @@
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Dict
+
+
+class Overloaded(Exception):
+    """A stage has no room, the work is shed instead of queued."""
+
+    def __init__(self, stage: str):
+        super().__init__(f"stage '{stage}' is overloaded")
+        self.stage = stage
+
+
+class Busy(Exception):
+    """The client already has a turn being processed."""
+    pass
+
+
+class Stage:
+    def __init__(self, name: str, concurrency: int, max_queue: int):
+        """
+        Runs at most `concurrency` jobs at once, at most `max_queue` more wait
+        for a slot. Anything beyond that is rejected right away.
+        """
+        self.name = name
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.active = 0
+        self.waiters = deque()
+        self.admitted = 0
+        self.rejected = 0
+
+    @property
+    def depth(self) -> int:
+        return len(self.waiters)
+
+    async def acquire(self, wait: bool = True):
+        """
+        Takes a slot, it has to be given back with `release()`.
+
+        Args:
+            wait (bool, optional): Queue when all slots are taken, speculative work passes False to never queue. Default is True.
+        """
+        if self.active >= self.concurrency or self.waiters:
+            if not wait or len(self.waiters) >= self.max_queue:
+                self.rejected += 1
+                raise Overloaded(self.name)
+            waiter = asyncio.get_running_loop().create_future()
+            self.waiters.append(waiter)
+            try:
+                # the slot is handed over by the job finishing
+                await waiter
+            except asyncio.CancelledError:
+                if waiter in self.waiters:
+                    self.waiters.remove(waiter)
+                elif not waiter.cancelled():
+                    # got the slot while being cancelled, pass it on
+                    self.release()
+                raise
+        else:
+            self.active += 1
+        self.admitted += 1
+
+    @asynccontextmanager
+    async def slot(self, wait: bool = True):
+        await self.acquire(wait)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def release(self):
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self) -> dict:
+        return {"active": self.active, "depth": self.depth, "concurrency": self.concurrency,
+                "max_queue": self.max_queue, "admitted": self.admitted, "rejected": self.rejected}
+
+
+class AdmissionController:
+    def __init__(self, stages: Dict[str, tuple]):
+        """
+        Bounded stages of a turn and the limit of one turn in flight per client.
+
+        Args:
+            stages (Dict[str, tuple]): Stage name: (concurrency, max_queue).
+        """
+        self.stages = {name: Stage(name, *limits) for name, limits in stages.items()}
+        self.turns = set()
+        self.busy = 0
+        self.shed = 0
+
+    @staticmethod
+    def parse(spec: str) -> Dict[str, tuple]:
+        """Reads stages like 'stt=1/8,llm=4/16'."""
+        stages = {}
+        for item in filter(None, (i.strip() for i in spec.split(","))):
+            name, limits = item.split("=")
+            concurrency, max_queue = limits.split("/")
+            stages[name.strip()] = (int(concurrency), int(max_queue))
+        return stages
+
+    def stage(self, name: str, wait: bool = True):
+        return self.stages[name].slot(wait)
+
+    async def run(self, name: str, func, *args, wait: bool = True, **kwargs):
+        """
+        Runs the blocking func on a worker thread with a slot of the stage.
+
+        A thread can't be interrupted, so when the caller is cancelled the
+        slot is still kept until the thread is done, the stage never runs
+        more calls at once than it's allowed to.
+        """
+        stage = self.stages[name]
+        await stage.acquire(wait)
+        job = asyncio.ensure_future(asyncio.to_thread(func, *args, **kwargs))
+
+        def done(job: asyncio.Future):
+            stage.release()
+            # nobody may be waiting for it anymore
+            if not job.cancelled():
+                job.exception()
+
+        job.add_done_callback(done)
+        return await asyncio.shield(job)
+
+    @asynccontextmanager
+    async def turn(self, sid: str):
+        if sid in self.turns:
+            self.busy += 1
+            raise Busy(f"a turn of {sid} is already in flight")
+        self.turns.add(sid)
+        try:
+            yield
+        finally:
+            self.turns.discard(sid)
+
+    def stats(self) -> dict:
+        return {
+            "turns_in_flight": len(self.turns),
+            "busy_rejected": self.busy,
+            "shed": self.shed,
+            "stages": {name: stage.stats() for name, stage in self.stages.items()},
+        }
+
+    def metrics(self, prefix: str = "fish") -> str:
+        """Queue depths and rejections in the Prometheus text format."""
+        lines = [
+            f"# HELP {prefix}_stage_queue_depth Jobs waiting for a slot of the stage.",
+            f"# TYPE {prefix}_stage_queue_depth gauge",
+        ]
+        lines += [f'{prefix}_stage_queue_depth{{stage="{name}"}} {stage.depth}'
+                  for name, stage in self.stages.items()]
+        lines += [
+            f"# HELP {prefix}_stage_active Jobs running in the stage.",
+            f"# TYPE {prefix}_stage_active gauge",
+        ]
+        lines += [f'{prefix}_stage_active{{stage="{name}"}} {stage.active}'
+                  for name, stage in self.stages.items()]
+        lines += [
+            f"# HELP {prefix}_stage_rejected_total Jobs turned away because the stage was full.",
+            f"# TYPE {prefix}_stage_rejected_total counter",
+        ]
+        lines += [f'{prefix}_stage_rejected_total{{stage="{name}"}} {stage.rejected}'
+                  for name, stage in self.stages.items()]
+        lines += [
+            f"# HELP {prefix}_turns_in_flight Turns being processed, one per client at most.",
+            f"# TYPE {prefix}_turns_in_flight gauge",
+            f"{prefix}_turns_in_flight {len(self.turns)}",
+            f"# HELP {prefix}_turns_busy_total Turns refused as the client had one in flight.",
+            f"# TYPE {prefix}_turns_busy_total counter",
+            f"{prefix}_turns_busy_total {self.busy}",
+            f"# HELP {prefix}_turns_shed_total Turns answered with the canned hold on.",
+            f"# TYPE {prefix}_turns_shed_total counter",
+            f"{prefix}_turns_shed_total {self.shed}",
+        ]
+        return "\n".join(lines) + "\n"
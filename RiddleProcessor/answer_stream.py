@@ -0,0 +1,32 @@
+import time
+
+import numpy as np
+
+from models.profile import OldPlayer
+from .transcribe import decode_recording
+
+
+class AnswerStream:
+    def __init__(self, player: OldPlayer, complete: bool = True):
+        """
+        Collects the pieces of an answer the client streams while the player
+        is speaking. Pieces are kept encoded and only decoded by `audio()`,
+        which runs in the stt stage once the turn is admitted, so queued and
+        shed answers never hold decoded audio nor take the event loop.
+
+        A stream which didn't start at the first piece isn't complete, the
+        beginning went to the connection the client had before reconnecting.
+        """
+        self.player = player
+        self.complete = complete
+        self.chunks = {}
+        self.started = time.perf_counter()
+
+    def add(self, seq: int, recording: bytes, codec: str, sample_rate: int):
+        if recording:
+            self.chunks[seq] = (recording, codec, sample_rate)
+
+    def audio(self) -> np.ndarray:
+        if not self.chunks:
+            return np.zeros(0, dtype=np.float32)
+        return np.concatenate([decode_recording(*self.chunks[seq]) for seq in sorted(self.chunks)])
@@ -0,0 +1,490 @@
+"""
+Load benchmark of the Riddle Processor.
+
+Starts server.app in a process of its own, with the stand-ins of standins.py
+in place of OpenAI, AllTalk and Whisper (stubbed, or a small model on the CPU
+with --whisper tiny). The stand-ins and the simulated fish run in this
+process, so they don't compete with the processor for its GIL.
+
+N simulated fish connect over Socket.IO. Each greets as a new player with
+greet_new_player, then gives --turns answers replaying recorded WAVs, through
+give_answer_on_riddle or, with --stream, in answer_chunk pieces sent as fast
+as the player speaks, like the Riddle Client does. Reports throughput, turn
+latency percentiles and the event loop lag of the processor:
+
+    python -m RiddleProcessor.bench_server --clients 8 --turns 5 --answers recordings/*.wav --stream
+
+With thresholds it exits with 1 when one of them is exceeded, so it can gate
+a CI job:
+
+    python -m RiddleProcessor.bench_server --clients 4 --max-p95 5 --max-lag 2 --max-errors 0
+
+The loop monitor of the processor runs too, the call sites which held its
+loop are listed and --max-stalls fails the run when there are more stalls.
+"""
+import argparse
+import asyncio
+import functools
+import importlib
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+import aiohttp
+import numpy as np
+import socketio
+from aiohttp import web
+
+from models.profile import NewPlayer, OldPlayer, UserPreference
+from models.responses import PlayerVoiceChunk, PlayerVoiceStream, ResponseContinue, ResponseStop
+from models.wire import WIRE_VERSION, pack, unpack, with_binary
+from . import transcribe
+from .standins import FakeAllTalk, FakeOpenAI, StubTranscriber
+
+
+class BackgroundServer:
+    def __init__(self, app: web.Application, name: str):
+        """
+        Serves an aiohttp app on a free local port from its own thread and event loop.
+
+        Args:
+            app (web.Application): What to serve.
+            name (str): Name of the thread.
+        """
+        self.app = app
+        self.port = None
+        self.error = None
+        self.loop = asyncio.new_event_loop()
+        self.ready = threading.Event()
+        self.thread = threading.Thread(target=self.run, name=name, daemon=True)
+
+    def start(self) -> int:
+        self.thread.start()
+        self.ready.wait()
+        if self.error is not None:
+            raise self.error
+        return self.port
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self.serve())
+        except Exception as e:
+            self.error = e
+            return
+        finally:
+            self.ready.set()
+        self.loop.run_forever()
+
+    async def serve(self):
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        self.port = self.runner.addresses[0][1]
+
+    async def shutdown(self):
+        await self.runner.cleanup()
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self.shutdown(), self.loop).result(timeout=30)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+
+class Fish:
+    def __init__(self, n: int, url: str, greeting: bytes, answers: List[bytes],
+                 turns: int, timeout: float, download: bool,
+                 streams: Optional[List[List[bytes]]] = None, chunk_seconds: float = 0.5):
+        """
+        One simulated Riddle Client, playing one game.
+
+        Args:
+            streams (List[List[bytes]], optional): PCM pieces of every answer, to send them with answer_chunk. Default is sending whole answers.
+            chunk_seconds (float, optional): Seconds of speech in a piece, one is sent every that many seconds. Default is 0.5.
+        """
+        self.n = n
+        self.url = url
+        self.greeting = greeting
+        self.answers = answers
+        self.streams = streams
+        self.chunk_seconds = chunk_seconds
+        self.turns = turns
+        self.timeout = timeout
+        self.download = download
+
+        self.player = None
+        self.stopped = False
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors = 0
+        self.retries = 0
+        self.responses = asyncio.Queue()
+
+        self.sio = socketio.AsyncClient()
+        self.sio.on('say', functools.partial(self.respond, 'say'))
+        self.sio.on('say_no_continue', functools.partial(self.respond, 'say_no_continue'))
+        self.sio.on('retry_greeting', functools.partial(self.respond, 'retry_greeting'))
+        self.sio.on('error', functools.partial(self.respond, 'error'))
+        self.sio.on('save_player_preferences', self.save_player_preferences)
+
+    async def respond(self, kind, data):
+        await self.responses.put((kind, data))
+
+    async def save_player_preferences(self, data):
+        preferences = unpack(UserPreference, data)
+        self.player = OldPlayer(id=preferences.id, age="(25-32)", confidence=0.9,
+                                lang=preferences.lang, voice=preferences.voice)
+
+    async def play(self, http: aiohttp.ClientSession):
+        await self.sio.connect(self.url, transports=['websocket'], auth={"wire": WIRE_VERSION})
+        try:
+            greeting = pack(with_binary(NewPlayer, id=uuid.uuid4(), age="(25-32)",
+                                        confidence=0.9, recording=self.greeting))
+            if not await self.turn(http, 'greet_new_player', greeting):
+                return
+
+            for i in range(self.turns):
+                if self.player is None or self.stopped:
+                    return
+                if self.streams is not None:
+                    if not await self.stream_turn(http, self.streams[(self.n + i) % len(self.streams)]):
+                        return
+                    continue
+                answer = pack(with_binary(PlayerVoiceChunk, player=self.player, codec="wav",
+                                          recording=self.answers[(self.n + i) % len(self.answers)]))
+                if not await self.turn(http, 'give_answer_on_riddle', answer):
+                    return
+        finally:
+            await self.sio.disconnect()
+
+    async def turn(self, http: aiohttp.ClientSession, event: str, payload) -> bool:
+        """Sends event and waits for the fish's reply, False when the game can't go on."""
+        start = time.perf_counter()
+        await self.sio.emit(event, payload)
+        return await self.reply(http, event, start, payload)
+
+    async def stream_turn(self, http: aiohttp.ClientSession, pieces: List[bytes]) -> bool:
+        """
+        Sends the answer piece by piece while the player "speaks" it. The
+        latency is counted from the last piece, when the player stopped.
+        """
+        for seq, pcm in enumerate(pieces):
+            final = seq == len(pieces) - 1
+            if final:
+                start = time.perf_counter()
+            await self.sio.emit('answer_chunk', pack(with_binary(
+                PlayerVoiceStream, player=self.player, seq=seq, codec="pcm_s16le",
+                sample_rate=transcribe.WHISPER_RATE, recording=pcm, final=final)))
+            if not final:
+                await asyncio.sleep(self.chunk_seconds)
+        return await self.reply(http, 'answer_chunk', start)
+
+    async def reply(self, http: aiohttp.ClientSession, event: str, start: float, payload=None) -> bool:
+        """Waits for the fish's reply on event, a greeting to retry is sent again with payload."""
+        retries = 0
+        while True:
+            try:
+                kind, data = await asyncio.wait_for(self.responses.get(), self.timeout)
+            except asyncio.TimeoutError:
+                print(f"fish {self.n}: no reply on {event} in {self.timeout}s")
+                self.errors += 1
+                return False
+
+            if kind == 'error':
+                print(f"fish {self.n}: {data}")
+                self.errors += 1
+                return False
+
+            if kind == 'retry_greeting' and payload is not None:
+                self.retries += 1
+                retries += 1
+                if retries > 3:
+                    self.errors += 1
+                    return False
+                await self.sio.emit(event, payload)
+                continue
+
+            response = unpack(ResponseStop if kind == 'say_no_continue' else ResponseContinue, data)
+            if self.download:
+                async with http.get(str(response.wav_location)) as wav:
+                    await wav.read()
+            self.latencies.setdefault(event, []).append(time.perf_counter() - start)
+            self.stopped = kind == 'say_no_continue'
+            return True
+
+
+def read(path: str) -> bytes:
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def pcm_pieces(recording: bytes, seconds: float) -> List[bytes]:
+    """A WAV as the Riddle Client uploads it: 16 kHz 16 bit mono PCM, in pieces of that many seconds."""
+    samples = transcribe.decode_recording(recording, "wav")
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767).astype('<i2')
+    size = max(1, int(transcribe.WHISPER_RATE * seconds))
+    return [pcm[i:i + size].tobytes() for i in range(0, len(pcm), size)] or [b""]
+
+
+def percentiles(values: List[float], q=(50, 95, 99)) -> Dict[int, float]:
+    if not values:
+        return {p: 0.0 for p in q}
+    return dict(zip(q, np.percentile(np.asarray(values), list(q)).tolist()))
+
+
+async def play_all(args, url: str) -> List[Fish]:
+    greeting = read(args.greeting)
+    answers = [read(path) for path in args.answers]
+    streams = [pcm_pieces(answer, args.chunk_seconds) for answer in answers] if args.stream else None
+    fish = [Fish(n, url, greeting, answers, args.turns, args.timeout, not args.no_download,
+                 streams, args.chunk_seconds)
+            for n in range(args.clients)]
+
+    async def play(one: Fish, delay: float):
+        await asyncio.sleep(delay)
+        try:
+            await one.play(http)
+        except Exception as e:
+            print(f"fish {one.n}: {str(e)}")
+            one.errors += 1
+
+    async with aiohttp.ClientSession() as http:
+        await asyncio.gather(*[play(one, args.ramp * n / max(args.clients, 1))
+                               for n, one in enumerate(fish)])
+    return fish
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+async def wait_for_processor(url: str, processor: subprocess.Popen, timeout: float):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as http:
+        while True:
+            if processor.poll() is not None:
+                raise RuntimeError(f"processor exited with {processor.returncode}")
+            try:
+                async with http.get(f"{url}/bench/lags") as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"processor didn't start in {timeout}s")
+            await asyncio.sleep(0.2)
+
+
+async def processor_report(url: str) -> Tuple[List[float], dict]:
+    """Event loop lags and the loop monitor report of the processor."""
+    async with aiohttp.ClientSession() as http:
+        async with http.get(f"{url}/bench/lags") as response:
+            lags = await response.json()
+        async with http.get(f"{url}/admin/loop") as response:
+            loop = await response.json()
+    return lags, loop
+
+
+def serve(args):
+    """The processor under test, run in its own process by run()."""
+    if args.whisper == "stub":
+        transcribe.WhisperTranscriber = functools.partial(StubTranscriber, rtf=args.whisper_rtf)
+    server = importlib.import_module(".server", __package__)
+    lags = []
+
+    async def measure_lag():
+        """How late the loop wakes up a sleeper, a handler blocking the loop shows up here."""
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(args.lag_interval)
+            lags.append(time.perf_counter() - start - args.lag_interval)
+
+    async def start_probe(app):
+        app['lag_probe'] = asyncio.create_task(measure_lag())
+
+    async def stop_probe(app):
+        app['lag_probe'].cancel()
+
+    async def lag_report(request):
+        return web.json_response(lags)
+
+    server.app.on_startup.append(start_probe)
+    server.app.on_cleanup.append(stop_probe)
+    server.app.router.add_get('/bench/lags', lag_report)
+    web.run_app(server.app, host='127.0.0.1', port=args.serve, print=None)
+
+
+def run(args) -> int:
+    openai = FakeOpenAI(delay=args.llm_delay, jitter=args.llm_jitter)
+    alltalk = FakeAllTalk(delay=args.tts_delay, per_char=args.tts_per_char)
+    # OpenAI and AllTalk are called with blocking clients, they can't share the processor loop
+    openai_server = BackgroundServer(openai.app(), "fake-openai")
+    alltalk_server = BackgroundServer(alltalk.app(), "fake-alltalk")
+    openai_port = openai_server.start()
+    alltalk_port = alltalk_server.start()
+
+    workdir = tempfile.TemporaryDirectory()
+    alltalk_config = os.path.join(workdir.name, "alltalk.json")
+    with open(alltalk_config, 'w') as f:
+        json.dump({
+            "api_alltalk_protocol": "http://",
+            "api_alltalk_ip_port": f"127.0.0.1:{alltalk_port}",
+            "api_alltalk_external_protocol": "http://",
+            "api_alltalk_external_ip_port": f"127.0.0.1:{alltalk_port}",
+            "api_connection_timeout": 5,
+        }, f)
+
+    # read by server on import, load_dotenv doesn't override them
+    env = {
+        **os.environ,
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{openai_port}/v1",
+        "OPENAI_API_KEY": "bench",
+        "ALLTALK_CONFIG": alltalk_config,
+        "FISH_DB": os.path.join(workdir.name, "fish.db"),
+        "TRACE_FILE": args.trace or "",
+        "LOOP_MONITOR": "1",
+        "LOOP_BLOCK_THRESHOLD": str(args.block_threshold),
+        "ADMIN_TOKEN": "",
+    }
+    if args.whisper != "stub":
+        env.update({"WHISPER_MODEL": args.whisper, "WHISPER_DEVICE": "cpu",
+                    "WHISPER_COMPUTE_TYPE": "int8"})
+    port = free_port()
+    processor = subprocess.Popen(
+        [sys.executable, "-m", f"{__package__}.bench_server", "--serve", str(port),
+         "--whisper", args.whisper, "--whisper-rtf", str(args.whisper_rtf),
+         "--lag-interval", str(args.lag_interval)],
+        env=env)
+    url = f"http://127.0.0.1:{port}"
+
+    try:
+        asyncio.run(wait_for_processor(url, processor, args.startup_timeout))
+        started = time.perf_counter()
+        fish = asyncio.run(play_all(args, url))
+        elapsed = time.perf_counter() - started
+        lags, loop = asyncio.run(processor_report(url))
+    finally:
+        processor.terminate()
+        processor.wait(timeout=30)
+        openai_server.stop()
+        alltalk_server.stop()
+        workdir.cleanup()
+
+    latencies: Dict[str, List[float]] = {}
+    for one in fish:
+        for event, values in one.latencies.items():
+            latencies.setdefault(event, []).extend(values)
+    everything = [value for values in latencies.values() for value in values]
+    errors = sum(one.errors for one in fish)
+    retries = sum(one.retries for one in fish)
+    throughput = len(everything) / elapsed if elapsed > 0 else 0.0
+    lag = percentiles(lags)
+    lag_max = max(lags, default=0.0)
+
+    print(f"{args.clients} fish, {len(everything)} turns in {elapsed:.1f} s: "
+          f"{throughput:.2f} turns/s, {errors} errors, {retries} greeting retries")
+    print(f"{'turn':<24} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for event, values in [*latencies.items(), ("all", everything)]:
+        p = percentiles(values)
+        print(f"{event:<24} {len(values):>7} {p[50] * 1000:>9.1f} {p[95] * 1000:>9.1f} {p[99] * 1000:>9.1f}")
+    print(f"{'event loop lag':<24} {len(lags):>7} {lag[50] * 1000:>9.1f} "
+          f"{lag[95] * 1000:>9.1f} {lag[99] * 1000:>9.1f}   max {lag_max * 1000:.1f} ms")
+    print(f"stand-ins: {openai.requests} completions, {alltalk.requests} TTS generations")
+
+    print(f"{loop['stalls']} times the loop was held over {args.block_threshold * 1000:.0f} ms, "
+          f"{loop['starved']} times it was starved of the GIL")
+    for offender in loop["offenders"][:args.offenders]:
+        print(f"  {offender['count']:>5}x {offender['total']:>7.2f} s  {offender['culprit']}")
+
+    p = percentiles(everything)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                "clients": args.clients,
+                "turns": len(everything),
+                "seconds": elapsed,
+                "throughput": throughput,
+                "errors": errors,
+                "retries": retries,
+                "latency": {event: percentiles(values) for event, values in
+                            [*latencies.items(), ("all", everything)]},
+                "loop_lag": {**lag, "max": lag_max},
+                "completions": openai.requests,
+                "tts_generations": alltalk.requests,
+                "stalls": loop["stalls"],
+                "starved": loop["starved"],
+                "offenders": loop["offenders"],
+            }, f, indent=2)
+
+    failed = []
+    if args.max_errors is not None and errors > args.max_errors:
+        failed.append(f"{errors} errors > {args.max_errors}")
+    if args.max_p95 is not None and p[95] > args.max_p95:
+        failed.append(f"turn p95 {p[95]:.2f}s > {args.max_p95}s")
+    if args.max_lag is not None and lag[99] > args.max_lag:
+        failed.append(f"event loop lag p99 {lag[99]:.2f}s > {args.max_lag}s")
+    if args.max_stalls is not None and loop["stalls"] > args.max_stalls:
+        failed.append(f"{loop['stalls']} loop stalls > {args.max_stalls}")
+    if args.min_throughput is not None and throughput < args.min_throughput:
+        failed.append(f"throughput {throughput:.2f} turns/s < {args.min_throughput}")
+    for reason in failed:
+        print(f"FAILED: {reason}")
+    return 1 if failed else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load the Riddle Processor with simulated fish, OpenAI, AllTalk and Whisper stand-ins")
+    parser.add_argument('--clients', type=int, default=4, help="fish playing at the same time")
+    parser.add_argument('--turns', type=int, default=5, help="answers per game after the greeting")
+    parser.add_argument('--ramp', type=float, default=1.0, help="seconds over which the fish connect")
+    parser.add_argument('--greeting', default='RiddleClient/english.wav',
+                        help="WAV sent with greet_new_player")
+    parser.add_argument('--answers', nargs='+', default=['RiddleClient/nederlands.wav'],
+                        help="WAVs replayed as answers, in turn")
+    parser.add_argument('--timeout', type=float, default=60.0, help="seconds to wait for a reply")
+    parser.add_argument('--stream', action='store_true',
+                        help="send answers in answer_chunk pieces, like the Riddle Client")
+    parser.add_argument('--chunk-seconds', type=float, default=0.5, help="seconds of speech per piece")
+    parser.add_argument('--startup-timeout', type=float, default=120.0,
+                        help="seconds the processor may take to start")
+    parser.add_argument('--no-download', action='store_true', help="don't fetch the TTS audio")
+    parser.add_argument('--llm-delay', type=float, default=0.5, help="seconds per chat completion, the processor gives up after 3")
+    parser.add_argument('--llm-jitter', type=float, default=0.1)
+    parser.add_argument('--tts-delay', type=float, default=0.3, help="seconds per TTS generation")
+    parser.add_argument('--tts-per-char', type=float, default=0.002)
+    parser.add_argument('--whisper', default='stub',
+                        help="stub, or a faster-whisper model run on the CPU, like tiny")
+    parser.add_argument('--whisper-rtf', type=float, default=0.1,
+                        help="seconds of the stub per second of audio")
+    parser.add_argument('--lag-interval', type=float, default=0.05)
+    parser.add_argument('--block-threshold', type=float, default=0.1,
+                        help="seconds a callback may hold the processor loop")
+    parser.add_argument('--offenders', type=int, default=5, help="how many blocking call sites to list")
+    parser.add_argument('--trace', help="JSONL file for the spans of the processor")
+    parser.add_argument('--json', help="write the results to this file")
+    parser.add_argument('--max-errors', type=int)
+    parser.add_argument('--max-p95', type=float, help="seconds")
+    parser.add_argument('--max-lag', type=float, help="seconds, p99 of the event loop lag")
+    parser.add_argument('--min-throughput', type=float, help="turns per second")
+    parser.add_argument('--max-stalls', type=int, help="times the processor loop may be held")
+    parser.add_argument('--serve', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve is not None:
+        serve(args)
+        return
+    raise SystemExit(run(args))
+
+
+if __name__ == "__main__":
+    main()
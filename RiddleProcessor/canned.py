@@ -0,0 +1,54 @@
+import asyncio
+from typing import Dict, Optional, Tuple
+
+from pydantic import HttpUrl
+
+from .tts import AllTalkAPI
+
+HOLD_ON = {
+    "en": "Blub! So many players at once, my fish brain needs a moment. Please say that again.",
+    "nl": "Blub! Zoveel spelers tegelijk, mijn vissenbrein heeft even tijd nodig. Zeg het alsjeblieft nog een keer.",
+    "ru": "Бульк! Столько игроков сразу, моей рыбьей голове нужна минутка. Повтори, пожалуйста.",
+}
+
+
+class CannedResponses:
+    def __init__(self, tts: AllTalkAPI, voice: str = None, phrases: Dict[str, str] = HOLD_ON):
+        """
+        What the fish says when the processor is too busy for a turn. Rendered
+        once on startup, so answering with it costs neither the LLM nor the TTS.
+
+        Args:
+            tts (AllTalkAPI): Renders the phrases.
+            voice (str, optional): Voice of all of them. Default is the first voice of AllTalk.
+            phrases (Dict[str, str], optional): Language: text. Default is HOLD_ON.
+        """
+        self.tts = tts
+        self.voice = voice
+        self.phrases = phrases
+        self.urls: Dict[str, HttpUrl] = {}
+
+    async def prepare(self):
+        voice = self.voice
+        if voice is None:
+            voices = await asyncio.to_thread(self.tts.get_available_voices)
+            voice = voices[0] if voices else None
+
+        for lang, text in self.phrases.items():
+            try:
+                resp_tts = await asyncio.to_thread(
+                    self.tts.generate_tts_export,
+                    text=text,
+                    character_voice=voice,
+                    language=lang,
+                    output_file_name=f"hold_on_{lang}",
+                )
+                self.urls[lang] = resp_tts.output_file_url
+            except Exception as e:
+                print(f"Unable to prepare the hold on for '{lang}': {str(e)}")
+
+    def hold_on(self, lang: str) -> Optional[Tuple[str, HttpUrl]]:
+        """Text and audio of the hold on, None if it isn't ready for the language."""
+        if lang not in self.urls:
+            return None
+        return self.phrases[lang], self.urls[lang]
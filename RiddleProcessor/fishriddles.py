@@ -1,10 +1,13 @@
+from typing import List, NamedTuple, Optional
 from openai import OpenAI, APITimeoutError
-from pydantic import ValidationError
 from models.profile import OldPlayer
 from models.registry import Riddle
 from models.riddles import *
 from models.history import *
+from models.store import PlayerStore
+from models.tracing import NullTracer, Tracer
 from .registry import Registry
+from .sessions import Session
 
 
 SYSTEM_INSTRUCTIONS = """
@@ -24,34 +27,51 @@ you don't repeat riddles from the registry.
 """
 
 
+class Greeting(NamedTuple):
+    # a new player's greeting starts the conversation over
+    new_conversation: bool
+    messages: List[MessageEntry]
+    response: RiddleResponse
+
+
+class Reply(NamedTuple):
+    # what the player said and what the fish answers
+    messages: List[MessageEntry]
+    response: RiddleResponse
+
+
 class FishRiddles:
-    def __init__(self, json_file_path="RiddleProcessor/history.json"):
+    def __init__(self, store_path="RiddleProcessor/fish.db", tracer: Tracer = None):
         self.client = OpenAI(timeout=3.0)
         self.model = "gpt-4o-mini"
-        self.json_file_path = json_file_path
-        self.data = self.load()
-        self.riddles_registry = Registry()
+        self.tracer = tracer if tracer is not None else NullTracer()
+        # conversations live in the sessions and are flushed here when they end
+        self.store = PlayerStore(store_path)
+        self.riddles_registry = Registry(self.store)
+
+    def parse(self, call: str, messages: List[dict]):
+        with self.tracer.span("llm", call=call):
+            return self.client.beta.chat.completions.parse(
+                model=self.model,
+                messages=messages,
+                response_format=RiddleResponse,
+            )
+
+    def greet_player(self, session: Session, flag_new: bool) -> RiddleResponse:
+        greeting = self.draft_greeting(session, flag_new)
+        self.commit_greeting(session, greeting)
+        return greeting.response
 
-    def load(self) -> PlayerEntries:
+    def draft_greeting(self, session: Session, flag_new: bool) -> Greeting:
+        """
+        Asks for the greeting without adding anything to the session, so a
+        greeting prepared ahead of time can be thrown away.
+        """
         # TODO: Truncate to 2500 tokens
-        try:
-            with open(self.json_file_path, 'r', encoding='utf-8') as f:
-                json_data = f.read()
-            return PlayerEntries.model_validate_json(json_data)
-        except (FileNotFoundError, ValidationError):
-            return PlayerEntries(root={})
-
-    def save(self):
-        with open(self.json_file_path, 'w', encoding='utf-8') as f:
-            f.write(self.data.model_dump_json(indent=4))
-
-    def save_user_info(self, user_info: OldPlayer, player_entry: UserEntry):
-        self.data.root[user_info.id] = player_entry
-        self.save()
-
-    def greet_player(self, info: OldPlayer, flag_new: bool) -> RiddleResponse:
-        if flag_new or info.id not in self.data.root:
-            user_entry = UserEntry(messages=[
+        info = session.player
+        new_conversation = flag_new or session.entry is None
+        if new_conversation:
+            messages = [
                 MessageEntry(
                     role="system",
                     content=[Content(
@@ -60,10 +80,10 @@ class FishRiddles:
                             {str(info.id)} approx age {info.age} used language {info.lang}")
                     ],
                 )
-            ])
+            ]
+            prompt = [i.model_dump() for i in messages]
         else:
-            user_entry = self.data.root[info.id]
-            user_entry.messages.append(
+            messages = [
                 MessageEntry(
                     role="system",
                     content=[Content(
@@ -71,35 +91,36 @@ class FishRiddles:
                     Greet him in special way to show what you recognize them, \
                     but never mention their ID directly, and ask do they want riddle or fact.")],
                 )
-            )
+            ]
+            prompt = session.prompt_with(*messages)
 
-        completion = self.client.beta.chat.completions.parse(
-            model=self.model,
-            messages=[i.model_dump() for i in user_entry.messages],
-            response_format=RiddleResponse,
-        )
+        completion = self.parse("greet", prompt)
 
         print(completion)
 
         response = completion.choices[0].message
 
         if response.parsed:
-            user_entry.messages.append(
+            messages.append(
                 MessageEntry(
                     role="assistant",
                     content=[Content(text=response.parsed.text)],
                 )
             )
-            self.save_user_info(player_entry=user_entry, user_info=info)
-            return response.parsed
+            return Greeting(new_conversation, messages, response.parsed)
+
+        raise ValueError("AHAHA, I'm just a fish!")
 
-        elif response.refusal:
-            raise ValueError("AHAHA, I'm just a fish!")
+    def commit_greeting(self, session: Session, greeting: Greeting):
+        if greeting.new_conversation:
+            session.start(UserEntry(messages=list(greeting.messages)))
+        else:
+            session.append(*greeting.messages)
 
-    def cannot_understand_player(self, info: OldPlayer) -> RiddleResponse:
+    def cannot_understand_player(self, session: Session) -> RiddleResponse:
         messages = [
             # First message always have valuable information
-            self.data.root[info.id].messages[0],
+            session.entry.messages[0],
             MessageEntry(
                 role="system",
                 content=[Content(
@@ -109,11 +130,7 @@ class FishRiddles:
             )
         ]
 
-        completion = self.client.beta.chat.completions.parse(
-            model=self.model,
-            messages=[i.model_dump() for i in messages],
-            response_format=RiddleResponse,
-        )
+        completion = self.parse("repeat", [i.model_dump() for i in messages])
 
         print(completion)
 
@@ -146,11 +163,7 @@ class FishRiddles:
             ),
         ]
 
-        completion = self.client.beta.chat.completions.parse(
-            model=self.model,
-            messages=[i.model_dump() for i in messages],
-            response_format=RiddleResponse,
-        )
+        completion = self.parse("troubles", [i.model_dump() for i in messages])
 
         response = completion.choices[0].message
         if response.parsed:
@@ -158,9 +171,52 @@ class FishRiddles:
         else:
             raise ValueError("Fish really tried hard, but failed second time")
 
-    def process_response_on_riddle(self, info: OldPlayer, riddle_response: str) -> RiddleResponse:
-        self.data.root[info.id].messages = self.data.root[info.id].messages + \
-            [MessageEntry(
+    def draft_next_riddle(self, session: Session) -> RiddleResponse:
+        """
+        Riddle the player will probably ask for next, made while the fish is
+        still talking. Nothing is added to the session, it's offered to the
+        model together with the player's answer in process_response_on_riddle.
+        """
+        info = session.player
+        messages = session.prompt_with(
+            MessageEntry(
+                role="system",
+                content=self.riddles_registry.get_content(info.lang),
+            ),
+            MessageEntry(
+                role="system",
+                content=[Content(text="Prepare a new riddle in case the player asks for one. \
+                    Put everything you would say in text and the riddle itself in riddle_text.")],
+            ))
+
+        completion = self.parse("next_riddle", messages)
+
+        response = completion.choices[0].message
+        if response.parsed and response.parsed.riddle_text != "":
+            return response.parsed
+        else:
+            raise ValueError("No riddle to prepare")
+
+    def process_response_on_riddle(self, session: Session, riddle_response: str,
+                                   prepared: Optional[RiddleResponse] = None) -> RiddleResponse:
+        reply = self.draft_response(session, riddle_response, prepared)
+        self.commit_response(session, reply)
+        return reply.response
+
+    def draft_response(self, session: Session, riddle_response: str,
+                       prepared: Optional[RiddleResponse] = None) -> Reply:
+        """
+        Asks for the answer without adding anything to the session, so the
+        turn can still be dropped until its audio is ready.
+
+        Args:
+            session (Session): Conversation of the player.
+            riddle_response (str): What the player said.
+            prepared (RiddleResponse, optional): Result of draft_next_riddle, used word for word if the player wants a new riddle.
+        """
+        info = session.player
+        messages = [
+            MessageEntry(
                 role="system",
                 content=[Content(text="Player either tried to give answer on the riddle or \
                     asked some generic fact. If its an answer - ask them do \
@@ -170,25 +226,30 @@ class FishRiddles:
             MessageEntry(
                 role="user",
                 content=[Content(text=riddle_response)],
-            )]
+            ),
+        ]
 
         # messages for riddle registry will not be saved to the history
         # but we'll provide context for the ChatGPT
         riddles_registry = self.riddles_registry.get_content(info.lang)
         print(riddles_registry)
-        messages_with_riddle_registry = self.data.root[info.id].messages + \
-            [MessageEntry(
+        extra = [
+            MessageEntry(
                 role="system",
                 content=riddles_registry,
-            )]
+            )
+        ]
+        if prepared is not None:
+            extra.append(
+                MessageEntry(
+                    role="system",
+                    content=[Content(text=f"If the player wants a new riddle reply exactly with \
+                        the text '{prepared.text}' and riddle_text '{prepared.riddle_text}'.")],
+                ))
+        messages_with_riddle_registry = session.prompt_with(*messages, *extra)
 
         try:
-            completion = self.client.beta.chat.completions.parse(
-                model=self.model,
-                messages=[i.model_dump()
-                          for i in messages_with_riddle_registry],
-                response_format=RiddleResponse,
-            )
+            completion = self.parse("answer", messages_with_riddle_registry)
 
         except APITimeoutError:
             raise ValueError("Fish has some memory problems, please handle it")
@@ -197,16 +258,18 @@ class FishRiddles:
 
         response = completion.choices[0].message
         if response.parsed:
-            self.data.root[info.id].messages.append(
+            messages.append(
                 MessageEntry(
                     role="assistant",
                     content=[Content(text=response.parsed.text)],
                 ),
             )
-            if response.parsed.riddle_text != "":
-                self.riddles_registry.add(info.lang,
-                                        Riddle(text=response.parsed.riddle_text))
-            self.save()
-            return response.parsed
+            return Reply(messages, response.parsed)
         else:
             raise ValueError(f"Cannot process response on riddle")
+
+    def commit_response(self, session: Session, reply: Reply):
+        session.append(*reply.messages)
+        if reply.response.riddle_text != "":
+            self.riddles_registry.add(session.player.lang,
+                                      Riddle(text=reply.response.riddle_text))
@@ -0,0 +1,199 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+from contextlib import contextmanager
+from typing import Dict, List
+
+import numpy as np
+
+# frames of these are where a stall is blamed on, rather than the library it ended up in
+OWN_CODE = ("RiddleProcessor", "models")
+# the loop waiting for events, held anyway it didn't get the GIL back from other threads
+IDLE = ("selectors.py",)
+
+
+class LoopMonitor:
+    def __init__(self, threshold: float = 0.1, interval: float = 0.02, keep: int = 50):
+        """
+        Watches the event loop of the server for callbacks which hold it.
+
+        A task on the loop sleeps `interval` seconds over and over, how late it
+        wakes up is the lag. A watchdog thread checks the heartbeat of that
+        task, when it is more than `threshold` seconds late it takes the stack
+        of the loop thread, which is the code blocking it. When that stack
+        ends in the selector the loop was idle but starved of the GIL by other
+        threads, such a stall is counted apart and blames no call site.
+
+        Handlers in flight are counted per event whether the monitor runs or not.
+
+        Args:
+            threshold (float, optional): Seconds the loop may be held before it's a stall. Default is 0.1.
+            interval (float, optional): Seconds between lag samples. Default is 0.02.
+            keep (int, optional): How many stalls are kept with their stack. Default is 50.
+        """
+        self.threshold = threshold
+        self.interval = interval
+
+        self.inflight = Counter()
+        self.handled = Counter()
+
+        self.lags = deque(maxlen=1000)
+        self.max_lag = 0.0
+        self.stall_count = 0
+        self.starved_count = 0
+        self.stalls = deque(maxlen=keep)
+        # culprit: count, seconds, longest and the stack of the longest
+        self.offenders: Dict[str, dict] = {}
+        self.lock = threading.Lock()
+
+        self.running = False
+        self.loop_thread = None
+        self.beat = time.monotonic()
+        self.sampler = None
+        self.watchdog = None
+
+    @contextmanager
+    def track(self, event: str):
+        self.inflight[event] += 1
+        try:
+            yield
+        finally:
+            self.inflight[event] -= 1
+            self.handled[event] += 1
+
+    def start(self):
+        """Starts watching the running loop, must be called from it."""
+        if self.running:
+            return
+        self.running = True
+        self.loop_thread = threading.get_ident()
+        self.beat = time.monotonic()
+        self.sampler = asyncio.ensure_future(self.sample())
+        self.watchdog = threading.Thread(target=self.watch, name="loop-watchdog", daemon=True)
+        self.watchdog.start()
+        print(f"Watching the event loop, stalls over {self.threshold * 1000:.0f} ms are reported")
+
+    def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        self.sampler.cancel()
+        self.watchdog.join()
+
+    async def sample(self):
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = now - start - self.interval
+            self.beat = now
+            self.lags.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+
+    def watch(self):
+        poll = self.threshold / 4
+        while self.running:
+            time.sleep(poll)
+            beat = self.beat
+            if time.monotonic() - beat - self.interval < self.threshold:
+                continue
+
+            # the loop is held right now, its stack shows by what
+            frame = sys._current_frames().get(self.loop_thread)
+            stack = traceback.extract_stack(frame) if frame is not None else []
+            inflight = self.inflight_now()
+
+            while self.running and self.beat == beat:
+                time.sleep(poll)
+            self.record_stall(max(self.beat - beat - self.interval, self.threshold), stack, inflight)
+
+    def inflight_now(self) -> Dict[str, int]:
+        # read from the watchdog thread while the loop may change it
+        for _ in range(3):
+            try:
+                return {event: count for event, count in self.inflight.items() if count}
+            except RuntimeError:
+                continue
+        return {}
+
+    def record_stall(self, duration: float, stack: List[traceback.FrameSummary], inflight: Dict[str, int]):
+        starved = self.starved(stack)
+        culprit = "starved of the GIL" if starved else self.culprit(stack)
+        formatted = "".join(traceback.format_list(stack))
+        if starved:
+            print(f"Event loop was starved for {duration * 1000:.0f} ms by other threads, handlers: {inflight}")
+        else:
+            print(f"Event loop was blocked for {duration * 1000:.0f} ms at {culprit}, handlers: {inflight}")
+
+        with self.lock:
+            self.stalls.append({
+                "at": time.time(),
+                "duration": duration,
+                "starved": starved,
+                "culprit": culprit,
+                "inflight": inflight,
+                "stack": formatted,
+            })
+            if starved:
+                self.starved_count += 1
+                return
+            self.stall_count += 1
+            offender = self.offenders.setdefault(
+                culprit, {"culprit": culprit, "count": 0, "total": 0.0, "max": 0.0, "stack": ""})
+            offender["count"] += 1
+            offender["total"] += duration
+            if duration >= offender["max"]:
+                offender["max"] = duration
+                offender["stack"] = formatted
+
+    @staticmethod
+    def starved(stack: List[traceback.FrameSummary]) -> bool:
+        return bool(stack) and os.path.basename(stack[-1].filename) in IDLE
+
+    @staticmethod
+    def culprit(stack: List[traceback.FrameSummary]) -> str:
+        if not stack:
+            return "unknown"
+        own = [i for i in stack if any(part in i.filename for part in OWN_CODE)]
+        frame = own[-1] if own else stack[-1]
+        return f"{frame.filename}:{frame.lineno} in {frame.name}"
+
+    def report(self) -> dict:
+        lags = list(self.lags)
+        p = np.percentile(lags, [50, 99]).tolist() if lags else [0.0, 0.0]
+        with self.lock:
+            offenders = sorted(self.offenders.values(), key=lambda i: i["total"], reverse=True)
+            return {
+                "running": self.running,
+                "threshold": self.threshold,
+                "lag": {"samples": len(lags), "p50": p[0], "p99": p[1], "max": self.max_lag},
+                "inflight": self.inflight_now(),
+                "handled": dict(self.handled),
+                "stalls": self.stall_count,
+                "starved": self.starved_count,
+                "offenders": [dict(i) for i in offenders],
+                "recent": list(self.stalls),
+            }
+
+    def metrics(self, prefix: str = "fish") -> str:
+        """Lag, stalls and handlers in flight in the Prometheus text format."""
+        lines = [
+            f"# HELP {prefix}_loop_lag_max_seconds Longest the event loop was late.",
+            f"# TYPE {prefix}_loop_lag_max_seconds gauge",
+            f"{prefix}_loop_lag_max_seconds {self.max_lag:.6f}",
+            f"# HELP {prefix}_loop_stalls_total Times the event loop was held longer than the threshold.",
+            f"# TYPE {prefix}_loop_stalls_total counter",
+            f"{prefix}_loop_stalls_total {self.stall_count}",
+            f"# HELP {prefix}_loop_starved_total Times the idle event loop didn't get the GIL for longer than the threshold.",
+            f"# TYPE {prefix}_loop_starved_total counter",
+            f"{prefix}_loop_starved_total {self.starved_count}",
+            f"# HELP {prefix}_handlers_in_flight Socket.IO handlers running, per event.",
+            f"# TYPE {prefix}_handlers_in_flight gauge",
+        ]
+        for event, count in list(self.inflight.items()):
+            lines.append(f'{prefix}_handlers_in_flight{{event="{event}"}} {count}')
+        return "\n".join(lines) + "\n"
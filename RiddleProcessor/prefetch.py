@@ -0,0 +1,81 @@
+import asyncio
+from typing import Dict, Hashable, Optional, Tuple
+
+
+class SpeculativeCache:
+    def __init__(self, name: str, ttl: float = 10.0, max_pending: Optional[int] = None):
+        """
+        Work started before it is known to be needed, one task per key.
+
+        A task which isn't taken within ttl seconds is cancelled, so
+        speculation nobody confirmed doesn't keep the LLM and TTS busy. Work
+        already handed to a thread can't be interrupted, cancelling only makes
+        sure its result is thrown away.
+
+        Taking a task says nothing about whether it paid off, the caller
+        counts each taken task as one of hits (used), dropped (not ready or
+        failed) or unused (ready, but not what the turn needed).
+
+        Args:
+            name (str): Shown in the log lines.
+            ttl (float, optional): Seconds a task is kept without being taken. Default is 10.
+            max_pending (int, optional): No new speculation while that many tasks are pending. Default is no limit.
+        """
+        self.name = name
+        self.ttl = ttl
+        self.max_pending = max_pending
+        self.pending: Dict[Hashable, Tuple[asyncio.Task, asyncio.TimerHandle]] = {}
+        self.hits = 0
+        self.dropped = 0
+        self.unused = 0
+        self.misses = 0
+        self.cancelled = 0
+        self.skipped = 0
+
+    def has_room(self) -> bool:
+        return self.max_pending is None or len(self.pending) < self.max_pending
+
+    def speculate(self, key: Hashable, task: asyncio.Task) -> asyncio.Task:
+        self.cancel(key)
+        timer = asyncio.get_running_loop().call_later(self.ttl, self._expire, key, task)
+        self.pending[key] = (task, timer)
+        task.add_done_callback(self._log_failure)
+        return task
+
+    def take(self, key: Hashable) -> Optional[asyncio.Task]:
+        """The task started for key, None when there is none or it was cancelled."""
+        entry = self.pending.pop(key, None)
+        if entry is None or entry[0].cancelled():
+            self.misses += 1
+            return None
+        task, timer = entry
+        timer.cancel()
+        return task
+
+    def cancel(self, key: Hashable):
+        entry = self.pending.pop(key, None)
+        if entry is None:
+            return
+        task, timer = entry
+        timer.cancel()
+        if not task.done():
+            task.cancel()
+            self.cancelled += 1
+
+    def cancel_where(self, predicate):
+        for key in [key for key in self.pending if predicate(key)]:
+            self.cancel(key)
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "dropped": self.dropped, "unused": self.unused, "misses": self.misses,
+                "cancelled": self.cancelled, "skipped": self.skipped, "pending": len(self.pending)}
+
+    def _expire(self, key: Hashable, task: asyncio.Task):
+        # a newer speculation for the same key has its own timer
+        if key in self.pending and self.pending[key][0] is task:
+            print(f"{self.name}: nobody asked for {key} in {self.ttl}s, cancelling")
+            self.cancel(key)
+
+    def _log_failure(self, task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            print(f"{self.name}: speculative task failed: {task.exception()}")
@@ -1,38 +1,32 @@
 from typing import List
-from pydantic import ValidationError
 from models.history import Content
-from models.registry import Riddle, RiddlesRegistry
+from models.registry import Riddle
+from models.store import PlayerStore
 
 
 class Registry:
-    def __init__(self, json_file_path="RiddleProcessor/riddles_registry.json"):
-        self.json_file_path = json_file_path
-        self.data = self.load()
-
-    def load(self) -> RiddlesRegistry:
-        try:
-            with open(self.json_file_path, 'r', encoding='utf-8') as f:
-                json_data = f.read()
-            return RiddlesRegistry.model_validate_json(json_data)
-        except (FileNotFoundError, ValidationError):
-            return RiddlesRegistry(root={})
-
-    def save(self):
-        with open(self.json_file_path, 'w', encoding='utf-8') as f:
-            f.write(self.data.model_dump_json(indent=4))
+    def __init__(self, store: PlayerStore):
+        self.store = store
+        # lang: (version, content for the prompt), rebuilt only after a riddle
+        # is added, by this worker or another one sharing the store
+        self.content = {}
 
     def add(self, lang: str, riddle: Riddle):
-        if lang not in self.data.root:
-            self.data.root[lang] = [riddle]
-            self.save()
-        elif riddle not in self.data.root[lang]:
-            self.data.root[lang].append(riddle)
-            self.save()
+        self.store.add_riddle(lang, riddle)
 
     def get(self, lang: str) -> List[Riddle]:
-        return self.data.root.get(lang)
+        return self.store.riddles(lang) or None
 
     def get_content(self, lang: str) -> List[Content]:
+        version = self.store.version(f"riddles:{lang}")
+        cached = self.content.get(lang)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        content = self.build_content(lang)
+        self.content[lang] = (version, content)
+        return content
+
+    def build_content(self, lang: str) -> List[Content]:
         riddle_registry = self.get(lang)
 
         if riddle_registry == None:
@@ -2,40 +2,104 @@ from dotenv import load_dotenv  # noqa
 load_dotenv()                  # noqa
 
 from models.responses import *
+import asyncio
+import functools
+import os
 import time
 import tempfile
 import sys
 from .tts import AllTalkAPI
-from .transcribe import WhisperTranscriber, SilenceDetectedError
+from .transcribe import WhisperTranscriber, SilenceDetectedError, decode_recording
+from .answer_stream import AnswerStream
 from models.riddles import *
 from .fishriddles import FishRiddles
+from .sessions import SessionManager
+from .prefetch import SpeculativeCache
+from .loop_monitor import LoopMonitor
+from .admission import AdmissionController, Busy, Overloaded
+from .canned import CannedResponses
 from aiohttp import web
 import socketio
 import logging
 import random
 import string
 from models.profile import NewPlayer, OldPlayer, UserPreference
+from typing import Callable, Optional
+from models.wire import WIRE_VERSION, pack, turn_of, unpack
+from models.tracing import Tracer, current_turn, start_turn
 
 
 logger = logging.getLogger(__name__)
 
 
-tts = AllTalkAPI()
-transcriber = WhisperTranscriber()
-riddles = FishRiddles()
+# spans of every turn, empty TRACE_FILE keeps only the /metrics histograms
+tracer = Tracer("processor" + (f"-{os.environ['WORKER_ID']}" if "WORKER_ID" in os.environ else ""),
+                os.getenv("TRACE_FILE", "RiddleProcessor/traces.jsonl") or None)
+tts = AllTalkAPI(config_file=os.getenv("ALLTALK_CONFIG", "RiddleProcessor/config.json"))
+transcriber = WhisperTranscriber(model_name=os.getenv("WHISPER_MODEL", "medium"),
+                                 device=os.getenv("WHISPER_DEVICE", "cuda"),
+                                 compute_type=os.getenv("WHISPER_COMPUTE_TYPE", "float16"),
+                                 tracer=tracer)
+riddles = FishRiddles(store_path=os.getenv("FISH_DB", "RiddleProcessor/fish.db"), tracer=tracer)
+# watches for blocking calls on the loop when LOOP_MONITOR is set, see /admin/loop
+monitor = LoopMonitor(threshold=float(os.getenv("LOOP_BLOCK_THRESHOLD", "0.1")))
+# concurrency/queue limit of every stage of a turn
+admission = AdmissionController(AdmissionController.parse(
+    os.getenv("STAGES", "stt=1/8,llm=4/16,tts=2/16")))
+canned = CannedResponses(tts, voice=os.getenv("HOLD_ON_VOICE"))
+# processes serving the port together, see workers.py
+workers = int(os.getenv("WORKERS", "1"))
+# with other workers on the store every turn is saved, the player may show up at one of them next
+sessions = SessionManager(riddles.store, flush_turns=workers > 1)
+# greetings prepared while a known player approaches, per (sid, player id)
+greetings = SpeculativeCache("greetings", ttl=10.0)
+# riddles prepared while the fish talks, in case the player asks for a new one
+next_riddles = SpeculativeCache("next riddles", ttl=60.0, max_pending=8)
+
+
+
+def client_manager():
+    """
+    Message queue shared by the workers, so an emit reaches a client connected
+    to any of them. Without SIO_MESSAGE_QUEUE the clients of this process are all.
+    """
+    url = os.getenv("SIO_MESSAGE_QUEUE")
+    if not url:
+        return None
+    if url.startswith(("redis://", "rediss://")):
+        return socketio.AsyncRedisManager(url)
+    return socketio.AsyncAioPikaManager(url)
+
 
 sio = socketio.AsyncServer(async_mode='aiohttp',
+                           client_manager=client_manager(),
                            transports=['websocket'],
                            ping_timeout=60,
                            ping_interval=10)
 app = web.Application()
 sio.attach(app)
 
+# answers being streamed, per client
+answer_streams = {}
+# clients which understand models.wire payloads
+wire_clients = set()
+
+
+def traced(handler):
+    """Runs a Socket.IO handler in the turn of its payload and measures it."""
+    @functools.wraps(handler)
+    async def wrapper(sid, data):
+        start_turn(turn_of(data))
+        with monitor.track(handler.__name__), tracer.span(f"event.{handler.__name__}"):
+            return await handler(sid, data)
+    return wrapper
+
 
 def save_bytes_to_temp_file(byte_data, suffix=".wav"):
-    with tempfile.NamedTemporaryFile(mode='wb', delete=False, suffix=suffix) as temp_file:
-        temp_file.write(byte_data)
-        temp_file_path = temp_file.name
+    with tracer.span("temp_file", bytes=len(byte_data)):
+        with tempfile.NamedTemporaryFile(mode='wb', delete=False, suffix=suffix) as temp_file:
+            temp_file.write(byte_data)
+            temp_file_path = temp_file.name
 
     print(f"Temporary file created at: {temp_file_path}")
     return temp_file_path
@@ -61,24 +125,165 @@ def generate_random_string(max_length=10):
     return random_letters
 
 
-async def greet_from_chatgpt(sid, info: OldPlayer, flag_new: bool):
-    ai_resp = riddles.greet_player(info=info, flag_new=flag_new)
+def generate_tts(**kwargs):
+    with tracer.span("tts"):
+        return tts.generate_tts_export(**kwargs)
 
-    resp_tts = tts.generate_tts_export(
-        text=ai_resp.text,
-        character_voice=info.voice,
-        language=info.lang,
+
+async def in_stage(stage: str, func, *args, wait=True, **kwargs):
+    """
+    Runs the blocking func on a worker thread once the stage has a slot for
+    it, raises Overloaded when the stage is full (or busy, without wait).
+    """
+    return await admission.run(stage, func, *args, wait=wait, **kwargs)
+
+
+async def admitted(sid, work, shed):
+    """
+    Runs one turn of the client, a client has at most one turn in flight.
+    When a stage of the turn is full, shed is awaited instead.
+    """
+    try:
+        async with admission.turn(sid):
+            await work()
+    except Busy as e:
+        print(f"Turn refused: {str(e)}")
+        await sio.emit('error', {'error': 'busy: a turn is already in flight'}, room=sid)
+    except Overloaded as e:
+        admission.shed += 1
+        print(f"Turn shed: {str(e)}")
+        await shed()
+
+
+async def hold_on(sid, player: OldPlayer):
+    """Canned answer of an overloaded processor, the player is asked to say it again."""
+    canned_response = canned.hold_on(player.lang)
+    if canned_response is None:
+        await emit_error("hold_on", sid, "overloaded")
+        return
+
+    text, wav_location = canned_response
+    await emit_model('say',
+                     ResponseContinue(
+                         player=player,
+                         total_riddles_correct=0,
+                         answer_correct=False,
+                         transcription=text,
+                         wav_location=wav_location,
+                     ),
+                     sid)
+
+
+async def prepare_greeting(session):
+    # speculation never waits for a slot, it would only take it from a real turn
+    greeting = await in_stage("llm", riddles.draft_greeting, session, False, wait=False)
+    resp_tts = await in_stage(
+        "tts",
+        generate_tts,
+        wait=False,
+        text=greeting.response.text,
+        character_voice=session.voice,
+        language=session.player.lang,
         output_file_name=generate_random_string(),
     )
+    return greeting, resp_tts
+
+
+async def prepare_next_riddle(session):
+    riddle = await in_stage("llm", riddles.draft_next_riddle, session, wait=False)
+    resp_tts = await in_stage(
+        "tts",
+        generate_tts,
+        wait=False,
+        text=riddle.text,
+        character_voice=session.voice,
+        language=session.player.lang,
+        output_file_name=generate_random_string(),
+    )
+    return riddle, resp_tts
+
+
+def prefetch_next_riddle(sid, session, last: RiddleResponse):
+    """
+    Starts on the riddle of the next turn while the fish says `last`, when
+    the player is asked whether they want one rather than given one.
+    """
+    if last.riddle_text != "" or last.player_wants_to_stop:
+        return
+    if not next_riddles.has_room():
+        next_riddles.skipped += 1
+        return
+    next_riddles.speculate((sid, session.player.id), session.spawn(prepare_next_riddle(session)))
+
+
+def prepared_next_riddle(task: Optional[asyncio.Task]):
+    """Riddle and its audio prepared for this turn if they are ready, an unfinished one is dropped."""
+    if task is None:
+        return None, None
+    if not task.done():
+        print("Prepared riddle is not ready yet, dropping it")
+        task.cancel()
+        next_riddles.dropped += 1
+        return None, None
+    if task.cancelled() or task.exception() is not None:
+        next_riddles.dropped += 1
+        return None, None
+    return task.result()
 
-    await sio.emit('say',
-                   ResponseContinue(
-                       player=info,
-                       total_riddles_correct=ai_resp.riddles_correct,
-                       answer_correct=ai_resp.answer_correct,
-                       wav_location=resp_tts.output_file_url,
-                       transcription=ai_resp.text).model_dump_json(),
-                   room=sid)
+
+async def greet_from_chatgpt(sid, info: OldPlayer, flag_new: bool):
+    session = await sessions.get(sid, info)
+
+    greeting = None
+    prepared = None if flag_new else greetings.take((sid, info.id))
+    if prepared is not None:
+        try:
+            # shielded to tell the prepared greeting being cancelled from this one being cancelled
+            greeting, resp_tts = await asyncio.shield(prepared)
+            greetings.hits += 1
+            print("Greeting was prepared while the player approached")
+        except asyncio.CancelledError:
+            if not prepared.cancelled():
+                prepared.cancel()
+                raise
+            greetings.dropped += 1
+            print("Prepared greeting was cancelled")
+        except Exception as e:
+            greetings.dropped += 1
+            print(f"Prepared greeting can't be used: {e!r}")
+
+    if greeting is None:
+        greeting = await in_stage("llm", riddles.draft_greeting, session=session, flag_new=flag_new)
+        resp_tts = await in_stage(
+            "tts",
+            generate_tts,
+            text=greeting.response.text,
+            character_voice=session.voice,
+            language=info.lang,
+            output_file_name=generate_random_string(),
+        )
+
+    riddles.commit_greeting(session, greeting)
+    await asyncio.to_thread(sessions.turn_done, session)
+    ai_resp = greeting.response
+    prefetch_next_riddle(sid, session, ai_resp)
+
+    await emit_model('say',
+                     ResponseContinue(
+                         player=info,
+                         total_riddles_correct=ai_resp.riddles_correct,
+                         answer_correct=ai_resp.answer_correct,
+                         wav_location=resp_tts.output_file_url,
+                         transcription=ai_resp.text),
+                     sid)
+
+
+async def emit_model(event: str, model, sid):
+    """Binary attachments for clients which announced the wire protocol, JSON for older ones."""
+    if sid in wire_clients:
+        await sio.emit(event, pack(model, turn=current_turn.get()), room=sid)
+    else:
+        await sio.emit(event, model.model_dump_json(), room=sid)
 
 
 async def emit_error(func, sid, e):
@@ -86,155 +291,381 @@ async def emit_error(func, sid, e):
 
 
 async def ask_player_to_repeat(sid, info: OldPlayer):
-    riddle_response = riddles.cannot_understand_player(info)
-
-    resp_tts = tts.generate_tts_export(
+    session = await sessions.get(sid, info)
+    if session.entry is None:
+        # nothing to repeat, the greeting was shed
+        await greet_from_chatgpt(sid=sid, info=info, flag_new=False)
+        return
+    riddle_response = await in_stage("llm", riddles.cannot_understand_player, session)
+
+    resp_tts = await in_stage(
+        "tts",
+        generate_tts,
         text=riddle_response.text,
-        character_voice=info.voice,
+        character_voice=session.voice,
         language=info.lang,
         output_file_name=generate_random_string(),
     )
 
-    await sio.emit('say',
-                   ResponseContinue(
-                       player=info,
-                       answer_correct=riddle_response.answer_correct,
-                       total_riddles_correct=riddle_response.riddles_correct,
-                       transcription=riddle_response.text,
-                       wav_location=resp_tts.output_file_url,
-                   ).model_dump_json(),
-                   room=sid)
+    await emit_model('say',
+                     ResponseContinue(
+                         player=info,
+                         answer_correct=riddle_response.answer_correct,
+                         total_riddles_correct=riddle_response.riddles_correct,
+                         transcription=riddle_response.text,
+                         wav_location=resp_tts.output_file_url,
+                     ),
+                     sid)
+
+
+async def answer_on_riddle(sid, player: OldPlayer, decode: Callable):
+    """
+    Args:
+        sid (str): Client of the player.
+        player (OldPlayer): Who answered.
+        decode (Callable): Returns the samples of the answer, it's called on a worker of the stt stage.
+    """
+    session = await sessions.get(sid, player)
+    if session.entry is None:
+        # the greeting was shed, there is nothing to answer on or to repeat yet
+        print("Player wasn't greeted yet, greeting them instead")
+        await greet_from_chatgpt(sid=sid, info=player, flag_new=False)
+        return
+
+    def transcribe():
+        with tracer.span("decode"):
+            audio = decode()
+        return transcriber.transcribe_audio(audio)
 
-
-@sio.event
-async def give_answer_on_riddle(sid, data):
     try:
-        model = PlayerVoiceChunk.model_validate_json(data)
-        tmp_path = save_bytes_to_temp_file(model.recording)
-        print(f'tmp path: {tmp_path}')
-
-        try:
-            player_response = transcriber.transcribe(file_path=tmp_path)
-        except SilenceDetectedError:
-            print("Only silence or non audible noise detected, asking to retry")
-            await ask_player_to_repeat(sid, model.player)
-            return
-
-        print(f'transcribed: {player_response}')
-
-        if player_response.lang != model.player.lang:
-            print("We decoded wrong language, ask player to repeat")
-            await ask_player_to_repeat(sid=sid, info=model.player)
-            return
-
-        if player_response.text == "":
-            print("Something wrong with transcribing, maybe just background noise?")
-            await ask_player_to_repeat(sid, model.player)
-            return
-
+        player_response = await in_stage("stt", transcribe)
+    except SilenceDetectedError:
+        print("Only silence or non audible noise detected, asking to retry")
+        await ask_player_to_repeat(sid, player)
+        return
+
+    print(f'transcribed: {player_response}')
+
+    if player_response.lang != player.lang:
+        print("We decoded wrong language, ask player to repeat")
+        await ask_player_to_repeat(sid=sid, info=player)
+        return
+
+    if player_response.text == "":
+        print("Something wrong with transcribing, maybe just background noise?")
+        await ask_player_to_repeat(sid, player)
+        return
+
+    key = (sid, player.id)
+    prepared_task = next_riddles.take(key)
+    prepared, prepared_tts = prepared_next_riddle(prepared_task)
+    reply = None
+    try:
         try:
-            riddle_response = riddles.process_response_on_riddle(
-                info=model.player,
+            reply = await in_stage(
+                "llm",
+                riddles.draft_response,
+                session=session,
                 riddle_response=player_response.text,
+                prepared=prepared,
             )
+            riddle_response = reply.response
         except ValueError as e:
             print(f"riddle_response ended with error, error was: {str(e)}")
-            riddle_response = riddles.fish_troubles_with_memory(
-                info=model.player)
+            riddle_response = await in_stage(
+                "llm", riddles.fish_troubles_with_memory, info=player)
 
-        resp_tts = tts.generate_tts_export(
-            text=riddle_response.text,
-            character_voice=model.player.voice,
-            language=model.player.lang,
-            output_file_name=generate_random_string(),
+        used = prepared is not None and riddle_response.text.strip() == prepared.text.strip()
+        if used:
+            print("Prepared riddle was used, its audio is ready")
+            resp_tts = prepared_tts
+        else:
+            resp_tts = await in_stage(
+                "tts",
+                generate_tts,
+                text=riddle_response.text,
+                character_voice=session.voice,
+                language=player.lang,
+                output_file_name=generate_random_string(),
+            )
+    except Overloaded:
+        # shed, the player says it again and the prepared riddle is still good for that
+        if prepared is not None:
+            next_riddles.speculate(key, prepared_task)
+        raise
+
+    if prepared is not None:
+        if used:
+            next_riddles.hits += 1
+        else:
+            next_riddles.unused += 1
+
+    # only the turn the player hears is kept
+    if reply is not None:
+        riddles.commit_response(session, reply)
+    await asyncio.to_thread(sessions.turn_done, session)
+    if riddle_response.player_wants_to_stop:
+        await sessions.end(sid, player.id)
+        resp = ResponseStop(
+            player=player,
+            wav_location=resp_tts.output_file_url,
+            transcription=riddle_response.text,
         )
 
-        if riddle_response.player_wants_to_stop:
-            resp = ResponseStop(
-                player=model.player,
-                wav_location=resp_tts.output_file_url,
-                transcription=riddle_response.text,
-            )
+        await emit_model('say_no_continue', resp, sid)
+    else:
+        resp = ResponseContinue(
+            player=player,
+            total_riddles_correct=riddle_response.riddles_correct,
+            answer_correct=riddle_response.answer_correct,
+            transcription=riddle_response.text,
+            wav_location=resp_tts.output_file_url,
+        )
+
+        await emit_model('say', resp, sid)
+        prefetch_next_riddle(sid, session, riddle_response)
 
-            await sio.emit('say_no_continue', resp.model_dump_json(), room=sid)
-        else:
-            resp = ResponseContinue(
-                player=model.player,
-                total_riddles_correct=riddle_response.riddles_correct,
-                answer_correct=riddle_response.answer_correct,
-                transcription=riddle_response.text,
-                wav_location=resp_tts.output_file_url,
-            )
 
-            await sio.emit('say', resp.model_dump_json(), room=sid)
+@sio.event
+@traced
+async def give_answer_on_riddle(sid, data):
+    try:
+        model = unpack(PlayerVoiceChunk, data)
+        # decoded once admitted, a shed answer never takes the memory
+        decode = functools.partial(decode_recording, model.recording, model.codec, model.sample_rate)
+        await admitted(sid,
+                       lambda: answer_on_riddle(sid, model.player, decode),
+                       lambda: hold_on(sid, model.player))
 
     except Exception as e:
         await emit_error("give_answer_on_riddle", sid, e)
 
 
 @sio.event
-async def greet_old_player(sid, data):
+@traced
+async def answer_chunk(sid, data):
+    """Same as give_answer_on_riddle, but the recording arrives in pieces while the player speaks."""
     try:
-        model = OldPlayer.model_validate_json(data)
-        await greet_from_chatgpt(sid=sid, info=model, flag_new=False)
+        model = unpack(PlayerVoiceStream, data)
+
+        stream = answer_streams.get(sid)
+        if stream is None or model.seq == 0:
+            stream = AnswerStream(model.player, complete=model.seq == 0)
+            answer_streams[sid] = stream
+        stream.add(model.seq, model.recording, model.codec, model.sample_rate)
+
+        if model.final:
+            del answer_streams[sid]
+            tracer.record("answer_stream", time.perf_counter() - stream.started, chunks=model.seq)
+            if stream.complete:
+                answer = lambda: answer_on_riddle(sid, stream.player, stream.audio)
+            else:
+                # transcribed without its beginning it would be a different answer
+                print("Answer stream is missing its beginning, asking to repeat")
+                answer = lambda: ask_player_to_repeat(sid, stream.player)
+            await admitted(sid, answer, lambda: hold_on(sid, stream.player))
 
     except Exception as e:
-        await emit_error("greet_old_player", sid, e)
+        answer_streams.pop(sid, None)
+        await emit_error("answer_chunk", sid, e)
 
 
 @sio.event
-async def greet_new_player(sid, data):
+@traced
+async def answer_cancel(sid, data):
+    """The player walked away while answering, their partial answer and prepared riddle are dropped."""
     try:
-        model = NewPlayer.model_validate_json(data)
-        tmp_path = save_bytes_to_temp_file(model.recording)
-        print(f'tmp path: {tmp_path}')
+        model = unpack(OldPlayer, data)
+        answer_streams.pop(sid, None)
+        next_riddles.cancel((sid, model.id))
 
-        try:
-            transcribed = transcriber.transcribe(file_path=tmp_path)
-        except SilenceDetectedError:
-            print(
-                "Something wrong with initial greeting, ask player again startup sequence")
-            await sio.emit('retry_greeting',
-                           ResponseRetry(player=model)
-                           .model_dump_json(),
-                           room=sid)
-            return
+    except Exception as e:
+        await emit_error("answer_cancel", sid, e)
 
-        print(f'transcribed: {transcribed}')
 
-        corrected_lang = parse_language(
-            text=transcribed.text, possible_lang=transcribed.lang)
+@sio.event
+async def connect(sid, environ, auth=None):
+    if auth and auth.get("wire", 0) >= WIRE_VERSION:
+        wire_clients.add(sid)
+
+
+@sio.event
+async def disconnect(sid):
+    wire_clients.discard(sid)
+    answer_streams.pop(sid, None)
+    greetings.cancel_where(lambda key: key[0] == sid)
+    next_riddles.cancel_where(lambda key: key[0] == sid)
+    await sessions.end_sid(sid)
+
+
+async def start_background_tasks(app):
+    app['session_expiry'] = asyncio.create_task(sessions.expire_idle())
+    app['canned'] = asyncio.create_task(canned.prepare())
+    if os.getenv("LOOP_MONITOR"):
+        monitor.start()
+
+
+async def cleanup_background_tasks(app):
+    app['session_expiry'].cancel()
+    app['canned'].cancel()
+    await sessions.end_all()
+    monitor.stop()
+    tracer.close()
+
+
+async def metrics(request):
+    """Prometheus scrape endpoint: span histograms, speculation and session counts."""
+    lines = [
+        "# HELP fish_speculation_total Outcome of the work started ahead of time.",
+        "# TYPE fish_speculation_total counter",
+    ]
+    for cache in (greetings, next_riddles):
+        stats = cache.stats()
+        for outcome in ("hits", "dropped", "unused", "misses", "cancelled", "skipped"):
+            lines.append(f'fish_speculation_total{{cache="{cache.name}",outcome="{outcome}"}} {stats[outcome]}')
+    lines += [
+        "# HELP fish_sessions Players with an open session.",
+        "# TYPE fish_sessions gauge",
+        f"fish_sessions {len(sessions.sessions)}",
+    ]
+    return web.Response(text=tracer.metrics() + monitor.metrics() + admission.metrics() +
+                        "\n".join(lines) + "\n",
+                        content_type="text/plain")
+
+
+def check_admin(request):
+    token = os.getenv("ADMIN_TOKEN")
+    if token and request.headers.get("X-Admin-Token") != token:
+        raise web.HTTPUnauthorized()
+
+
+async def loop_report(request):
+    """Lag, handlers in flight and the stacks of the calls which blocked the loop."""
+    check_admin(request)
+    return web.json_response(monitor.report())
 
-        if corrected_lang == None:
-            print("we cannot recognize language, trying again")
-            await sio.emit('retry_greeting',
-                           ResponseRetry(player=model)
-                           .model_dump_json(),
-                           room=sid)
+
+async def admission_report(request):
+    """Stage queues, turns in flight and what was refused or shed."""
+    check_admin(request)
+    return web.json_response(admission.stats())
+
+
+app.router.add_get('/metrics', metrics)
+app.router.add_get('/admin/loop', loop_report)
+app.router.add_get('/admin/admission', admission_report)
+
+
+app.on_startup.append(start_background_tasks)
+app.on_cleanup.append(cleanup_background_tasks)
+
+
+@sio.event
+@traced
+async def player_arriving(sid, data):
+    """Hint of the client that a known player is probably in front of the fish."""
+    try:
+        model = unpack(OldPlayer, data)
+        if (sid, model.id) in greetings.pending:
             return
+        session = await sessions.get(sid, model)
+        greetings.speculate((sid, model.id), session.spawn(prepare_greeting(session)))
 
-        player_info = OldPlayer(
-            id=model.id,
-            age=model.age,
-            confidence=model.confidence,
-            lang=corrected_lang,
-            voice=tts.get_random_voice(),
-        )
+    except Exception as e:
+        await emit_error("player_arriving", sid, e)
 
-        player_preferences = UserPreference(
-            id=player_info.id,
-            lang=corrected_lang,
-            voice=player_info.voice,
-        )
 
-        await sio.emit('save_player_preferences', player_preferences.model_dump_json(), room=sid)
-        await greet_from_chatgpt(sid=sid, info=player_info, flag_new=True)
+@sio.event
+@traced
+async def player_gone(sid, data):
+    """The player of player_arriving walked away before being greeted."""
+    try:
+        model = unpack(OldPlayer, data)
+        greetings.cancel((sid, model.id))
+
+    except Exception as e:
+        await emit_error("player_gone", sid, e)
+
+
+@sio.event
+@traced
+async def greet_old_player(sid, data):
+    try:
+        model = unpack(OldPlayer, data)
+        await admitted(sid,
+                       lambda: greet_from_chatgpt(sid=sid, info=model, flag_new=False),
+                       lambda: hold_on(sid, model))
+
+    except Exception as e:
+        await emit_error("greet_old_player", sid, e)
+
+
+@sio.event
+@traced
+async def greet_new_player(sid, data):
+    try:
+        model = unpack(NewPlayer, data)
+        player_info = None
+
+        async def greet():
+            nonlocal player_info
+            tmp_path = save_bytes_to_temp_file(model.recording)
+            print(f'tmp path: {tmp_path}')
+
+            try:
+                transcribed = await in_stage("stt", transcriber.transcribe, file_path=tmp_path)
+            except SilenceDetectedError:
+                print(
+                    "Something wrong with initial greeting, ask player again startup sequence")
+                await emit_model('retry_greeting', ResponseRetry(player=model), sid)
+                return
+
+            print(f'transcribed: {transcribed}')
+
+            corrected_lang = parse_language(
+                text=transcribed.text, possible_lang=transcribed.lang)
+
+            if corrected_lang == None:
+                print("we cannot recognize language, trying again")
+                await emit_model('retry_greeting', ResponseRetry(player=model), sid)
+                return
+
+            player_info = OldPlayer(
+                id=model.id,
+                age=model.age,
+                confidence=model.confidence,
+                lang=corrected_lang,
+                voice=await asyncio.to_thread(tts.get_random_voice),
+            )
+
+            player_preferences = UserPreference(
+                id=player_info.id,
+                lang=corrected_lang,
+                voice=player_info.voice,
+            )
+
+            await emit_model('save_player_preferences', player_preferences, sid)
+            await greet_from_chatgpt(sid=sid, info=player_info, flag_new=True)
+
+        async def shed():
+            # with the language known the player can just answer, else they're asked again
+            if player_info is not None:
+                await hold_on(sid, player_info)
+            else:
+                await emit_model('retry_greeting', ResponseRetry(player=model), sid)
+
+        await admitted(sid, greet, shed)
 
     except Exception as e:
         await emit_error("greet_new_player", sid, e)
 
 
-if __name__ == "__main__":
+def serve(port: int = 8081, reuse_port: bool = False):
+    """
+    Args:
+        port (int, optional): Port of the Socket.IO server. Default is 8081.
+        reuse_port (bool, optional): Share the port with the other workers, the kernel spreads the connections between them. Default is False.
+    """
     if not tts.initialize():
         print("Failed to initialize AllTalk API.")
         sys.exit(1)
@@ -251,4 +682,8 @@ if __name__ == "__main__":
         print("Enabled")
 
     print("Starting server")
-    web.run_app(app, port=8081)
+    web.run_app(app, port=port, reuse_port=reuse_port)
+
+
+if __name__ == "__main__":
+    serve()
@@ -0,0 +1,179 @@
+import asyncio
+import sqlite3
+import time
+from typing import Dict, List, Optional, Tuple
+from uuid import UUID
+
+from models.history import MessageEntry, UserEntry
+from models.profile import OldPlayer
+from models.store import PlayerStore, StaleVersion
+
+
+class Session:
+    def __init__(self, sid: str, player: OldPlayer, entry: Optional[UserEntry], version: int = 0):
+        """
+        Conversation of one player on one connection, kept between the turns.
+
+        Holds the messages already dumped into the form sent to OpenAI, so a
+        turn only dumps what it adds, and a cursor of how many messages are in
+        the store, so a flush only writes the new ones.
+
+        The version is the one of the stored conversation the session is
+        based on, another worker may have saved the player's since.
+        """
+        self.sid = sid
+        self.player = player
+        # TTS voice, the player model of every event carries it again
+        self.voice = player.voice
+        self.entry = entry
+        self.prompt = [i.model_dump() for i in entry.messages] if entry else []
+        self.stored = len(entry.messages) if entry else 0
+        self.version = version
+        # new conversation, the stored one is dropped on flush
+        self.replace = False
+        # speculative work for this player, cancelled when the session ends
+        self.tasks = set()
+        self.last_active = time.monotonic()
+
+    @property
+    def dirty(self) -> bool:
+        return self.entry is not None and (self.replace or len(self.entry.messages) > self.stored)
+
+    def touch(self, player: OldPlayer = None):
+        if player is not None:
+            self.player = player
+            self.voice = player.voice
+        self.last_active = time.monotonic()
+
+    def start(self, entry: UserEntry):
+        self.entry = entry
+        self.prompt = [i.model_dump() for i in entry.messages]
+        self.stored = 0
+        self.replace = True
+
+    def append(self, *messages: MessageEntry):
+        self.entry.messages.extend(messages)
+        self.prompt.extend(i.model_dump() for i in messages)
+
+    def prompt_with(self, *messages: MessageEntry) -> List[dict]:
+        """The conversation plus messages which aren't kept in it."""
+        return self.prompt + [i.model_dump() for i in messages]
+
+    def spawn(self, coro) -> asyncio.Task:
+        task = asyncio.ensure_future(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    def flush(self, store: PlayerStore, attempts: int = 3):
+        if not self.dirty:
+            return
+        for _ in range(attempts):
+            try:
+                self.version = store.save_conversation(
+                    self.player.id, self.entry, replace=self.replace, version=self.version)
+                self.stored = len(self.entry.messages)
+                self.replace = False
+                return
+            except StaleVersion as e:
+                print(f"Conversation of {self.player.id} changed meanwhile ({str(e)}), rebasing")
+                self.rebase(store)
+            except sqlite3.OperationalError as e:
+                # locked by other workers for too long, still dirty so the next flush tries again
+                print(f"Unable to save the conversation of {self.player.id}: {str(e)}")
+                return
+        print(f"Unable to save the conversation of {self.player.id}, it kept changing")
+
+    def rebase(self, store: PlayerStore):
+        """
+        Puts the messages of this session after the ones stored meanwhile. A
+        new conversation replaces the stored one anyway, it only takes the version.
+        """
+        entry, self.version = store.versioned_conversation(self.player.id)
+        if self.replace:
+            return
+        if entry is None:
+            # nothing stored to build on, the whole conversation is written
+            self.stored = 0
+            return
+        new = self.entry.messages[self.stored:]
+        entry.messages.extend(new)
+        self.entry = entry
+        self.prompt = [i.model_dump() for i in entry.messages]
+        self.stored = len(entry.messages) - len(new)
+
+
+class SessionManager:
+    def __init__(self, store: PlayerStore, idle_timeout: float = 120.0, flush_turns: bool = False):
+        """
+        Sessions keyed by Socket.IO sid and player UUID.
+
+        Args:
+            store (PlayerStore): Where conversations are read from and flushed to.
+            idle_timeout (float, optional): Seconds without a turn after which the player is gone. Default is 120.
+            flush_turns (bool, optional): Flush after every turn rather than when the session ends, so other workers sharing the store see it right away. Default is False.
+        """
+        self.store = store
+        self.idle_timeout = idle_timeout
+        self.flush_turns = flush_turns
+        self.sessions: Dict[Tuple[str, UUID], Session] = {}
+
+    async def get(self, sid: str, player: OldPlayer) -> Session:
+        """Session of the player, opened with the stored conversation when there is none."""
+        key = (sid, player.id)
+        session = self.sessions.get(key)
+        if session is None:
+            stored = await asyncio.to_thread(self.store.versioned_conversation, player.id)
+            # another turn may have opened it meanwhile
+            session = self.sessions.get(key)
+            if session is None:
+                session = Session(sid, player, *stored)
+                self.sessions[key] = session
+        session.touch(player)
+        return session
+
+    def turn_done(self, session: Session):
+        if self.flush_turns:
+            session.flush(self.store)
+
+    def find(self, sid: str, player_id: UUID) -> Optional[Session]:
+        return self.sessions.get((sid, player_id))
+
+    async def end(self, sid: str, player_id: UUID):
+        session = self.sessions.pop((sid, player_id), None)
+        if session is None:
+            return
+        for task in list(session.tasks):
+            task.cancel()
+        await asyncio.to_thread(session.flush, self.store)
+
+    async def end_sid(self, sid: str):
+        for key in [key for key in self.sessions if key[0] == sid]:
+            await self.end(*key)
+
+    async def end_all(self):
+        for key in list(self.sessions):
+            await self.end(*key)
+
+    async def expire(self) -> int:
+        now = time.monotonic()
+        idle = [key for key, session in self.sessions.items()
+                if now - session.last_active > self.idle_timeout]
+        for key in idle:
+            try:
+                await self.end(*key)
+            except Exception as e:
+                # one broken session mustn't keep the others from expiring
+                print(f"Unable to end the idle session {key}: {str(e)}")
+        return len(idle)
+
+    async def expire_idle(self, interval: float = 15.0):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                expired = await self.expire()
+            except Exception as e:
+                print(f"Expiring idle sessions failed: {str(e)}")
+                continue
+            if expired:
+                print(f"Ended {expired} idle sessions")
@@ -0,0 +1,180 @@
+"""
+Local stand-ins for what the Riddle Processor talks to, so it can be run and
+benchmarked without an OpenAI key, an AllTalk instance or a GPU:
+
+* FakeOpenAI - the chat completions endpoint, answering with RiddleResponse JSON
+* FakeAllTalk - the AllTalk API endpoints the processor uses, serving silent WAVs
+* StubTranscriber - in place of WhisperTranscriber, takes time proportional to the audio
+
+Delays are configurable. OpenAI and AllTalk are called with blocking clients,
+so the fakes have to run on another event loop than the processor.
+"""
+import asyncio
+import io
+import json
+import random
+import time
+import wave
+
+import numpy as np
+from aiohttp import web
+
+from models.riddles import RiddleResponse
+from models.tracing import NullTracer, Tracer
+from models.transcribe import TranscribeResult
+
+
+def silent_wav(seconds: float, rate: int = 24000) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(b"\0\0" * int(seconds * rate))
+    return buffer.getvalue()
+
+
+def wav_seconds(file_path: str) -> float:
+    try:
+        with wave.open(file_path, 'rb') as f:
+            return f.getnframes() / f.getframerate()
+    except (wave.Error, EOFError):
+        return 1.0
+
+
+class FakeOpenAI:
+    def __init__(self, delay: float = 0.5, jitter: float = 0.1, seed: int = 0):
+        """
+        Args:
+            delay (float, optional): Mean seconds per completion. Default is 0.5.
+            jitter (float, optional): Completions take delay +- jitter seconds. Default is 0.1.
+            seed (int, optional): Seed of the delays and of the made up answers. Default is 0.
+        """
+        self.delay = delay
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.requests = 0
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post('/v1/chat/completions', self.completions)
+        return app
+
+    def riddle_response(self, messages) -> RiddleResponse:
+        # asked for a riddle ahead of time, or a coin flip between a riddle and a question
+        asks_riddle = "Prepare a new riddle" in json.dumps(messages[-1]) or self.random.random() < 0.5
+        n = self.requests
+        return RiddleResponse(
+            text=f"Blub! Here is riddle number {n}, what has keys but can't open locks?"
+            if asks_riddle else "Blub! Well done. Do you want another riddle or a fact?",
+            riddles_correct=n // 2,
+            answer_correct=self.random.random() < 0.3,
+            player_wants_to_stop=False,
+            player_wants_interesting_fact=False,
+            riddle_text=f"What has keys but can't open locks? ({n})" if asks_riddle else "",
+            fact_text="",
+        )
+
+    async def completions(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        self.requests += 1
+        await asyncio.sleep(max(0.0, self.delay + self.random.uniform(-self.jitter, self.jitter)))
+
+        content = self.riddle_response(body["messages"]).model_dump_json()
+        prompt_tokens = len(json.dumps(body["messages"])) // 4
+        completion_tokens = len(content) // 4
+        return web.json_response({
+            "id": f"chatcmpl-bench{self.requests}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-4o-mini"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content, "refusal": None},
+                "logprobs": None,
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        })
+
+
+class FakeAllTalk:
+    def __init__(self, delay: float = 0.3, per_char: float = 0.002, audio_seconds: float = 3.0):
+        """
+        Args:
+            delay (float, optional): Seconds of every TTS generation. Default is 0.3.
+            per_char (float, optional): Seconds added per character of the text. Default is 0.002.
+            audio_seconds (float, optional): Length of the served WAVs. Default is 3.
+        """
+        self.delay = delay
+        self.per_char = per_char
+        self.wav = silent_wav(audio_seconds)
+        self.requests = 0
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get('/api/ready', self.ready)
+        app.router.add_get('/api/currentsettings', self.current_settings)
+        app.router.add_get('/api/voices', self.voices)
+        app.router.add_get('/api/rvcvoices', self.rvc_voices)
+        app.router.add_post('/api/tts-generate', self.tts_generate)
+        app.router.add_get('/audio/{name}', self.audio)
+        return app
+
+    async def ready(self, request):
+        return web.Response(text="Ready")
+
+    async def current_settings(self, request):
+        return web.json_response({"deepspeed_enabled": True})
+
+    async def voices(self, request):
+        return web.json_response({"voices": ["bench_female.wav", "bench_male.wav"]})
+
+    async def rvc_voices(self, request):
+        return web.json_response({"rvcvoices": []})
+
+    async def tts_generate(self, request):
+        data = await request.post()
+        self.requests += 1
+        await asyncio.sleep(self.delay + self.per_char * len(data.get("text_input", "")))
+        name = data.get("output_file_name", "bench")
+        return web.json_response({
+            "status": "generate-success",
+            "output_file_path": f"/outputs/{name}.wav",
+            "output_file_url": f"/audio/{name}.wav",
+        })
+
+    async def audio(self, request):
+        return web.Response(body=self.wav, content_type="audio/wav")
+
+
+class StubTranscriber:
+    def __init__(self, rtf: float = 0.1, lang: str = "en", tracer: Tracer = None, **kwargs):
+        """
+        Takes the place of WhisperTranscriber. Blocks like the real one does,
+        for rtf (real time factor) times the length of the audio.
+
+        Args:
+            rtf (float, optional): Seconds of transcribing per second of audio. Default is 0.1.
+            lang (str, optional): Language of every transcription. Default is en.
+            tracer (Tracer, optional): Records whisper spans. Default is not recording anything.
+        """
+        self.rtf = rtf
+        self.lang = lang
+        self.tracer = tracer if tracer is not None else NullTracer()
+
+    def transcribe(self, file_path: str) -> TranscribeResult:
+        # greetings of new players: the language they want
+        return self.transcribe_seconds(wav_seconds(file_path), "english")
+
+    def transcribe_audio(self, audio: np.ndarray) -> TranscribeResult:
+        return self.transcribe_seconds(len(audio) / 16000, "a keyboard")
+
+    def transcribe_seconds(self, seconds: float, text: str) -> TranscribeResult:
+        with self.tracer.span("whisper", lang=self.lang):
+            time.sleep(seconds * self.rtf)
+        return TranscribeResult(text=text, lang=self.lang)
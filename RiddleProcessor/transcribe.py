@@ -1,7 +1,16 @@
+import io
+
+import numpy as np
 from faster_whisper import WhisperModel
+from faster_whisper.audio import decode_audio
 from pydub import AudioSegment
 from pydub.silence import detect_nonsilent
 from models.transcribe import *
+from models.tracing import NullTracer, Tracer
+
+
+# rate faster-whisper expects for numpy input
+WHISPER_RATE = 16000
 
 
 class SilenceDetectedError(Exception):
@@ -9,10 +18,30 @@ class SilenceDetectedError(Exception):
     pass
 
 
+def decode_recording(recording: bytes, codec: str = "wav", sample_rate: int = None) -> np.ndarray:
+    """
+    Decodes an uploaded recording in memory into what the transcriber takes:
+    float32 mono samples at WHISPER_RATE.
+    """
+    if len(recording) == 0:
+        return np.zeros(0, dtype=np.float32)
+
+    if codec == "pcm_s16le":
+        samples = np.frombuffer(recording, dtype='<i2').astype(np.float32) / 32768
+        if sample_rate in (None, WHISPER_RATE):
+            return samples
+        # let the decoder resample, wrapped as WAV it knows the rate
+        recording = AudioSegment(data=recording, sample_width=2,
+                                 frame_rate=sample_rate, channels=1).export(format="wav").read()
+
+    return decode_audio(io.BytesIO(recording), sampling_rate=WHISPER_RATE)
+
+
 class WhisperTranscriber:
-    def __init__(self, model_name="medium"):
+    def __init__(self, model_name="medium", device="cuda", compute_type="float16", tracer: Tracer = None):
         self.model = WhisperModel(
-            model_name, device="cuda", compute_type="float16")
+            model_name, device=device, compute_type=compute_type)
+        self.tracer = tracer if tracer is not None else NullTracer()
 
     def detect_and_trim_silence(self, file_path, silence_thresh=-50, min_silence_len=500):
         """
@@ -25,7 +54,9 @@ class WhisperTranscriber:
         """
         # Load the audio file
         audio = AudioSegment.from_wav(file_path)
+        return self.trim_silence(audio, silence_thresh, min_silence_len)
 
+    def trim_silence(self, audio: AudioSegment, silence_thresh=-50, min_silence_len=500):
         # Detect non-silent chunks
         non_silent_chunks = detect_nonsilent(
             audio, min_silence_len=min_silence_len, silence_thresh=silence_thresh)
@@ -44,11 +75,29 @@ class WhisperTranscriber:
     def transcribe(self, file_path: str) -> TranscribeResult:
         new_path = f'{file_path}.trimmed.wav'
 
-        trimmed_audio = self.detect_and_trim_silence(file_path)
-        trimmed_audio.export(new_path, format="wav")
+        with self.tracer.span("trim"):
+            trimmed_audio = self.detect_and_trim_silence(file_path)
+            trimmed_audio.export(new_path, format="wav")
+
+        return self.transcribe_input(new_path)
+
+    def transcribe_audio(self, audio: np.ndarray) -> TranscribeResult:
+        """Same as transcribe, for samples from decode_recording, without temporary files."""
+        with self.tracer.span("trim"):
+            pcm = (np.clip(audio, -1, 1) * 32767).astype(np.int16)
+            segment = AudioSegment(data=pcm.tobytes(), sample_width=2,
+                                   frame_rate=WHISPER_RATE, channels=1)
+            trimmed = self.trim_silence(segment)
+
+        samples = np.array(trimmed.get_array_of_samples(), dtype=np.float32) / 32768
+        return self.transcribe_input(samples)
 
-        segments, info = self.model.transcribe(new_path, beam_size=5)
-        segments = list(segments)
+    def transcribe_input(self, audio) -> TranscribeResult:
+        with self.tracer.span("whisper") as span:
+            segments, info = self.model.transcribe(audio, beam_size=5)
+            # segments are decoded while iterating
+            segments = list(segments)
+            span["lang"] = info.language
 
         if len(segments) == 0:
             raise SilenceDetectedError("No audible segment detected")
@@ -0,0 +1,78 @@
+"""
+Runs several Riddle Processor workers on one port, so more fish can be served
+by adding cores:
+
+    python -m RiddleProcessor.workers --workers 4
+
+Every worker is its own process with its own Whisper model, OpenAI and AllTalk
+clients, the kernel spreads the incoming connections between them. The fish
+only connect over websocket, so a connection stays with the worker it reached
+and no sticky sessions are needed.
+
+Sharing a port needs SO_REUSEPORT, which Windows doesn't have. There every
+worker gets a port of its own instead, counting up from --port:
+
+    python -m RiddleProcessor.workers --workers 4 --separate-ports
+
+and each fish is pointed at one of them, or a proxy spreads the fish over them.
+
+Conversations and the riddle registry are shared through FISH_DB, writes of
+a worker based on an outdated read are retried on top of what the others
+wrote. FISH_DB is a SQLite file, so the workers sharing it run on one machine.
+With SIO_MESSAGE_QUEUE (redis:// or amqp://) an emit reaches a client
+connected to any worker.
+"""
+import argparse
+import multiprocessing
+import os
+import socket
+import sys
+
+
+def run_worker(index: int, count: int, port: int, reuse_port: bool):
+    os.environ["WORKER_ID"] = str(index)
+    os.environ["WORKERS"] = str(count)
+    # the server is set up on import, which has to happen in the worker
+    from . import server
+    server.serve(port=port, reuse_port=reuse_port)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run several Riddle Processor workers on one port")
+    parser.add_argument('--workers', type=int, default=2, help="number of worker processes")
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--separate-ports', action='store_true',
+                        help="a port per worker, --port, --port + 1 and so on, for systems without SO_REUSEPORT")
+    args = parser.parse_args()
+
+    if not args.separate_ports and not hasattr(socket, "SO_REUSEPORT"):
+        sys.exit("Workers can't share a port on this system (no SO_REUSEPORT), "
+                 "run them with --separate-ports and spread the fish over the ports")
+
+    ports = [args.port + i if args.separate_ports else args.port for i in range(args.workers)]
+    # spawned, a forked CUDA context doesn't work in the child
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=run_worker,
+                                 args=(i, args.workers, port, not args.separate_ports),
+                                 name=f"riddle-worker-{i}")
+                 for i, port in enumerate(ports)]
+    for process in processes:
+        process.start()
+    if args.separate_ports:
+        print(f"Started {args.workers} workers on ports {ports[0]}-{ports[-1]}")
+    else:
+        print(f"Started {args.workers} workers on port {args.port}")
+
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        print("Stopping workers")
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,11 @@
-from pydantic import Base64Bytes, BaseModel, HttpUrl
+from typing import Literal, Optional
+from pydantic import Base64Bytes, BaseModel, Field, HttpUrl
 
 from models.profile import NewPlayer, OldPlayer
 
+# how a recording is encoded, pcm_s16le is raw mono samples at sample_rate
+AudioCodec = Literal["wav", "pcm_s16le", "flac", "opus"]
+
 
 class ResponseContinue(BaseModel):
     player: OldPlayer
@@ -28,3 +32,15 @@ class TTSResponse(BaseModel):
 class PlayerVoiceChunk(BaseModel):
     player: OldPlayer
     recording: Base64Bytes
+    codec: AudioCodec = Field(default="wav")
+    sample_rate: Optional[int] = Field(default=None)
+
+
+class PlayerVoiceStream(BaseModel):
+    """Piece of an answer sent while the player is still speaking."""
+    player: OldPlayer
+    seq: int
+    codec: AudioCodec
+    sample_rate: int
+    recording: Base64Bytes = Field(default=b"")
+    final: bool = Field(default=False)
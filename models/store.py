@@ -0,0 +1,316 @@
+"""
+Player state in one SQLite database: face encodings and preferences on the
+Riddle Client, conversation turns and the riddle registry on the Riddle
+Processor. Both use the same schema, each machine keeps its own file.
+
+Several Riddle Processor workers can share one file. Conversations and the
+riddle registry carry a version, a write based on an outdated read fails with
+StaleVersion instead of overwriting what another worker wrote.
+
+Existing JSON files are imported once with:
+
+    python -m models.store RiddleClient/fish.db --faces RiddleClient/recognized_faces.json \
+        --preferences RiddleClient/preferences.json
+    python -m models.store RiddleProcessor/fish.db --history RiddleProcessor/history.json \
+        --riddles RiddleProcessor/riddles_registry.json
+"""
+import argparse
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterable, List, Optional, Tuple
+from uuid import UUID
+
+import numpy as np
+
+from models.history import MessageEntry, PlayerEntries, UserEntry
+from models.profile import UserPreference, UserPreferences, UserProfile, UserProfiles
+from models.registry import Riddle, RiddlesRegistry
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS faces (
+    id TEXT PRIMARY KEY,
+    age TEXT NOT NULL,
+    confidence REAL NOT NULL,
+    encoding BLOB NOT NULL,
+    created REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS preferences (
+    id TEXT PRIMARY KEY,
+    lang TEXT NOT NULL,
+    voice TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS turns (
+    player TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    PRIMARY KEY (player, seq)
+);
+CREATE TABLE IF NOT EXISTS riddles (
+    lang TEXT NOT NULL,
+    text TEXT NOT NULL,
+    PRIMARY KEY (lang, text)
+);
+CREATE TABLE IF NOT EXISTS versions (
+    key TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+"""
+
+
+class StaleVersion(Exception):
+    """Someone else wrote since the version the write is based on was read."""
+
+    def __init__(self, key: str, expected: int, actual: int):
+        super().__init__(f"'{key}' is at version {actual}, not {expected}")
+        self.key = key
+        self.expected = expected
+        self.actual = actual
+
+
+class PlayerStore:
+    def __init__(self, path: str):
+        """
+        Opens (and creates when needed) the database in WAL mode, so readers
+        never wait for the writer and a write only appends to the log.
+
+        Every write is its own transaction, unless it runs inside `batch()`.
+
+        Args:
+            path (str): Database file, ':memory:' for a throwaway store.
+        """
+        self.path = path
+        self.lock = threading.RLock()
+        self.depth = 0
+
+        # autocommit, transactions are started explicitly in batch()
+        self.conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    @contextmanager
+    def batch(self):
+        """Groups the writes inside into one transaction, nesting is fine."""
+        with self.lock:
+            if self.depth == 0:
+                self.conn.execute("BEGIN IMMEDIATE")
+            self.depth += 1
+            try:
+                yield self
+            except BaseException:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.conn.execute("ROLLBACK")
+                raise
+            self.depth -= 1
+            if self.depth == 0:
+                self.conn.execute("COMMIT")
+
+    # versions, 0 for what was never written
+
+    def version(self, key: str) -> int:
+        with self.lock:
+            row = self.conn.execute("SELECT version FROM versions WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else 0
+
+    def bump(self, key: str, expected: Optional[int] = None) -> int:
+        """
+        Moves key to the next version, must run inside `batch()`.
+
+        Args:
+            key (str): What was written.
+            expected (int, optional): Version the write is based on, StaleVersion is raised when it moved on. Default is not checking.
+        """
+        actual = self.version(key)
+        if expected is not None and expected != actual:
+            raise StaleVersion(key, expected, actual)
+        self.conn.execute(
+            "INSERT INTO versions (key, version) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET version = excluded.version",
+            (key, actual + 1))
+        return actual + 1
+
+    # faces
+
+    def faces(self) -> List[UserProfile]:
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT id, age, confidence, encoding FROM faces ORDER BY created").fetchall()
+        return [UserProfile(id=UUID(id), age=age, confidence=confidence,
+                            encoding=np.frombuffer(encoding, dtype=np.float64))
+                for id, age, confidence, encoding in rows]
+
+    def add_face(self, profile: UserProfile):
+        encoding = np.asarray(profile.encoding, dtype=np.float64).tobytes()
+        with self.batch():
+            self.conn.execute(
+                "INSERT OR REPLACE INTO faces (id, age, confidence, encoding, created) VALUES (?, ?, ?, ?, ?)",
+                (str(profile.id), profile.age, float(profile.confidence), encoding, time.time()))
+
+    # preferences
+
+    def preference(self, id: UUID) -> Optional[UserPreference]:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT lang, voice FROM preferences WHERE id = ?", (str(id),)).fetchone()
+        if row is None:
+            return None
+        return UserPreference(id=id, lang=row[0], voice=row[1])
+
+    def preferences(self) -> List[UserPreference]:
+        with self.lock:
+            rows = self.conn.execute("SELECT id, lang, voice FROM preferences").fetchall()
+        return [UserPreference(id=UUID(id), lang=lang, voice=voice) for id, lang, voice in rows]
+
+    def upsert_preference(self, preference: UserPreference):
+        with self.batch():
+            self.conn.execute(
+                "INSERT INTO preferences (id, lang, voice) VALUES (?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET lang = excluded.lang, voice = excluded.voice",
+                (str(preference.id), preference.lang, preference.voice))
+
+    # conversation turns
+
+    def conversation(self, player: UUID) -> Optional[UserEntry]:
+        return self.versioned_conversation(player)[0]
+
+    def versioned_conversation(self, player: UUID) -> Tuple[Optional[UserEntry], int]:
+        """The conversation and its version, read together."""
+        with self.lock:
+            # one read transaction, a worker writing meanwhile can't come between them
+            own = not self.conn.in_transaction
+            if own:
+                self.conn.execute("BEGIN")
+            try:
+                rows = self.conn.execute(
+                    "SELECT role, content FROM turns WHERE player = ? ORDER BY seq", (str(player),)).fetchall()
+                version = self.version(f"turns:{player}")
+            finally:
+                if own:
+                    self.conn.execute("COMMIT")
+        if not rows:
+            return None, version
+        return UserEntry(messages=[MessageEntry(role=role, content=json.loads(content))
+                                   for role, content in rows]), version
+
+    def save_conversation(self, player: UUID, entry: UserEntry, replace: bool = False,
+                          version: Optional[int] = None) -> int:
+        """
+        Stores the messages of entry which aren't in the database yet, the
+        conversation only ever grows. With replace it starts over.
+
+        Args:
+            player (UUID): Whose conversation.
+            entry (UserEntry): The whole conversation.
+            replace (bool, optional): Drop the stored conversation first. Default is False.
+            version (int, optional): Version the entry was read at, StaleVersion is raised when another worker saved since. Default is not checking.
+
+        Returns:
+            int: The new version.
+        """
+        with self.batch():
+            version = self.bump(f"turns:{player}", version)
+            if replace:
+                self.conn.execute("DELETE FROM turns WHERE player = ?", (str(player),))
+            stored = self.conn.execute(
+                "SELECT COUNT(*) FROM turns WHERE player = ?", (str(player),)).fetchone()[0]
+            self.conn.executemany(
+                "INSERT INTO turns (player, seq, role, content) VALUES (?, ?, ?, ?)",
+                [(str(player), seq, message.role,
+                  json.dumps([content.model_dump() for content in message.content]))
+                 for seq, message in enumerate(entry.messages[stored:], start=stored)])
+        return version
+
+    # riddle registry
+
+    def riddles(self, lang: str) -> List[Riddle]:
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT text FROM riddles WHERE lang = ? ORDER BY rowid", (lang,)).fetchall()
+        return [Riddle(text=text) for text, in rows]
+
+    def add_riddle(self, lang: str, riddle: Riddle):
+        with self.batch():
+            added = self.conn.execute(
+                "INSERT OR IGNORE INTO riddles (lang, text) VALUES (?, ?)", (lang, riddle.text)).rowcount
+            if added:
+                self.bump(f"riddles:{lang}")
+
+    # import of the JSON files used before
+
+    def import_faces(self, profiles: Iterable[UserProfile]) -> int:
+        count = 0
+        with self.batch():
+            for profile in profiles:
+                self.add_face(profile)
+                count += 1
+        return count
+
+    def import_preferences(self, preferences: Iterable[UserPreference]) -> int:
+        count = 0
+        with self.batch():
+            for preference in preferences:
+                self.upsert_preference(preference)
+                count += 1
+        return count
+
+    def import_history(self, history: PlayerEntries) -> int:
+        with self.batch():
+            for player, entry in history.root.items():
+                self.save_conversation(player, entry, replace=True)
+        return len(history.root)
+
+    def import_riddles(self, registry: RiddlesRegistry) -> int:
+        count = 0
+        with self.batch():
+            for lang, riddles in registry.root.items():
+                for riddle in riddles:
+                    self.add_riddle(lang, riddle)
+                    count += 1
+        return count
+
+
+def read(path: str) -> str:
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Import the JSON files of the Riddle Client/Processor into a player store")
+    parser.add_argument('db', help="SQLite database, created when missing")
+    parser.add_argument('--faces', help="recognized_faces.json of the Riddle Client")
+    parser.add_argument('--preferences', help="preferences.json of the Riddle Client")
+    parser.add_argument('--history', help="history.json of the Riddle Processor")
+    parser.add_argument('--riddles', help="riddles_registry.json of the Riddle Processor")
+    args = parser.parse_args()
+
+    store = PlayerStore(args.db)
+    # one transaction, a failing file leaves the database as it was
+    with store.batch():
+        if args.faces:
+            count = store.import_faces(UserProfiles.model_validate_json(read(args.faces)).root)
+            print(f"faces: {count}")
+        if args.preferences:
+            count = store.import_preferences(
+                UserPreferences.model_validate_json(read(args.preferences)).root)
+            print(f"preferences: {count}")
+        if args.history:
+            count = store.import_history(PlayerEntries.model_validate_json(read(args.history)))
+            print(f"conversations: {count}")
+        if args.riddles:
+            count = store.import_riddles(RiddlesRegistry.model_validate_json(read(args.riddles)))
+            print(f"riddles: {count}")
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Latency tracing of the turns across the Riddle Client and the Riddle Processor.
+
+A turn is one exchange between the player and the fish. Its ID travels in the
+models.wire payloads (see `pack`/`turn_of`), so spans recorded by both sides
+can be put next to each other. Spans are measured with the monotonic clock,
+their start is written as wall time for lining up the two machines.
+
+Each span is appended to a JSONL file and counted in a histogram which is
+served in the Prometheus text format.
+"""
+import json
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+# turn the code runs for, copied into tasks and asyncio.to_thread
+current_turn: ContextVar[Optional[str]] = ContextVar("current_turn", default=None)
+
+# upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def new_turn() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+def start_turn(turn: Optional[str] = None) -> str:
+    """Makes turn (a new one when None) the current turn of this task."""
+    turn = turn or new_turn()
+    current_turn.set(turn)
+    return turn
+
+
+class Tracer:
+    def __init__(self, process: str, path: Optional[str] = None, buckets=BUCKETS):
+        """
+        Args:
+            process (str): client or processor, written into every span.
+            path (str, optional): JSONL file the spans are appended to. Default is keeping only the histograms.
+            buckets (optional): Upper bounds of the histogram buckets in seconds. Default is BUCKETS.
+        """
+        self.process = process
+        self.path = path
+        self.buckets = tuple(buckets)
+        # spans are recorded from the loop and from worker threads
+        self.lock = threading.Lock()
+        # line buffered, a span is on disk as soon as it ends
+        self.file = open(path, 'a', encoding='utf-8', buffering=1) if path else None
+        # span name: count per bucket, the last one is +Inf
+        self.counts: Dict[str, List[int]] = {}
+        self.sums: Dict[str, float] = {}
+        self.errors: Dict[str, int] = {}
+
+    @contextmanager
+    def span(self, name: str, turn: Optional[str] = None, **attrs):
+        """
+        Measures the block. Yields attrs, what is added to it is written
+        with the span.
+        """
+        wall = time.time()
+        start = time.perf_counter()
+        try:
+            yield attrs
+        except BaseException as e:
+            attrs["error"] = type(e).__name__
+            raise
+        finally:
+            self.record(name, time.perf_counter() - start, turn=turn, wall=wall, **attrs)
+
+    def record(self, name: str, duration: float, turn: Optional[str] = None,
+               wall: Optional[float] = None, **attrs):
+        if turn is None:
+            turn = current_turn.get()
+        if wall is None:
+            wall = time.time() - duration
+
+        with self.lock:
+            counts = self.counts.get(name)
+            if counts is None:
+                counts = self.counts[name] = [0] * (len(self.buckets) + 1)
+            counts[bisect_left(self.buckets, duration)] += 1
+            self.sums[name] = self.sums.get(name, 0.0) + duration
+            if "error" in attrs:
+                self.errors[name] = self.errors.get(name, 0) + 1
+
+            if self.file is not None:
+                self.file.write(json.dumps({
+                    "turn": turn,
+                    "process": self.process,
+                    "span": name,
+                    "start": round(wall, 6),
+                    "duration": round(duration, 6),
+                    **attrs,
+                }, default=str) + "\n")
+
+    def metrics(self, prefix: str = "fish") -> str:
+        """Histograms of the span durations in the Prometheus text format."""
+        labels = f'process="{self.process}"'
+        lines = [
+            f"# HELP {prefix}_span_seconds Duration of the traced stages of a turn.",
+            f"# TYPE {prefix}_span_seconds histogram",
+        ]
+        with self.lock:
+            for name, counts in self.counts.items():
+                span = f'{labels},span="{name}"'
+                cumulative = 0
+                for le, count in zip(self.buckets, counts):
+                    cumulative += count
+                    lines.append(f'{prefix}_span_seconds_bucket{{{span},le="{le}"}} {cumulative}')
+                cumulative += counts[-1]
+                lines.append(f'{prefix}_span_seconds_bucket{{{span},le="+Inf"}} {cumulative}')
+                lines.append(f'{prefix}_span_seconds_sum{{{span}}} {self.sums[name]:.6f}')
+                lines.append(f'{prefix}_span_seconds_count{{{span}}} {cumulative}')
+
+            lines.append(f"# HELP {prefix}_span_errors_total Traced stages which raised.")
+            lines.append(f"# TYPE {prefix}_span_errors_total counter")
+            for name, count in self.errors.items():
+                lines.append(f'{prefix}_span_errors_total{{{labels},span="{name}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+class NullTracer(Tracer):
+    """Does not keep anything - used when nobody is tracing."""
+
+    def __init__(self):
+        super().__init__("null")
+
+    def span(self, name: str, turn: Optional[str] = None, **attrs):
+        return nullcontext(attrs)
+
+    def record(self, name: str, duration: float, turn: Optional[str] = None,
+               wall: Optional[float] = None, **attrs):
+        pass
@@ -0,0 +1,123 @@
+import json
+from typing import Dict, Optional, Type, TypeVar
+
+from pydantic import BaseModel
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# sent in the Socket.IO auth on connect, clients without it get plain JSON models
+WIRE_VERSION = 2
+
+Model = TypeVar("Model", bound=BaseModel)
+
+
+def _binary_fields(model: BaseModel) -> Dict:
+    """Exclude spec (as in model_dump) of the fields holding bytes, nested models included."""
+    spec = {}
+    for name in type(model).model_fields:
+        value = getattr(model, name)
+        if isinstance(value, bytes):
+            spec[name] = True
+        elif isinstance(value, BaseModel):
+            nested = _binary_fields(value)
+            if nested:
+                spec[name] = nested
+    return spec
+
+
+def _collect(model: BaseModel, spec: Dict, prefix: str = "") -> Dict[str, bytes]:
+    blobs = {}
+    for name, nested in spec.items():
+        value = getattr(model, name)
+        if nested is True:
+            blobs[prefix + name] = value
+        else:
+            blobs.update(_collect(value, nested, f"{prefix}{name}."))
+    return blobs
+
+
+def _placeholders(meta: Dict, path: str):
+    *parents, name = path.split(".")
+    for parent in parents:
+        meta = meta.setdefault(parent, {})
+    # empty base64 validates to b"", the real bytes are set after validation
+    meta[name] = ""
+
+
+def _assign(model: BaseModel, path: str, blob: bytes):
+    *parents, name = path.split(".")
+    for parent in parents:
+        model = getattr(model, parent)
+    setattr(model, name, blob)
+
+
+def pack(model: BaseModel, metadata: str = "json", turn: Optional[str] = None) -> Dict:
+    """
+    Turns a model into a Socket.IO payload: the metadata as compact JSON
+    (or msgpack) and every bytes field as a raw binary attachment, instead
+    of base64 inside the JSON.
+
+    Args:
+        model (BaseModel): What to send.
+        metadata (str, optional): json or msgpack. Default is json.
+        turn (str, optional): Turn ID of models.tracing, sent next to the model. Default is none.
+    """
+    spec = _binary_fields(model)
+    meta = model.model_dump(mode="json", exclude=spec or None)
+
+    if metadata == "msgpack":
+        if msgpack is None:
+            raise ValueError("msgpack metadata requested, but msgpack isn't installed")
+        encoded = msgpack.packb(meta)
+    else:
+        encoded = json.dumps(meta, separators=(",", ":"))
+
+    payload = {"v": WIRE_VERSION, "meta": encoded, "bin": _collect(model, spec)}
+    if turn is not None:
+        payload["turn"] = turn
+    return payload
+
+
+def turn_of(data) -> Optional[str]:
+    """Turn ID of a payload from pack, None for older peers."""
+    if isinstance(data, dict):
+        return data.get("turn")
+    return None
+
+
+def unpack(model_cls: Type[Model], data) -> Model:
+    """Reads a payload from pack, or a model_dump_json string from an older peer."""
+    if isinstance(data, (str, bytes, bytearray)):
+        return model_cls.model_validate_json(data)
+
+    meta = data["meta"]
+    if isinstance(meta, (bytes, bytearray)):
+        if msgpack is None:
+            raise ValueError("msgpack metadata received, but msgpack isn't installed")
+        meta = msgpack.unpackb(meta)
+    else:
+        meta = json.loads(meta)
+
+    blobs = data.get("bin") or {}
+    for path in blobs:
+        _placeholders(meta, path)
+
+    model = model_cls.model_validate(meta)
+    for path, blob in blobs.items():
+        _assign(model, path, bytes(blob))
+    return model
+
+
+def with_binary(model_cls: Type[Model], **fields) -> Model:
+    """
+    Builds a model with raw bytes for its Base64Bytes fields, which would
+    otherwise have to be base64 encoded only to be decoded again.
+    """
+    blobs = {name: value for name, value in fields.items() if isinstance(value, (bytes, bytearray))}
+    model = model_cls.model_validate({**fields, **{name: "" for name in blobs}})
+    for name, blob in blobs.items():
+        setattr(model, name, bytes(blob))
+    return model